@@ -13,7 +13,10 @@ import warnings
 import pickle
 import os
 from datetime import datetime
-from bs4 import BeautifulSoup
+from sp500_journal import CheckpointJournal
+from sp500_macrotrends import capture_grid
+from sp500_tables import grid_cells
+from sp500_universe import load_universe, symbols
 
 # Selenium imports for Edge
 from selenium import webdriver
@@ -31,14 +34,9 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 report = 'cash-flow-statement'
 
 # -------------------------------
-# Get S&P 500 Tickers from Wikipedia
+# S&P 500 Tickers from the local universe snapshot
 # -------------------------------
-wiki_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-wiki_response = requests.get(wiki_url)
-soup_wiki = BeautifulSoup(wiki_response.text, 'html.parser')
-table = soup_wiki.find('table', {'class': "wikitable"})
-sp500 = pd.read_html(str(table))[0]
-tickers = sp500['Symbol'].str.replace('.', '-', regex=False)
+tickers = symbols(load_universe(), "dash")
 
 
 
@@ -153,23 +151,7 @@ def capture_grid_data(grid_container, additional_offset=0):
     Capture the visible grid segment (data rows) and adjust cell keys by adding 
     the current horizontal scroll (additional_offset) so that keys are absolute.
     """
-    html = grid_container.get_attribute("outerHTML")
-    soup = BeautifulSoup(html, "html.parser")
-    data = {}
-    for row in soup.find_all("div", {"role": "row"}):
-        row_id = row.get("id")
-        if not row_id:
-            continue
-        if row_id not in data:
-            data[row_id] = {}
-        for cell in row.find_all("div", {"role": "gridcell"}):
-            style = cell.get("style", "")
-            m = re.search(r'left:\s*(\d+)px', style)
-            left_val = int(m.group(1)) if m else 0
-            key = left_val + additional_offset
-            text = cell.get_text(strip=True)
-            data[row_id][key] = text
-    return data
+    return grid_cells(grid_container.get_attribute("outerHTML"), additional_offset)
 
 def capture_headers():
     """Capture the visible column headers."""
@@ -269,48 +251,48 @@ def capture_all_table_data(driver, grid_container, offset_x=None, max_attempts=1
             break
     return combined_headers, combined_data
 
-    attempt = 0
-    while attempt < max_attempts:
-        attempt += 1
-        current_left = get_thumb_left()
-        try:
-            slider_thumb = driver.find_element(By.ID, "jqxScrollThumbhorizontalScrollBarjqxgrid")
-        except Exception as e:
-            print("Slider thumb not found:", e)
-            break
-        actions.click_and_hold(slider_thumb).move_by_offset(offset_x, 0).release().perform()
-        #time.sleep(1)  # wait for new columns to load
-        new_left = get_thumb_left()
-        # Merge headers from the new segment.
-        combined_headers.update(capture_headers())
-        # Capture grid data from the new segment.
-        current_scroll = driver.execute_script("return arguments[0].scrollLeft;", grid_container)
-        segment = capture_grid_data(grid_container, additional_offset=current_scroll)
-        for row_id, cells in segment.items():
-            if row_id in combined_data:
-                combined_data[row_id].update(cells)
-            else:
-                combined_data[row_id] = cells.copy()
-        if new_left == current_left:
-            break
-    return combined_headers, combined_data
+
+def capture_by_scrolling(driver, grid_container):
+    """
+    Fallback capture for pages without a readable grid data source: scroll the
+    rendered grid and rebuild the table from its cells.
+    """
+    vertical_scroll(grid_container)
+    headers_data, full_data = capture_all_table_data(driver, grid_container, offset_x=150)
+
+    # Merge row data: sort row IDs by numeric part and then order cells by absolute left offset.
+    def extract_row_number(row_id):
+        m = re.search(r'row(\d+)', row_id)
+        return int(m.group(1)) if m else 0
+    sorted_row_ids = sorted(full_data.keys(), key=extract_row_number)
+    final_rows = []
+    for row_id in sorted_row_ids:
+        cell_dict = full_data[row_id]
+        sorted_keys = sorted(cell_dict.keys())
+        row = [cell_dict[k] for k in sorted_keys]
+        final_rows.append(row)
+
+    sorted_headers = [headers_data[k] for k in sorted(headers_data.keys())]
+
+    # Remove empty strings from each row.
+    final_rows = [[item for item in row if item != ''] for row in final_rows]
+
+    # Build DataFrame: if header length matches first row, use headers; otherwise, fallback.
+    if sorted_headers and final_rows and len(sorted_headers) == len(final_rows[0]):
+        return pd.DataFrame(final_rows, columns=sorted_headers)
+    print("Falling back to using first data row as header")
+    return pd.DataFrame(final_rows[1:], columns=final_rows[0])
 
 # -------------------------------
-# Checkpointing with pickle
+# Checkpointing with an append-only journal (one shard per ticker)
 # -------------------------------
-CHECKPOINT_FILE = f"sp500_{report}.pkl"
+CHECKPOINT_DIR = f"sp500_{report}_journal"
 
-if os.path.exists(CHECKPOINT_FILE):
-    with open(CHECKPOINT_FILE, "rb") as f:
-        checkpoint = pickle.load(f)
-    fin_df = checkpoint.get("fin_df", pd.DataFrame())
-    processed_tickers = checkpoint.get("processed_tickers", set())
+journal = CheckpointJournal(CHECKPOINT_DIR)
+processed_tickers = journal.completed()
+count = len(processed_tickers)
+if processed_tickers:
     print(f"Resuming from checkpoint: {len(processed_tickers)} tickers processed.")
-    count = len(processed_tickers)
-else:
-    fin_df = pd.DataFrame()
-    processed_tickers = set()
-    count = 0
 
 
 # -------------------------------
@@ -345,49 +327,25 @@ for ticker in tickers:
         print(f"Skipping {ticker} due to missing grid container.")
         continue
         
-    vertical_scroll(grid_container)
-    headers_data, full_data = capture_all_table_data(driver, grid_container, offset_x=150)
-    
-    # Merge row data: sort row IDs by numeric part and then order cells by absolute left offset.
-    def extract_row_number(row_id):
-        m = re.search(r'row(\d+)', row_id)
-        return int(m.group(1)) if m else 0
-    sorted_row_ids = sorted(full_data.keys(), key=extract_row_number)
-    final_rows = []
-    for row_id in sorted_row_ids:
-        cell_dict = full_data[row_id]
-        sorted_keys = sorted(cell_dict.keys())
-        row = [cell_dict[k] for k in sorted_keys]
-        final_rows.append(row)
-    
-    sorted_headers = [headers_data[k] for k in sorted(headers_data.keys())]
-    #print("Scraped Column Headers for", ticker, ":", sorted_headers)
-    
-    # Remove empty strings from each row.
-    final_rows = [[item for item in row if item != ''] for row in final_rows]
-    
-    # Build DataFrame: if header length matches first row, use headers; otherwise, fallback.
-    if sorted_headers and final_rows and len(sorted_headers) == len(final_rows[0]):
-        df_ticker = pd.DataFrame(final_rows, columns=sorted_headers)
-    else:
-        print("Falling back to using first data row as header for", ticker)
-        df_ticker = pd.DataFrame(final_rows[1:], columns=final_rows[0])
+    # Whole grid in one round-trip (grid API / embedded data); scroll only as a fallback
+    df_ticker = capture_grid(driver)
+    if df_ticker is None:
+        print(f"{ticker}: grid data source not found; capturing by scrolling.")
+        df_ticker = capture_by_scrolling(driver, grid_container)
+    label_col = df_ticker.columns[0]
     df_ticker['Ticker'] = ticker
     
     # Optionally melt the DataFrame into long format.
     try:
-        df_ticker = df_ticker.melt(id_vars=['Ticker', sorted_headers[0]])
+        df_ticker = df_ticker.melt(id_vars=['Ticker', label_col])
     except Exception:
         df_ticker = df_ticker.melt(id_vars=['Ticker'])
     
-    fin_df = pd.concat([fin_df, df_ticker], ignore_index=True)
+    # Save checkpoint after each ticker: only this ticker's rows are written.
+    journal.append(ticker, df_ticker)
     processed_tickers.add(ticker)
-    print(f"{count}: {ticker} processed. Total records so far: {len(fin_df)}")
+    print(f"{count}: {ticker} processed. Total records so far: {journal.total_rows()}")
     count += 1
-    
-    # Save checkpoint after each ticker.
-    with open(CHECKPOINT_FILE, "wb") as f:
-        pickle.dump({"fin_df": fin_df, "processed_tickers": processed_tickers}, f)
 
 driver.quit()
-fin_df.to_csv(f"sp500_{report}.csv", index=False)
+fin_df = journal.compact(csv_path=f"sp500_{report}.csv")
@@ -4,25 +4,17 @@ Created on Fri Feb 21 20:50:34 2025
 
 @author: Pavilion
 """
+import asyncio
 import pandas as pd
-import re
-import time
-import requests
-import warnings
-import pickle
 import os
-from datetime import datetime
-from bs4 import BeautifulSoup
+from sp500_sec import fetch_filing_dates
+from sp500_http import HttpCache
+from sp500_universe import load_universe, symbols
 
 # -------------------------------
-# Get S&P 500 Tickers from Wikipedia
+# S&P 500 Tickers from the local universe snapshot
 # -------------------------------
-wiki_url = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-wiki_response = requests.get(wiki_url)
-soup_wiki = BeautifulSoup(wiki_response.text, 'html.parser')
-table = soup_wiki.find('table', {'class': "wikitable"})
-sp500 = pd.read_html(str(table))[0]
-tickers = sp500['Symbol'].str.replace('.', '-', regex=False)
+tickers = symbols(load_universe(), "dash")
 
 
 def load_cik_mapping(file_path):
@@ -36,55 +28,25 @@ def load_cik_mapping(file_path):
     return cik_dict
 
 
-def get_sec_filing_dates(tickers, cik_dict, form_type="10-Q", count=10):
-
-    if type(tickers) != list:
-        tickers = [tickers]
-
-    merged_df = pd.DataFrame()
-    for ticker in tickers:
-        cik = cik_dict.get(ticker.lower())
-        if not cik:
-            print(f"CIK not found for {ticker}.")
-            return None
-
-        # SEC API to fetch filings
-        sec_url = f"https://data.sec.gov/submissions/CIK{cik}.json"
-        headers = {"User-Agent": "Mozilla/5.0"}
-
-        response = requests.get(sec_url, headers=headers)
-
-        if response.status_code != 200:
-            print(f"Failed to retrieve SEC filings for {ticker}.")
-            return None
-
-        filings_data = response.json()
-
-        # Extract 10-Q filings
-        filings = filings_data.get("filings", {}).get("recent", {})
-
-        # Extract relevant data
-        form_list = list(zip(filings["form"], filings["filingDate"]))
-        ten_q_filings = [f for f in form_list if f[0] == form_type]
-
-        df = pd.DataFrame(ten_q_filings[:count], columns=[
-                          "Form Type", "Filing Date"])
-        df['Ticker'] = ticker
-        merged_df = pd.concat([merged_df, df], axis=0)
-    return merged_df
+def fetch_report_dates(tickers, cik_dict):
+    """
+    10-Q filing dates of all tickers, concurrently and rate-limited to SEC's
+    10 req/s, through the shared on-disk HTTP cache.
+    """
+    cache = HttpCache()
+    dates_df, failures = asyncio.run(fetch_filing_dates(
+        tickers, cik_dict=cik_dict, form_type="10-Q", count=None, cache=cache))
+    cache.report()
+    return dates_df, failures
 
 
 # Load and display the CIK mapping
 # https://www.sec.gov/include/ticker.txt
 cik_dict = load_cik_mapping(file_path="ticker.txt")
-count = 1
 
-dates_df = pd.DataFrame()
-for ticker in tickers:
-    ticker_df = get_sec_filing_dates(
-        ticker, cik_dict=cik_dict, form_type="10-Q", count=None)
-    dates_df = pd.concat([dates_df, ticker_df], axis=0)
-    print(f"{count}: {ticker} processed. Total records so far: {len(dates_df)}")
-    count += 1
+dates_df, failures = fetch_report_dates(tickers, cik_dict)
+print(f"{dates_df['Ticker'].nunique()} tickers processed. Total records: {len(dates_df)}")
+for ticker, reason in sorted(failures.items()):
+    print(f"Failed {ticker}: {reason}")
 
-dates_df.to_csv('report_dates.csv')
+dates_df.to_csv(os.getenv('SP500_REPORT_DATES', 'report_dates.csv'))
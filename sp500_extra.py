@@ -1,77 +1,40 @@
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-import time
-import yfinance as yf
-import missingno as mno
-from datetime import datetime, timedelta
 import warnings
-from io import StringIO
 import os
+from sp500_http import CachedSession
+from sp500_universe import load_universe, symbols
+from sp500_ratelimit import AdaptiveRateLimiter, limited_get, run_grid
+from sp500_tables import read_tables
 
-# Function to handle rate-limiting by checking Retry-After header
-
-
-def handle_rate_limit(response, timeout=20):
-    if 'Retry-After' in response.headers:
-        retry_after = response.headers['Retry-After']
-        try:
-            # Retry-After can be in seconds or as a date
-            wait_time = int(retry_after)  # If it's in seconds
-            print(f"Rate limit hit. Waiting for {wait_time} seconds...")
-            time.sleep(wait_time)
-        except ValueError:
-            # If Retry-After is a date, calculate the time difference
-            retry_time = datetime.strptime(
-                retry_after, '%a, %d %b %Y %H:%M:%S GMT')
-            wait_time = (retry_time - datetime.utcnow()).total_seconds()
-            if wait_time > 0:
-                print(
-                    f"Rate limit hit. Waiting until {retry_time} ({wait_time:.0f} seconds)...")
-                time.sleep(wait_time)
-    else:
-        # Fallback wait time in case Retry-After is not present
-        wait_time = timeout  # Default wait time
-        print(f"Rate limit hit. Waiting for {wait_time} seconds...")
-        time.sleep(wait_time)
-
-# Function to retrieve the data with retry-after handling
-
-
-def fetch_data(url, headers, timeout=20, retries=3):
-    while retries > 0:
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 429:
-                print(f"Rate limit encountered for {url}.")
-                handle_rate_limit(response, timeout)
-                retries -= 1  # Reduce the retry count
-            elif response.status_code == 200:
-                return response.text  # Return the response content if successful
-            else:
-                print(
-                    f"Failed to retrieve data from {url}. Status code: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return None
-    return None  # Return None if all retries are exhausted
+# Macrotrends history pages change at most once per quarter per ticker
+MACROTRENDS_TTL = 7 * 24 * 3600
+http = CachedSession()
+
+# Shared limiter: one 429 (Retry-After) pauses every worker, AIMD tunes rate/concurrency
+limiter = AdaptiveRateLimiter(rate=1.0, max_rate=5.0, max_in_flight=4, default_retry_after=30)
+MAX_WORKERS = 4
+
+# Function to retrieve the data through the cache and the shared rate limiter;
+# errors propagate so that run_grid reports them per (variable, ticker)
+
+
+def fetch_data(url, headers, retries=8):
+    entry = http.cache.lookup(url)
+    if entry is not None and entry["fresh"]:
+        # Served from disk: no request, so no rate-limit slot needed
+        return http.get(url, headers=headers, ttl=MACROTRENDS_TTL).text
+    response = limited_get(http, limiter, url, headers=headers,
+                           max_retries=retries, ttl=MACROTRENDS_TTL)
+    response.raise_for_status()
+    return response.text
 
 
 # Suppress all deprecation warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 
-# List of SP500 companies
-wikiurl = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-response = requests.get(wikiurl)
-
-soup = BeautifulSoup(response.text, 'html.parser')
-sp500 = soup.find('table', {'class': "wikitable"})
-sp500 = pd.read_html(str(sp500))
-sp500 = pd.DataFrame(sp500[0])
-names = sp500['Symbol']
+# List of SP500 companies (local universe snapshot, macrotrends uses BRK.B)
+names = symbols(load_universe(), "dot")
 
 
 # financial data
@@ -92,43 +55,42 @@ headers = {
     'DNT': '1',  # Enable Do Not Track
 }
 
-financial_df = pd.DataFrame()
-
-for var in variables:
-    count = 0
-    for name in names.str.replace('-', '.'):
-        url = f"https://www.macrotrends.net/stocks/charts/{name}/apple/{var}"
-
-        # Fetch data with retry-after handling
-        response_text = fetch_data(url, headers, timeout=30)
-        if response_text:
-            # Process the data if fetched successfully
-            soup = BeautifulSoup(response_text, 'html.parser')
-            ticker_fin = soup.find_all('table', {'class': "table"})
-            if ticker_fin:
-                # Convert the HTML table to a DataFrame
-                html_str = str(ticker_fin)
-                try:
-                    ticker_fin = pd.read_html(StringIO(html_str))[1]
-                except:
-                    ticker_fin = pd.read_html(StringIO(html_str))[0]
-                ticker_fin = pd.DataFrame(ticker_fin)
-                ticker_fin.columns = ['Date', 'Amount']
-
-                # Add extra columns for the variable and company name
-                ticker_fin['Variable'] = var
-                ticker_fin['COMPANY'] = name
-
-                # Concatenate the result with the main DataFrame
-                financial_df = pd.concat(
-                    [financial_df, ticker_fin], ignore_index=True)
-                print(
-                    f"{count}: {name} is done. Total number of records: {len(financial_df)}")
-            else:
-                print(f"No table found for {name} and {var}")
-        else:
-            print(f"Skipping {name} due to failure in retrieving data.")
-
-        count += 1
-
-    financial_df.to_csv('sp500_extra.csv')
+
+
+def fetch_table(task):
+    """
+    Fetch and parse one (variable, ticker) macrotrends page. A failed request
+    or a page without a table raises, and run_grid records it as a failure.
+    """
+    var, name = task
+    url = f"https://www.macrotrends.net/stocks/charts/{name}/apple/{var}"
+
+    # Fetch data with retry-after handling
+    response_text = fetch_data(url, headers)
+    tables = read_tables(response_text, css_class="table")
+
+    # Quarterly history is the second table when the page has both
+    ticker_fin = tables[1] if len(tables) > 1 else tables[0]
+    ticker_fin.columns = ['Date', 'Amount']
+
+    # Add extra columns for the variable and company name
+    ticker_fin['Variable'] = var
+    ticker_fin['COMPANY'] = name
+    print(f"{name} {var} is done: {len(ticker_fin)} records")
+    return ticker_fin
+
+
+# The whole (variable, ticker) grid runs concurrently under the shared limiter
+tasks = [(var, name) for var in variables for name in names]
+results, failures = run_grid(tasks, fetch_table, workers=MAX_WORKERS)
+for task, error in failures.items():
+    print(f"Failed {task}: {error}")
+
+# Concatenate once, in the original variable/ticker order
+frames = [results[t] for t in tasks if results.get(t) is not None]
+financial_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+financial_df.to_csv(os.getenv('SP500_EXTRA', 'sp500_extra.csv'))
+print(f"Total number of records: {len(financial_df)}")
+
+limiter.report()
+http.cache.report()
@@ -1,20 +1,28 @@
 # -*- coding: utf-8 -*-
 """
 S&P 500 financials scraper with robust resume:
-- state_pkl includes {timestamp}
+- state_dir includes {timestamp}
+- append-only checkpoint journal: one shard per completed (ticker, report)
 - success-only advancement of report_idx/counter
 - auto-restart WebDriver on 'invalid session id'
+- browserless HTTP fetch of the quarterly tables (Selenium kept as fallback)
 """
 
 import os
 import time
-import pickle
 import warnings
-from io import StringIO
 from datetime import datetime
 import ctypes
 import pandas as pd
 from getpass import getpass
+from sp500_journal import CheckpointJournal
+from sp500_universe import load_universe, symbols
+from sp500_stockanalysis import (
+    fetch_quarterly_table,
+    parse_main_table,
+    session_from_driver,
+    table_to_long,
+)
 
 # Selenium imports for Edge
 from selenium import webdriver
@@ -41,13 +49,13 @@ EMAIL = os.getenv("APP_EMAIL") or input("Email: ")
 PASSWORD = os.getenv("APP_PASSWORD") or getpass("Password: ")
 
 run_stamp = datetime.now().strftime("%d%m%Y")  # {timestamp}
-names_csv = os.path.join(DATA_DIR, f"sp500_names_{run_stamp}.csv")
-state_pkl = os.path.join(DATA_DIR, f"sp500_financials_state_{run_stamp}.pkl")   # timestamped
-final_csv = os.path.join(DATA_DIR, f"sp500_financials_{run_stamp}.csv")
+state_dir = os.path.join(DATA_DIR, f"sp500_financials_state_{run_stamp}")   # timestamped journal
+final_csv = os.getenv("SP500_FINANCIALS", os.path.join(DATA_DIR, f"sp500_financials_{run_stamp}.csv"))
 
 edge_driver_path = r"C:\Users\Dell\Downloads\msedgedriver.exe"
 page_wait_seconds = 20
 max_retries = 3
+use_http = True  # fetch tables over plain HTTP with the browser's cookies
 
 ctypes.windll.kernel32.SetThreadExecutionState(0x80000000 | 0x00000001) # tell Windows to stay awake
 
@@ -66,18 +74,17 @@ def init_driver():
     w = WebDriverWait(drv, page_wait_seconds)
     return drv, w
 
-def save_state(df, counter, report_idx, last_ticker, completed_pairs):
-    tmp_path = state_pkl + ".tmp"
+def save_state(counter, report_idx, last_ticker, key=None, rows=None):
+    # O(1) per save: only the rows of the (ticker, report) just completed are written
     state = {
-        "df": df,
         "counter": int(counter),
         "report_idx": int(report_idx),
         "last_ticker": last_ticker,
-        "completed_pairs": list(completed_pairs),
     }
-    with open(tmp_path, "wb") as f:
-        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
-    os.replace(tmp_path, state_pkl)
+    if rows is not None:
+        journal.append(list(key), rows, **state)
+    else:
+        journal.save_state(**state)
     rpt_name = reports[report_idx] if 0 <= report_idx < len(reports) else "done"
     print(f"[STATE SAVED] counter={counter}, ticker={last_ticker}, report_idx={report_idx} ({rpt_name})")
 
@@ -87,20 +94,18 @@ def is_invalid_session(e: Exception) -> bool:
 # -------------------------------
 # Load tickers
 # -------------------------------
-sp500_names = pd.read_csv(names_csv)
-tickers = sp500_names["Symbol"].astype(str).tolist()
+tickers = symbols(load_universe(), "wiki")
 
 # -------------------------------
 # Load or init state
 # -------------------------------
-if os.path.exists(state_pkl):
-    with open(state_pkl, "rb") as f:
-        state = pickle.load(f)
-    df = state.get("df", pd.DataFrame())
+journal = CheckpointJournal(state_dir)
+if journal.records:
+    state = journal.state()
     saved_counter = int(state.get("counter", 0))
     report_idx = int(state.get("report_idx", 0))
     last_ticker = state.get("last_ticker", tickers[saved_counter] if saved_counter < len(tickers) else None)
-    completed_pairs = set(state.get("completed_pairs", []))
+    completed_pairs = journal.completed()
 
     # Recompute counter from last_ticker if possible to avoid order mismatches
     if last_ticker in tickers:
@@ -111,7 +116,6 @@ if os.path.exists(state_pkl):
 
     print(f"Resuming from ticker index {counter} ({last_ticker}), report index {report_idx}.")
 else:
-    df = pd.DataFrame()
     counter = 0
     report_idx = 0
     last_ticker = tickers[0] if tickers else None
@@ -154,6 +158,10 @@ email.send_keys(EMAIL)
 password_box = driver.find_element(By.XPATH, "/html/body/div/div[1]/div[2]/main/div/form/input[2]")
 password_box.send_keys(PASSWORD)
 password_box.send_keys(Keys.RETURN)
+time.sleep(3)
+
+# Reuse the logged-in cookies for browserless table fetches
+http_session = session_from_driver(driver) if use_http else None
 
 # -------------------------------
 # Main scraping loop
@@ -182,53 +190,52 @@ try:
             success = False
             while attempt <= max_retries and not success:
                 try:
-                    driver.get(url)
-                    # Cookie banner 
-                    time.sleep(0.5)
-                    try:
-                        btn = driver.find_element(
-                            By.XPATH,
-                            "/html/body/div[2]/div[2]/div[2]/div[2]/div[2]/button[1]/p",
-                        )
-                        btn.click()
-                    except NoSuchElementException:
-                        pass
-                    except Exception:
-                        pass
-
-                    # Switch to "Quarters"
-                    quarters_btn = wait.until(
-                        EC.element_to_be_clickable(
-                            (By.XPATH, "/html/body/div/div[1]/div[2]/main/div[2]/nav[2]/ul/li[2]/button")
-                        )
-                    )
-                    quarters_btn.click()
-                    time.sleep(3)
+                    ticker_df = None
+                    if http_session is not None:
+                        try:
+                            ticker_df = fetch_quarterly_table(http_session, ticker, report)
+                        except Exception as e:
+                            print(f"HTTP fetch failed for {ticker} {report} ({e}); using browser")
+
+                    if ticker_df is None:
+                        driver.get(url)
+                        # Cookie banner 
+                        time.sleep(0.5)
+                        try:
+                            btn = driver.find_element(
+                                By.XPATH,
+                                "/html/body/div[2]/div[2]/div[2]/div[2]/div[2]/button[1]/p",
+                            )
+                            btn.click()
+                        except NoSuchElementException:
+                            pass
+                        except Exception:
+                            pass
 
-                    # Read table
-                    table_elem = driver.find_element(By.XPATH, '//*[@id="main-table"]')
-                    table_html = table_elem.get_attribute("outerHTML")
+                        # Switch to "Quarters"
+                        quarters_btn = wait.until(
+                            EC.element_to_be_clickable(
+                                (By.XPATH, "/html/body/div/div[1]/div[2]/main/div[2]/nav[2]/ul/li[2]/button")
+                            )
+                        )
+                        quarters_btn.click()
+                        time.sleep(3)
 
-                    buffer = StringIO(table_html)
-                    ticker_df = pd.read_html(buffer)[0]
-                    ticker_df.set_index(ticker_df.columns[0], inplace=True)
+                        # Read table
+                        table_elem = driver.find_element(By.XPATH, '//*[@id="main-table"]')
+                        table_html = table_elem.get_attribute("outerHTML")
+                        ticker_df = parse_main_table(table_html)
 
                     # Long format
-                    long = ticker_df.stack(level=[0, 1], future_stack=True).reset_index(name="Value")
-                    long.columns = ["Metric", "Fiscal Quarter", "Period Ending", "Value"]
-                    long = long[long["Value"] != "Upgrade"]
-                    long["Ticker"] = ticker
+                    long = table_to_long(ticker_df, ticker)
 
-                    # Append to in-memory df (as in your original approach)
-                    df = pd.concat([df, long], ignore_index=True)
                     completed_pairs.add(key)
 
-                    print(f"SUCCESS: {ticker} {report} | rows_added={len(long)} | total_rows={len(df)}")
-
-                    # SUCCESS ONLY: advance report index and save
+                    # SUCCESS ONLY: advance report index and journal this page's rows
                     r += 1
                     report_idx = r  # next report to attempt for this ticker
-                    save_state(df, counter, report_idx, ticker, completed_pairs)
+                    save_state(counter, report_idx, ticker, key=key, rows=long)
+                    print(f"SUCCESS: {ticker} {report} | rows_added={len(long)} | total_rows={journal.total_rows()}")
                     success = True
 
                 except (TimeoutException, NoSuchElementException) as e:
@@ -240,7 +247,7 @@ try:
                         # Move to next ticker; do not mark current report as done
                         report_idx = 0
                         counter += 1
-                        save_state(df, counter, report_idx, ticker, completed_pairs)
+                        save_state(counter, report_idx, ticker)
                         break  # break retry loop -> proceed to next ticker
 
                 except WebDriverException as e:
@@ -261,7 +268,7 @@ try:
                         print(f"WebDriverException on {ticker} {report}: {e}")
                         report_idx = 0
                         counter += 1
-                        save_state(df, counter, report_idx, ticker, completed_pairs)
+                        save_state(counter, report_idx, ticker)
                         break  # proceed to next ticker
 
                 except Exception as e:
@@ -273,7 +280,7 @@ try:
                         print(f"Skipping ticker due to repeated errors: {ticker}")
                         report_idx = 0
                         counter += 1
-                        save_state(df, counter, report_idx, ticker, completed_pairs)
+                        save_state(counter, report_idx, ticker)
                         break
 
             # If we gave up the ticker inside retry loop, break out of report loop
@@ -285,15 +292,15 @@ try:
         if r >= len(reports) and tickers[counter] == ticker:
             report_idx = 0
             counter += 1
-            save_state(df, counter, report_idx, ticker, completed_pairs)
+            save_state(counter, report_idx, ticker)
 
 except Exception as e:
     print(f"Unexpected error: {e}")
 
 finally:
-    # Final CSV export (as in your original)
+    # Final CSV export: compact the journal shards once
     try:
-        df.to_csv(final_csv, index=False)
+        df = journal.compact(csv_path=final_csv)
         print(f"Final CSV saved to: {final_csv}")
     except Exception as e:
         print(f"Failed to save final CSV: {e}")
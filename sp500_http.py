@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Shared on-disk HTTP response cache.
+
+Bodies are stored content-addressed (objects/<sha256[:2]>/<sha256>), so the
+same page under two URLs is kept once; a small SQLite index maps each URL to
+its body, validators (ETag / Last-Modified), fetch time, TTL and last access.
+
+- fresh entry (younger than its TTL): served from disk, no request;
+- stale entry: revalidated with If-None-Match / If-Modified-Since, and a
+  304 only refreshes the timestamp;
+- a body replaced under its URL is deleted once no URL references it;
+- the store is kept under max_bytes by evicting least-recently-used entries.
+  The byte count is of the blobs actually on disk: it is taken when the
+  cache is opened (unreferenced blobs and temp files are removed then) and
+  updated on every write and delete.
+
+CachedSession wraps requests for the synchronous scrapers; HttpCache's
+lookup/store methods are transport-agnostic so the aiohttp SEC fetcher uses
+the same store. Hit/miss counters are printed with report().
+
+Run this file to check freshness, revalidation, replacement and eviction
+against a local server.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = os.getenv("SP500_HTTP_CACHE", "http_cache")
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+DEFAULT_TTL = 24 * 3600  # seconds
+
+# Response headers worth keeping with the body
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+class HttpCache:
+    """Content-addressed response store with TTLs, validators and LRU eviction."""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES, default_ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " url TEXT PRIMARY KEY, digest TEXT, size INTEGER, headers TEXT,"
+            " fetched_at REAL, ttl REAL, accessed_at REAL)")
+        self.db.commit()
+        self.total_bytes = self._scan_objects()
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest)
+
+    def _scan_objects(self):
+        """Bytes of the referenced blobs on disk; unreferenced blobs and temp files are removed."""
+        referenced = {d for (d,) in self.db.execute("SELECT DISTINCT digest FROM entries")}
+        total = 0
+        for sub in os.scandir(os.path.join(self.cache_dir, "objects")):
+            if not sub.is_dir():
+                continue
+            for blob in os.scandir(sub.path):
+                if blob.name in referenced:
+                    total += blob.stat().st_size
+                else:
+                    os.remove(blob.path)
+        return total
+
+    def _release(self, digest):
+        """Delete a blob no entry references any more (call with the lock held)."""
+        if self.db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        path = self._object_path(digest)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.total_bytes -= size
+
+    def lookup(self, url):
+        """Entry dict for url (with 'fresh' flag and 'headers'), or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest, size, headers, fetched_at, ttl FROM entries WHERE url = ?",
+                (url,)).fetchone()
+        if row is None or not os.path.exists(self._object_path(row[0])):
+            return None
+        digest, size, headers, fetched_at, ttl = row
+        return {"url": url, "digest": digest, "size": size,
+                "headers": json.loads(headers), "fetched_at": fetched_at, "ttl": ttl,
+                "fresh": time.time() - fetched_at < ttl}
+
+    def validators(self, entry):
+        """Conditional request headers for a stale entry."""
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def read(self, entry, revalidated=False):
+        """Body of an entry; counts a hit (or revalidation) and bumps LRU order."""
+        now = time.time()
+        with self.lock:
+            if revalidated:
+                self.db.execute("UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                                (now, now, entry["url"]))
+            else:
+                self.db.execute("UPDATE entries SET accessed_at = ? WHERE url = ?", (now, entry["url"]))
+            self.db.commit()
+        self.stats["revalidated" if revalidated else "hits"] += 1
+        with open(self._object_path(entry["digest"]), "rb") as f:
+            return f.read()
+
+    def store(self, url, body, headers, ttl=None):
+        """Save a 200 response body and its validators; counts a miss."""
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._object_path(digest)
+        kept = {k: headers[k] for k in _KEPT_HEADERS if headers.get(k)}
+        now = time.time()
+        with self.lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, path)
+                self.total_bytes += len(body)
+            old = self.db.execute("SELECT digest FROM entries WHERE url = ?", (url,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, digest, len(body), json.dumps(kept), now,
+                 self.default_ttl if ttl is None else ttl, now))
+            self.db.commit()
+            if old is not None and old[0] != digest:
+                self._release(old[0])
+        self.stats["misses"] += 1
+        self._evict()
+
+    def _evict(self):
+        """Drop least-recently-used entries until the store fits max_bytes."""
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+            for url, digest in self.db.execute(
+                    "SELECT url, digest FROM entries ORDER BY accessed_at").fetchall():
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._release(digest)
+                self.stats["evicted"] += 1
+            self.db.commit()
+
+    def report(self):
+        s = self.stats
+        print(f"HTTP cache: hits={s['hits']}, revalidated={s['revalidated']}, "
+              f"misses={s['misses']}, evicted={s['evicted']}")
+
+
+def _cached_response(url, body, headers):
+    """Build a requests.Response from cached content so callers see no difference."""
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.headers = CaseInsensitiveDict(headers)
+    response.url = url
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+    return response
+
+
+class CachedSession:
+    """
+    requests.Session-like GET through an HttpCache.
+
+    Only 200 responses are cached; anything else (429, 404, ...) is returned
+    as-is so callers' retry logic keeps working.
+    """
+
+    def __init__(self, cache=None, session=None):
+        self.cache = cache or HttpCache()
+        self.session = session or requests.Session()
+
+    def get(self, url, headers=None, ttl=None, **kwargs):
+        entry = self.cache.lookup(url)
+        if entry is not None and entry["fresh"]:
+            return _cached_response(url, self.cache.read(entry), entry["headers"])
+
+        req_headers = dict(headers or {})
+        if entry is not None:
+            req_headers.update(self.cache.validators(entry))
+        response = self.session.get(url, headers=req_headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            return _cached_response(url, self.cache.read(entry, revalidated=True), entry["headers"])
+        if response.status_code == 200:
+            self.cache.store(url, response.content, response.headers, ttl=ttl)
+        return response
+
+
+if __name__ == "__main__":
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    pages = {"/a": b"A" * 1000, "/b": b"B" * 1000, "/c": b"C" * 1000, "/same": b"A" * 1000}
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pages[self.path]
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            seen.append((self.path, self.headers.get("If-None-Match")))
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    def blobs(cache):
+        root = os.path.join(cache.cache_dir, "objects")
+        return sorted(f for d in os.listdir(root) for f in os.listdir(os.path.join(root, d)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = HttpCache(tmp, max_bytes=2500)
+        session = CachedSession(cache)
+
+        # Miss, then fresh hit without a request
+        assert session.get(base + "/a").content == pages["/a"]
+        assert session.get(base + "/a").content == pages["/a"]
+        assert len(seen) == 1 and cache.stats["misses"] == 1 and cache.stats["hits"] == 1
+
+        # Stale entry: revalidated with its ETag, 304 serves the cached body
+        session.get(base + "/b", ttl=0)
+        assert session.get(base + "/b", ttl=0).content == pages["/b"]
+        assert seen[-1] == ("/b", cache.lookup(base + "/b")["headers"]["ETag"])
+        assert cache.stats["revalidated"] == 1
+
+        # Same body under another URL is stored once
+        session.get(base + "/same")
+        assert len(blobs(cache)) == 2 and cache.total_bytes == 2000
+
+        # New body under a URL: the replaced blob is deleted
+        pages["/b"] = b"b" * 800
+        assert session.get(base + "/b").content == pages["/b"]
+        assert blobs(cache) == sorted(hashlib.sha256(pages[p]).hexdigest() for p in ("/a", "/b"))
+        assert cache.total_bytes == 1800
+
+        # Over max_bytes: least recently used entries go first ("/a" and "/same" share a blob)
+        time.sleep(0.01)
+        session.get(base + "/b")
+        time.sleep(0.01)
+        session.get(base + "/c")
+        assert cache.lookup(base + "/a") is None and cache.lookup(base + "/same") is None
+        assert cache.lookup(base + "/b") is not None and cache.lookup(base + "/c") is not None
+        assert cache.total_bytes == 1800 <= cache.max_bytes
+        assert cache.total_bytes == sum(
+            os.path.getsize(cache._object_path(d)) for d in blobs(cache))
+
+        # Unreferenced blobs (e.g. left by a crash) are removed when the cache is opened
+        stray = cache._object_path("0" * 64)
+        os.makedirs(os.path.dirname(stray), exist_ok=True)
+        with open(stray, "wb") as f:
+            f.write(b"x" * 5000)
+        cache.db.close()
+        reopened = HttpCache(tmp, max_bytes=2500)
+        assert not os.path.exists(stray) and reopened.total_bytes == 1800
+        reopened.db.close()
+    httpd.shutdown()
+    print("HttpCache: fresh hits, 304 revalidation, replaced bodies deleted, "
+          "LRU eviction by on-disk bytes, stray blobs removed on open")
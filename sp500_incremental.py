@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental merge: recompute only the ticker-quarters whose inputs changed.
+
+State is kept in a directory next to the merged output (SP500_MERGE_STATE):
+    levels.parquet       quarter rows before the pct diffs, including the
+                         first rows of each ticker that the output drops
+    diff.parquet         the persisted output
+    financials.parquet   one hash per (Ticker, Date) of the parsed financial rows
+    inputs.json          per-ticker price/universe fingerprints and the code hash
+
+A run hashes the inputs per (Ticker, quarter) and per ticker, compares them
+with the state and rebuilds the quarter rows of the affected tickers only
+(indicators need each ticker's full price history). Rows whose values
+changed, together with the rows whose lag-1/lag-4 pct diffs read them, are
+then upserted into the persisted output; rows that disappeared are removed.
+
+Run this file for the check that an upsert reproduces a full rebuild and
+that appended price bars only rebuild the tickers whose quarters read them.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from sp500_store import append_prices, partition_files, read_prices, write_prices
+
+KEY = ["Ticker", "Date"]
+LAGS = (1, 4)
+PRICE_COLUMNS = ["Company", "Date", "Close", "Volume", "Dividends"]
+UNIVERSE_COLUMNS = ["Symbol", "GICS Sector", "GICS Sub-Industry", "Founded"]
+
+
+def frame_hashes(df, keys, columns):
+    """
+    One uint64 hash per key over the rows of `columns` (row order included).
+
+    Returns:
+        pd.Series: Hashes indexed by the key columns.
+    """
+    if df.empty:
+        return pd.Series([], dtype=np.uint64,
+                         index=pd.MultiIndex.from_arrays([[]] * len(keys), names=keys))
+    key_frame = df[keys].astype(str)
+    position = key_frame.groupby(keys, sort=False).cumcount()
+    rows = df[columns].assign(_position=position.to_numpy())
+    hashes = pd.util.hash_pandas_object(rows, index=False).to_numpy()
+    # uint64 sums wrap around, which is fine for a fingerprint
+    return pd.Series(hashes).groupby([key_frame[k].to_numpy() for k in keys]).sum() \
+        .rename_axis(keys)
+
+
+def financial_hashes(financials_fiscal):
+    """Hash per (Ticker, Date) of the parsed long financials."""
+    df = financials_fiscal.dropna(subset=KEY)
+    df = df.assign(Date=df["Date"].dt.strftime("%Y-%m-%d"))
+    return frame_hashes(df, KEY, ["Variable", "Value"])
+
+
+def universe_hashes(names):
+    """Hash per Symbol of the universe columns copied into the output."""
+    return frame_hashes(names, ["Symbol"], UNIVERSE_COLUMNS)
+
+
+def last_targets(financials_fiscal):
+    """Last quarter Date per Ticker of the parsed long financials ('YYYY-MM-DD')."""
+    df = financials_fiscal.dropna(subset=KEY)
+    last = df.groupby(df["Ticker"].astype(str))["Date"].max()
+    return last.dt.strftime("%Y-%m-%d").to_dict()
+
+
+def price_fingerprints(store_dir, tickers, targets, previous=None, prices=None):
+    """
+    Per-ticker price fingerprints: the partition's file listing plus a hash
+    of the bars up to the ticker's last quarter target.
+
+    A quarter row only reads bars on or before its target day, so bars
+    appended after the last target leave the hash alone. Whether the history
+    reaches that day is kept too: calendar targets past the last bar are not
+    computed, and the first bar beyond them adds the row. Data is read only
+    for tickers whose file listing or last target changed.
+
+    Args:
+        store_dir (str): Parquet price store.
+        tickers (list): Tickers the merge reads.
+        targets (dict): last_targets() of this run; tickers without one have
+            no quarter rows, whatever their prices.
+        previous (dict, optional): Fingerprints from the last run.
+        prices (pd.DataFrame, optional): PRICE_COLUMNS of all `tickers`, already
+            loaded (full runs); hashed instead of reading the store again.
+
+    Returns:
+        dict: {ticker: {"files": str, "until": str, "covered": bool, "data": str}}
+    """
+    previous = previous or {}
+    files = partition_files(store_dir)
+    out, to_read = {}, []
+    for ticker in tickers:
+        if ticker not in files:
+            continue
+        sig = hashlib.sha256(repr(files[ticker]).encode()).hexdigest()
+        until = targets.get(ticker)
+        old = previous.get(ticker)
+        if until is None:
+            out[ticker] = {"files": sig, "until": None, "covered": False, "data": ""}
+        elif prices is None and old is not None and old["files"] == sig \
+                and old.get("until") == until:
+            out[ticker] = old
+        else:
+            out[ticker] = {"files": sig, "until": until, "covered": False, "data": None}
+            to_read.append(ticker)
+    if to_read:
+        if prices is None:
+            prices = read_prices(store_dir, tickers=to_read, columns=PRICE_COLUMNS)
+        prices = prices[PRICE_COLUMNS].assign(Company=prices["Company"].astype(str))
+        prices = prices[prices["Company"].isin(to_read)]
+        until = pd.to_datetime(prices["Company"].map(targets))
+        last = prices.groupby("Company")["Date"].max()
+        prefix = prices[(prices["Date"] <= until).to_numpy()]
+        data = frame_hashes(prefix, ["Company"], PRICE_COLUMNS[1:])
+        for ticker in to_read:
+            fp = out[ticker]
+            fp["covered"] = bool(last.get(ticker, pd.NaT) >= pd.Timestamp(fp["until"]))
+            fp["data"] = str(data.get(ticker, ""))
+    return out
+
+
+def changed_keys(old, new):
+    """Keys of two hash Series whose hashes differ or exist on one side only."""
+    both = pd.concat([old.rename("old"), new.rename("new")], axis=1)
+    return both.index[~(both["old"] == both["new"])]
+
+
+def _price_inputs(fingerprint):
+    """What the quarter rows read from a price fingerprint (not the file listing)."""
+    fingerprint = fingerprint or {}
+    return fingerprint.get("until"), fingerprint.get("covered"), fingerprint.get("data")
+
+
+def changed_tickers(state, financials, universe, prices, symbol_to_ticker):
+    """
+    Tickers whose quarter rows must be rebuilt.
+
+    Args:
+        state (dict): Output of load_state().
+        financials (pd.Series): financial_hashes() of this run.
+        universe (pd.Series): universe_hashes() of this run.
+        prices (dict): price_fingerprints() of this run.
+        symbol_to_ticker (dict): Universe Symbol -> price ticker.
+
+    Returns:
+        tuple: (set of tickers, dict with the number of changed keys per input)
+    """
+    fin_keys = changed_keys(state["financials"], financials)
+    uni_keys = changed_keys(state["universe"], universe)
+    old_prices = state["prices"]
+    price_tickers = {t for t in set(old_prices) | set(prices)
+                     if _price_inputs(old_prices.get(t)) != _price_inputs(prices.get(t))}
+    tickers = set(fin_keys.get_level_values("Ticker")) | price_tickers
+    for symbol in uni_keys.get_level_values("Symbol"):
+        tickers |= {symbol, symbol_to_ticker.get(symbol, symbol)}
+    counts = {"financial ticker-quarters": len(fin_keys), "price tickers": len(price_tickers),
+              "universe rows": len(uni_keys)}
+    return tickers, counts
+
+
+def _same(a, b):
+    """Element-wise equality that treats NaN == NaN."""
+    a, b = np.asarray(a), np.asarray(b)
+    return np.asarray(a == b, dtype=bool) | (pd.isna(a) & pd.isna(b))
+
+
+def affected_rows(old_levels, new_levels, lags=LAGS):
+    """
+    Rows of `new_levels` whose pct diffs may differ from the last run.
+
+    A row is affected when it is new or its values changed, when a row it
+    reads through a lag changed, or when the row at that lag is a different
+    quarter than before (a quarter was inserted or removed before it).
+
+    Args:
+        old_levels (pd.DataFrame): Previous quarter rows of the rebuilt tickers.
+        new_levels (pd.DataFrame): Rebuilt quarter rows, same columns, sorted by KEY.
+        lags (tuple): Lags of the pct diffs.
+
+    Returns:
+        tuple: (affected keys, removed keys), both DataFrames with KEY columns.
+    """
+    old = old_levels.set_index(KEY)
+    new = new_levels.set_index(KEY)
+    common = new.index.intersection(old.index)
+    same = pd.Series(False, index=new.index)
+    if len(common):
+        a, b = new.loc[common], old.loc[common, new.columns]
+        same.loc[common] = np.logical_and.reduce(
+            [_same(a[c].to_numpy(), b[c].to_numpy()) for c in new.columns])
+    changed = ~same.to_numpy()
+
+    affected = changed.copy()
+    new_keys = new_levels[KEY].reset_index(drop=True)
+    old_keys = old_levels[KEY].reset_index(drop=True)
+    by_new = new_keys.groupby("Ticker", sort=False)
+    by_old = old_keys.groupby("Ticker", sort=False)
+    changed_s = pd.Series(changed.astype(np.int8))
+    for lag in lags:
+        lag_changed = changed_s.groupby(new_keys["Ticker"], sort=False).shift(lag)
+        affected |= (lag_changed == 1).to_numpy()
+        new_lag = new_keys.assign(Lag=by_new["Date"].shift(lag))
+        old_lag = old_keys.assign(Lag=by_old["Date"].shift(lag))
+        lag_before = new_lag.merge(old_lag, on=KEY, how="left", suffixes=("", "_old"))
+        affected |= ~_same(lag_before["Lag"].to_numpy(), lag_before["Lag_old"].to_numpy())
+
+    removed = old_keys.merge(new_keys, on=KEY, how="left", indicator=True)
+    removed = removed.loc[removed["_merge"] == "left_only", KEY].reset_index(drop=True)
+    return new_keys[affected].reset_index(drop=True), removed
+
+
+def _drop_keys(df, keys):
+    if keys.empty:
+        return df
+    hit = pd.MultiIndex.from_frame(df[KEY]).isin(pd.MultiIndex.from_frame(keys[KEY]))
+    return df[~hit]
+
+
+def replace_tickers(levels, new_levels, tickers):
+    """Quarter rows with those of `tickers` replaced, sorted by KEY."""
+    kept = levels[~levels["Ticker"].isin(tickers)]
+    out = pd.concat([kept, new_levels], ignore_index=True)
+    return out.sort_values(KEY, kind="mergesort").reset_index(drop=True)
+
+
+def upsert(diff, rows, drop, levels):
+    """
+    Replace the rows of `drop` in the persisted output by `rows`.
+
+    The output index is the row's position in `levels`, as in a full merge.
+
+    Args:
+        diff (pd.DataFrame): Persisted output.
+        rows (pd.DataFrame): Recomputed output rows (same columns).
+        drop (pd.DataFrame): KEY rows to remove (recomputed and removed keys).
+        levels (pd.DataFrame): Updated quarter rows (position = output index).
+    """
+    out = pd.concat([_drop_keys(diff, drop), rows[diff.columns]])
+    out = out.sort_values(KEY, kind="mergesort")
+    position = pd.Series(np.arange(len(levels)), index=pd.MultiIndex.from_frame(levels[KEY]))
+    out.index = position.reindex(pd.MultiIndex.from_frame(out[KEY])).to_numpy()
+    return out
+
+
+def code_fingerprint(paths):
+    """Hash of the merge code; a change forces a full rebuild."""
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _hashes_to_frame(hashes):
+    return hashes.rename("hash").reset_index()
+
+
+def _hashes_from_frame(df, keys):
+    return df.set_index(keys)["hash"].astype(np.uint64)
+
+
+def load_state(state_dir, code):
+    """
+    Previous run's state, or None when there is none or it cannot be used
+    (other code version, missing or inconsistent files).
+    """
+    inputs_path = os.path.join(state_dir, "inputs.json")
+    if not os.path.exists(inputs_path):
+        return None
+    with open(inputs_path, "r", encoding="utf-8") as f:
+        inputs = json.load(f)
+    if inputs.get("code") != code:
+        return None
+    try:
+        levels = pd.read_parquet(os.path.join(state_dir, "levels.parquet"))
+        diff = pd.read_parquet(os.path.join(state_dir, "diff.parquet"))
+        financials = pd.read_parquet(os.path.join(state_dir, "financials.parquet"))
+    except (OSError, ValueError):
+        return None
+    if len(levels) != inputs["rows"]["levels"] or len(diff) != inputs["rows"]["diff"]:
+        return None
+    universe = pd.DataFrame(inputs["universe"], columns=["Symbol", "hash"])
+    return {
+        "levels": levels,
+        "diff": diff,
+        "financials": _hashes_from_frame(financials, KEY),
+        "universe": _hashes_from_frame(universe.astype({"hash": np.uint64}), ["Symbol"]),
+        "prices": inputs["prices"],
+    }
+
+
+def _replace(path, write):
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_state(state_dir, code, levels, diff, financials, universe, prices):
+    """Write the state; inputs.json goes last and records the row counts it expects."""
+    os.makedirs(state_dir, exist_ok=True)
+    _replace(os.path.join(state_dir, "levels.parquet"), lambda p: levels.to_parquet(p))
+    _replace(os.path.join(state_dir, "diff.parquet"), lambda p: diff.to_parquet(p))
+    _replace(os.path.join(state_dir, "financials.parquet"),
+             lambda p: _hashes_to_frame(financials).to_parquet(p))
+    inputs = {
+        "code": code,
+        "rows": {"levels": len(levels), "diff": len(diff)},
+        "universe": [[s, str(h)] for s, h in universe.items()],
+        "prices": prices,
+    }
+
+    def write_inputs(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(inputs, f)
+    _replace(os.path.join(state_dir, "inputs.json"), write_inputs)
+
+
+def _pct_diff(levels, lags=LAGS):
+    """Stand-in for the merge's pct-diff step (same drop rule) for the self-check."""
+    df = levels.sort_values(KEY).copy()
+    numeric = df.select_dtypes(include=[np.number]).columns
+    new_cols = {f"{c}_pct_diff_{lag}": df.groupby("Ticker")[c].pct_change(periods=lag)
+                for c in numeric for lag in lags}
+    df = pd.concat([df, pd.DataFrame(new_cols, index=df.index)], axis=1)
+    return df.dropna(subset=[f"Close_pct_diff_{lag}" for lag in lags]).fillna(0)
+
+
+def _synthetic_levels(n_tickers=30, n_quarters=24, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2015-03-31", periods=n_quarters, freq="QE").strftime("%Y-%m-%d")
+    df = pd.DataFrame({
+        "Ticker": np.repeat([f"T{i:03d}" for i in range(n_tickers)], n_quarters),
+        "Date": np.tile(dates, n_tickers),
+    })
+    df["Close"] = rng.uniform(10, 100, len(df))
+    df["Revenue"] = rng.uniform(1e6, 1e9, len(df))
+    return df
+
+
+def _check_price_appends(store_dir):
+    """Appending bars after a ticker's last quarter target must not rebuild it."""
+    def bars(ticker, start, end, close=10.0):
+        days = pd.bdate_range(start, end)
+        return pd.DataFrame({"Date": days, "Close": close, "Volume": 1000.0,
+                             "Dividends": 0.0, "Company": ticker})
+
+    # AAA reaches its last quarter, BBB stops short of it
+    write_prices(pd.concat([bars("AAA", "2020-01-01", "2021-01-15"),
+                            bars("BBB", "2020-01-01", "2020-12-21")]), store_dir)
+    targets = {"AAA": "2020-12-31", "BBB": "2020-12-31"}
+    no_keys = {"financials": frame_hashes(pd.DataFrame(columns=KEY), KEY, []),
+               "universe": frame_hashes(pd.DataFrame(columns=["Symbol"]), ["Symbol"], [])}
+
+    def rebuilt(previous, current):
+        state = dict(no_keys, prices=previous)
+        tickers, _ = changed_tickers(state, no_keys["financials"], no_keys["universe"],
+                                     current, {})
+        return tickers
+
+    fp0 = price_fingerprints(store_dir, ["AAA", "BBB"], targets)
+    full = price_fingerprints(store_dir, ["AAA", "BBB"], targets,
+                              prices=read_prices(store_dir, columns=PRICE_COLUMNS))
+    assert full == fp0
+    assert fp0["AAA"]["covered"] and not fp0["BBB"]["covered"]
+
+    # One bar after the last target: the files change, the quarter inputs do not
+    append_prices(bars("AAA", "2021-01-18", "2021-01-18"), store_dir)
+    fp1 = price_fingerprints(store_dir, ["AAA", "BBB"], targets, previous=fp0)
+    assert fp1["AAA"]["files"] != fp0["AAA"]["files"]
+    assert rebuilt(fp0, fp1) == set()
+
+    # BBB's first bar past the target adds its last quarter row
+    append_prices(bars("BBB", "2021-01-04", "2021-01-04"), store_dir)
+    fp2 = price_fingerprints(store_dir, ["AAA", "BBB"], targets, previous=fp1)
+    assert rebuilt(fp1, fp2) == {"BBB"}
+
+    # A restated bar before the target rebuilds the ticker
+    restated = read_prices(store_dir, tickers=["AAA"])
+    restated.loc[restated["Date"] == "2020-06-01", "Close"] = 11.0
+    write_prices(restated, store_dir)
+    fp3 = price_fingerprints(store_dir, ["AAA", "BBB"], targets, previous=fp2)
+    assert rebuilt(fp2, fp3) == {"AAA"}
+    print("Price fingerprints: appended bars after the last target rebuild nothing")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        _check_price_appends(os.path.join(tmp, "prices"))
+
+    old_levels = _synthetic_levels()
+    old_diff = _pct_diff(old_levels)
+
+    # New quarter, restated value, backfilled middle quarter, removed quarter
+    new_levels = old_levels.copy()
+    new_levels.loc[(new_levels["Ticker"] == "T001") & (new_levels["Date"] == "2017-06-30"),
+                   "Revenue"] *= 1.1
+    new_levels = new_levels[~((new_levels["Ticker"] == "T002")
+                              & (new_levels["Date"] == "2016-09-30"))]
+    extra = pd.DataFrame({"Ticker": ["T003", "T004"], "Date": ["2021-03-31", "2014-12-31"],
+                          "Close": [50.0, 20.0], "Revenue": [2e8, 3e8]})
+    new_levels = pd.concat([new_levels, extra]).sort_values(KEY).reset_index(drop=True)
+
+    tickers = ["T001", "T002", "T003", "T004"]
+    old_t = old_levels[old_levels["Ticker"].isin(tickers)]
+    new_t = new_levels[new_levels["Ticker"].isin(tickers)]
+    keys, removed = affected_rows(old_t, new_t)
+    levels = replace_tickers(old_levels, new_t, tickers)
+    rows = _pct_diff(new_t).merge(keys, on=KEY)
+    got = upsert(old_diff, rows, pd.concat([keys, removed]), levels)
+
+    expected = _pct_diff(levels)
+    pd.testing.assert_frame_equal(got, expected)
+    print(f"Upserted {len(rows)} of {len(expected)} rows ({len(keys)} affected, "
+          f"{len(removed)} removed) - matches a full rebuild")
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Batched technical indicators for all tickers at once.
+
+Prices arrive as flat arrays sorted by (ticker, date), the layout used by
+compute_quarter_metrics. They are laid out as a (bars x tickers) matrix,
+with every ticker left-aligned on its own bar number, so each recurrence
+sees exactly the bar sequence that a per-ticker pandas Series has. Tickers
+are ordered longest first, so the tickers still trading at bar t are a
+prefix of the columns and padding is never touched. All exponential/Wilder
+recurrences of the requested indicators advance together in one loop over
+bars, each step a vector operation across tickers; bars without missing
+values take a shorter path.
+Window indicators (Bollinger, stochastic) and OBV are computed with
+cumulative sums and sliding windows over the whole matrix.
+
+The recurrences follow pandas' ewm(adjust=False) step by step, including
+missing values, so MACD, RSI, ATR and OBV match the `ta` package to the
+last bit. Rolling means and deviations come from cumulative sums and agree
+with pandas rolling windows to ~1e-10 relative.
+
+Tickers are processed in chunks of at most CHUNK_CELLS matrix cells, which
+bounds memory at 5,000 tickers x 30 years.
+
+Add an indicator by writing a builder `fn(engine, **params)` that registers
+its recurrences and outputs, and listing it in INDICATORS.
+
+Run this file for the checks against `ta` and the benchmark.
+"""
+
+import numpy as np
+
+CHUNK_CELLS = 4_000_000
+
+# Indicators the quarter metrics use: MACD(30, 60, 30) and RSI(60)
+MERGE_INDICATORS = [
+    ("macd", {"window_fast": 30, "window_slow": 60, "window_sign": 30}),
+    ("rsi", {"window": 60}),
+]
+
+
+def _alpha(span=None, alpha=None):
+    """Smoothing factor computed the way pandas does (via the center of mass)."""
+    com = (span - 1) / 2.0 if span is not None else 1.0 / alpha - 1.0
+    return 1.0 / (1.0 + com)
+
+
+class _Ewm:
+    """State of one pandas ewm(adjust=False, ignore_na=False).mean() per ticker."""
+
+    def __init__(self, source, alpha, min_periods, out, active):
+        self.source = source
+        self.alpha = alpha
+        self.decay = 1.0 - alpha
+        self.norm = self.decay + alpha
+        self.min_periods = max(min_periods, 1)
+        self.out = out
+        k = out.shape[1]
+        self.weighted = np.full(k, np.nan)
+        self.old_wt = np.ones(k)
+        self.nobs = np.zeros(k, dtype=np.int64)
+        # Every active ticker observed at the previous bar: old weights are all 1
+        self.clean = False
+        self.warm = False
+        if not callable(source):
+            cols = np.arange(source.shape[1])
+            self.row_clean = ~(np.isnan(source) & (cols[None, :] < active[:, None])).any(axis=1)
+
+    def step(self, t, k):
+        if callable(self.source):
+            x = self.source(t, k)
+            x_clean = not np.isnan(x).any()
+        else:
+            x = self.source[t, :k]
+            x_clean = self.row_clean[t]
+        w = self.weighted[:k]
+        if self.clean and x_clean:
+            np.copyto(w, (self.decay * w + self.alpha * x) / self.norm, where=w != x)
+            if not self.warm:
+                self.nobs[:k] += 1
+                self.warm = self.nobs[:k].min() >= self.min_periods
+                self.out[t, :k] = np.where(self.nobs[:k] >= self.min_periods, w, np.nan)
+            else:
+                self.out[t, :k] = w
+            return
+
+        old_wt, nobs = self.old_wt[:k], self.nobs[:k]
+        started = w == w
+        observed = x == x
+        nobs += observed
+        np.multiply(old_wt, self.decay, out=old_wt, where=started)
+        both = started & observed
+        update = both & (w != x)
+        np.divide(old_wt * w + self.alpha * x, old_wt + self.alpha, out=w, where=update)
+        np.copyto(old_wt, 1.0, where=both)
+        np.copyto(w, x, where=observed & ~started)
+        self.out[t, :k] = np.where(nobs >= self.min_periods, w, np.nan)
+        self.clean = bool(observed.all())
+        self.warm = bool(nobs.min() >= self.min_periods)
+
+
+class _Wilder:
+    """ta's ATR smoothing: mean of the first `window` values, then (prev*(n-1)+x)/n."""
+
+    def __init__(self, source, window, out):
+        self.source = source
+        self.window = window
+        self.out = out
+        head = np.ascontiguousarray(source[:window].T)
+        valid = ~np.isnan(head)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.seed = np.where(valid, head, 0.0).sum(axis=1) / valid.sum(axis=1)
+
+    def step(self, t, k):
+        if t < self.window - 1:
+            self.out[t, :k] = 0.0
+        elif t == self.window - 1:
+            self.out[t, :k] = self.seed[:k]
+        else:
+            self.out[t, :k] = (self.out[t - 1, :k] * (self.window - 1) + self.source[t, :k]) \
+                / float(self.window)
+
+
+class IndicatorEngine:
+    """
+    Indicators over (bars x tickers) input matrices.
+
+    Args:
+        inputs (dict): 'close' and optionally 'high', 'low', 'volume' matrices
+            of equal shape; missing bars (and padding after a ticker's last
+            bar) are NaN.
+        active (np.ndarray, optional): Number of leading columns still holding
+            bars at each row (tickers ordered longest first); all by default.
+    """
+
+    def __init__(self, inputs, active=None):
+        self.inputs = inputs
+        self.shape = inputs["close"].shape
+        self.active = np.full(self.shape[0], self.shape[1]) if active is None else active
+        self.outputs = {}
+        self._recurrences = []
+        self._finalizers = []
+
+    def matrix(self):
+        return np.full(self.shape, np.nan)
+
+    def ewm(self, source, span=None, alpha=None, min_periods=0):
+        """Register an ewm(adjust=False) of a matrix or of a per-bar callable; returns its output."""
+        rec = _Ewm(source, _alpha(span, alpha), min_periods, self.matrix(), self.active)
+        self._recurrences.append(rec)
+        return rec.out
+
+    def wilder(self, source, window):
+        """Register a Wilder (ATR-style) smoothing of a matrix; returns its output."""
+        rec = _Wilder(source, window, self.matrix())
+        self._recurrences.append(rec)
+        return rec.out
+
+    def after(self, fn):
+        """Run fn() once the recurrences are done (derived outputs)."""
+        self._finalizers.append(fn)
+
+    def run(self):
+        for t, k in enumerate(self.active.tolist()):
+            for rec in self._recurrences:
+                rec.step(t, k)
+        for fn in self._finalizers:
+            fn()
+        return self.outputs
+
+
+def _shift(x, periods=1):
+    out = np.full_like(x, np.nan)
+    out[periods:] = x[:-periods]
+    return out
+
+
+def _rolling(x, window, reduce=None):
+    """
+    Trailing-window statistics along bars; windows need `window` observations
+    (min_periods=window), non-finite values count as missing.
+
+    Returns:
+        tuple: (mean, population std) or, with reduce=np.fmin/np.fmax, the
+               window minimum/maximum.
+    """
+    valid = np.isfinite(x)
+    count = np.cumsum(valid, axis=0)
+    count[window:] -= count[:-window].copy()
+    enough = count >= window
+    if reduce is not None:
+        out = np.full_like(x, np.nan)
+        if x.shape[0] >= window:
+            windows = np.lib.stride_tricks.sliding_window_view(x, window, axis=0)
+            out[window - 1:] = reduce.reduce(windows, axis=-1)
+        return np.where(enough, out, np.nan)
+
+    # Shift each ticker by a reference level so the sums of squares do not cancel
+    with np.errstate(invalid="ignore"):
+        ref = np.nanmean(np.where(valid, x, np.nan), axis=0)
+    ref = np.where(np.isfinite(ref), ref, 0.0)
+    d = np.where(valid, x - ref, 0.0)
+    s = np.cumsum(d, axis=0)
+    s2 = np.cumsum(d * d, axis=0)
+    s[window:] -= s[:-window].copy()
+    s2[window:] -= s2[:-window].copy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_d = s / count
+        var = np.maximum(s2 / count - mean_d * mean_d, 0.0)
+    return np.where(enough, mean_d + ref, np.nan), np.where(enough, np.sqrt(var), np.nan)
+
+
+def _macd(engine, window_fast=12, window_slow=26, window_sign=9):
+    close = engine.inputs["close"]
+    fast = engine.ewm(close, span=window_fast, min_periods=window_fast)
+    slow = engine.ewm(close, span=window_slow, min_periods=window_slow)
+    line = engine.matrix()
+
+    def macd_line(t, k):
+        np.subtract(fast[t, :k], slow[t, :k], out=line[t, :k])
+        return line[t, :k]
+
+    signal = engine.ewm(macd_line, span=window_sign, min_periods=window_sign)
+    engine.outputs.update(MACD=line, MACD_Signal=signal)
+    engine.after(lambda: engine.outputs.update(MACD_Hist=line - signal))
+
+
+def _rsi(engine, window=14):
+    close = engine.inputs["close"]
+    diff = close - _shift(close)
+    up = np.where(diff > 0, diff, 0.0)
+    down = -np.where(diff < 0, diff, 0.0)
+    emaup = engine.ewm(up, alpha=1 / window, min_periods=window)
+    emadn = engine.ewm(down, alpha=1 / window, min_periods=window)
+
+    def finish():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            engine.outputs["RSI"] = np.where(emadn == 0, 100, 100 - (100 / (1 + emaup / emadn)))
+    engine.after(finish)
+
+
+def _bollinger(engine, window=20, window_dev=2):
+    mavg, mstd = _rolling(engine.inputs["close"], window)
+    engine.outputs.update(BB_Mavg=mavg, BB_High=mavg + window_dev * mstd,
+                          BB_Low=mavg - window_dev * mstd)
+
+
+def _atr(engine, window=14):
+    high, low, close = engine.inputs["high"], engine.inputs["low"], engine.inputs["close"]
+    prev_close = _shift(close)
+    true_range = np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+    engine.outputs["ATR"] = engine.wilder(true_range, window)
+
+
+def _obv(engine):
+    close, volume = engine.inputs["close"], engine.inputs["volume"]
+    signed = np.where(close < _shift(close), -volume, volume)
+    missing = np.isnan(signed)
+    obv = np.cumsum(np.where(missing, 0.0, signed), axis=0)
+    obv[missing] = np.nan
+    engine.outputs["OBV"] = obv
+
+
+def _stochastic(engine, window=14, smooth_window=3):
+    high, low, close = engine.inputs["high"], engine.inputs["low"], engine.inputs["close"]
+    smin = _rolling(low, window, reduce=np.fmin)
+    smax = _rolling(high, window, reduce=np.fmax)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stoch_k = 100 * (close - smin) / (smax - smin)
+    engine.outputs.update(Stoch_K=stoch_k, Stoch_D=_rolling(stoch_k, smooth_window)[0])
+
+
+INDICATORS = {
+    "macd": _macd,
+    "rsi": _rsi,
+    "bollinger": _bollinger,
+    "atr": _atr,
+    "obv": _obv,
+    "stochastic": _stochastic,
+}
+
+
+def _chunks(lengths, max_cells):
+    """Ranges of longest-first tickers whose (bars x tickers) matrix stays under max_cells."""
+    c0 = 0
+    while c0 < len(lengths):
+        c1 = c0 + max(1, max_cells // max(int(lengths[c0]), 1))
+        yield c0, min(c1, len(lengths))
+        c0 = c1
+
+
+def compute_indicators(seg_starts, close, high=None, low=None, volume=None,
+                       indicators=MERGE_INDICATORS, rows=None, max_cells=CHUNK_CELLS):
+    """
+    Indicators for every ticker of flat (ticker, date)-sorted price arrays.
+
+    Args:
+        seg_starts (np.ndarray): First row of every ticker.
+        close, high, low, volume (np.ndarray): Flat price arrays (high/low/volume
+            only for the indicators that need them).
+        indicators (list): (name, params) pairs; names are keys of INDICATORS.
+        rows (np.ndarray, optional): Flat rows to return; all rows by default.
+        max_cells (int): Largest (bars x tickers) matrix processed at once.
+
+    Returns:
+        dict: Output name (e.g. 'MACD', 'RSI', 'ATR') -> array aligned with `rows`.
+    """
+    n = len(close)
+    arrays = {"close": close, "high": high, "low": low, "volume": volume}
+    arrays = {k: np.asarray(v, dtype=np.float64) for k, v in arrays.items() if v is not None}
+    rows = np.arange(n) if rows is None else np.asarray(rows)
+    bounds = np.append(seg_starts, n)
+    lengths = np.diff(bounds)
+    # Longest first: the tickers with a bar at row t are the first active[t] columns
+    order = np.argsort(-lengths, kind="stable")
+    seg_of_row = np.searchsorted(seg_starts, rows, side="right") - 1
+    rank_of_seg = np.empty(len(order), dtype=np.int64)
+    rank_of_seg[order] = np.arange(len(order))
+    rank_of_row = rank_of_seg[seg_of_row]
+    results = {}
+    for c0, c1 in _chunks(lengths[order], max_cells):
+        segs = order[c0:c1]
+        lens = lengths[segs]
+        col = np.repeat(np.arange(c1 - c0), lens)
+        pos = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+        src = np.repeat(bounds[segs], lens) + pos
+        shape = (int(lens[0]), c1 - c0)
+        active = np.searchsorted(-lens, -np.arange(shape[0]), side="left")
+        inputs = {}
+        for name, values in arrays.items():
+            m = np.full(shape, np.nan)
+            m[pos, col] = values[src]
+            inputs[name] = m
+        engine = IndicatorEngine(inputs, active)
+        for name, params in indicators:
+            INDICATORS[name](engine, **params)
+        outputs = engine.run()
+
+        in_chunk = (rank_of_row >= c0) & (rank_of_row < c1)
+        r_col = rank_of_row[in_chunk] - c0
+        r_pos = rows[in_chunk] - bounds[seg_of_row[in_chunk]]
+        for name, m in outputs.items():
+            if name not in results:
+                results[name] = np.full(len(rows), np.nan)
+            results[name][in_chunk] = m[r_pos, r_col]
+    return results
+
+
+def _ta_reference(close, high, low, volume, seg_starts):
+    """Per-ticker `ta` calls with the default parameters of every builder."""
+    import pandas as pd
+    import ta
+
+    out = {k: np.empty(len(close)) for k in
+           ["MACD", "MACD_Signal", "MACD_Hist", "RSI", "BB_Mavg", "BB_High", "BB_Low",
+            "ATR", "OBV", "Stoch_K", "Stoch_D"]}
+    bounds = np.append(seg_starts, len(close))
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        c, h, l, v = (pd.Series(a[s:e]) for a in (close, high, low, volume))
+        macd = ta.trend.MACD(close=c)
+        bb = ta.volatility.BollingerBands(close=c)
+        stoch = ta.momentum.StochasticOscillator(high=h, low=l, close=c)
+        values = {
+            "MACD": macd.macd(), "MACD_Signal": macd.macd_signal(), "MACD_Hist": macd.macd_diff(),
+            "RSI": ta.momentum.RSIIndicator(close=c).rsi(),
+            "BB_Mavg": bb.bollinger_mavg(), "BB_High": bb.bollinger_hband(),
+            "BB_Low": bb.bollinger_lband(),
+            "ATR": ta.volatility.AverageTrueRange(high=h, low=l, close=c).average_true_range(),
+            "OBV": ta.volume.OnBalanceVolumeIndicator(close=c, volume=v).on_balance_volume(),
+            "Stoch_K": stoch.stoch(), "Stoch_D": stoch.stoch_signal(),
+        }
+        for k, series in values.items():
+            out[k][s:e] = series.to_numpy()
+    return out
+
+
+def _merge_reference(close, seg_starts):
+    """The per-ticker `ta` calls compute_quarter_metrics used to make."""
+    import pandas as pd
+    import ta
+
+    out = {k: np.empty(len(close)) for k in ["MACD", "MACD_Signal", "MACD_Hist", "RSI"]}
+    bounds = np.append(seg_starts, len(close))
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        c = pd.Series(close[s:e])
+        macd = ta.trend.MACD(close=c, window_slow=60, window_fast=30, window_sign=30)
+        out["MACD"][s:e] = macd.macd().to_numpy()
+        out["MACD_Signal"][s:e] = macd.macd_signal().to_numpy()
+        out["MACD_Hist"][s:e] = macd.macd_diff().to_numpy()
+        out["RSI"][s:e] = ta.momentum.RSIIndicator(close=c, window=60).rsi().to_numpy()
+    return out
+
+
+def synthetic_bars(n_tickers, n_bars=2520, seed=0, missing=0.0):
+    """Flat (ticker, bar)-sorted OHLCV random walks with uneven history lengths."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(n_bars // 2, n_bars + 1, n_tickers)
+    lengths[0] = n_bars
+    seg_starts = np.append(0, np.cumsum(lengths)[:-1])
+    n = int(lengths.sum())
+    steps = rng.normal(0, 0.01, n)
+    steps[seg_starts] = np.log(rng.uniform(10, 500, n_tickers))
+    close = np.exp(_segment_cumsum(steps, seg_starts))
+    spread = np.abs(rng.normal(0, 0.01, n)) * close
+    high, low = close + spread, close - spread * rng.uniform(0.5, 1.5, n)
+    volume = rng.integers(1_000, 5_000_000, n).astype(np.float64)
+    if missing:
+        close[rng.random(n) < missing] = np.nan
+    return seg_starts, close, high, low, volume
+
+
+def _segment_cumsum(values, seg_starts):
+    """
+    Cumulative sum restarted at every ticker boundary: one global cumsum minus
+    the running total before each segment (last bits may differ from a
+    per-segment np.cumsum).
+    """
+    c = np.cumsum(values)
+    lengths = np.diff(np.append(seg_starts, len(values)))
+    offsets = np.where(seg_starts > 0, c[np.maximum(seg_starts - 1, 0)], 0)
+    return c - np.repeat(offsets, lengths)
+
+
+if __name__ == "__main__":
+    import time
+
+    # Correctness against ta: every indicator on tickers of uneven length
+    seg_starts, close, high, low, volume = synthetic_bars(40, n_bars=600, seed=1)
+    expected = _ta_reference(close, high, low, volume, seg_starts)
+    got = compute_indicators(seg_starts, close, high, low, volume,
+                             indicators=[(name, {}) for name in INDICATORS], max_cells=5_000)
+    for name in ["MACD", "MACD_Signal", "MACD_Hist", "RSI", "ATR", "OBV"]:
+        np.testing.assert_array_equal(got[name], expected[name], err_msg=name)
+    for name in ["BB_Mavg", "BB_High", "BB_Low", "Stoch_K", "Stoch_D"]:
+        np.testing.assert_allclose(got[name], expected[name], rtol=1e-9, atol=1e-9, err_msg=name)
+    print("All indicators match ta (MACD/RSI/ATR/OBV bit-exact)")
+
+    # The merge's MACD(30, 60, 30)/RSI(60), with missing closes
+    seg_starts, close, _, _, _ = synthetic_bars(40, n_bars=600, seed=2, missing=0.01)
+    expected = _merge_reference(close, seg_starts)
+    got = compute_indicators(seg_starts, close)
+    for name, values in expected.items():
+        np.testing.assert_array_equal(got[name], values, err_msg=name)
+    print("Merge indicators with missing closes: bit-exact")
+
+    # Benchmark: ta per ticker (timed on a sample, scaled) vs the batched engine
+    sample = 100
+    for n_tickers in (500, 5000):
+        seg_starts, close, high, low, volume = synthetic_bars(n_tickers, seed=3)
+        bounds = np.append(seg_starts, len(close))
+        t0 = time.perf_counter()
+        _merge_reference(close[:bounds[sample]], seg_starts[:sample])
+        t_ta = (time.perf_counter() - t0) * n_tickers / sample
+        t0 = time.perf_counter()
+        compute_indicators(seg_starts, close)
+        t_merge = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        compute_indicators(seg_starts, close, high, low, volume,
+                           indicators=[(name, {}) for name in INDICATORS])
+        t_all = time.perf_counter() - t0
+        print(f"{n_tickers} tickers x <= 2520 bars ({len(close):,} bars): "
+              f"ta MACD+RSI ~{t_ta:.1f}s (scaled from {sample}) | "
+              f"batched MACD+RSI {t_merge:.1f}s | all six indicators {t_all:.1f}s")
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+Price ingestion for the Parquet price store.
+
+The fetch layer is pluggable: anything with a
+`history(ticker, start=None) -> pd.DataFrame` method (Date index, OHLCV
+columns, as returned by yfinance) can be used. YFinanceSource talks to Yahoo;
+LocalPriceSource serves frames held in memory, so incremental updates can be
+exercised offline.
+
+Tickers are fetched concurrently by a bounded thread pool; per-ticker frames
+are written to the store as they arrive (or concatenated once), and every
+ticker that yields no data or raises is reported with its reason.
+
+Only trading days are stored (no calendar-day forward fill); quarter
+statistics resolve calendar dates with as-of lookups (sp500_metrics).
+strip_calendar_fill() converts a store written with the former ffilled
+calendar days.
+
+In incremental mode only bars after the last stored date are fetched and
+appended. Because prices are dividend/split adjusted, a ticker is re-pulled
+in full whenever the overlapping bar no longer matches the stored close or
+the new bars contain a dividend or split.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from sp500_store import append_prices, last_dates, read_prices, write_prices
+
+# Relative tolerance when comparing the overlap bar with the stored close
+ADJUSTMENT_TOLERANCE = 1e-6
+
+# Concurrent requests to the price source
+MAX_WORKERS = 8
+
+
+class YFinanceSource:
+    """Daily adjusted bars from Yahoo Finance."""
+
+    def history(self, ticker, start=None):
+        import yfinance as yf
+
+        kwargs = {"start": start} if start is not None else {"period": "max"}
+        return yf.Ticker(ticker).history(interval="1d", auto_adjust=True, **kwargs)
+
+
+class LocalPriceSource:
+    """
+    Stand-in source backed by in-memory frames ({ticker: DataFrame with a
+    Date index}). Used to test ingestion without the network; `latency`
+    adds an artificial per-request delay in seconds.
+    """
+
+    def __init__(self, frames, latency=0.0):
+        self.frames = frames
+        self.latency = latency
+        self.calls = []
+
+    def history(self, ticker, start=None):
+        self.calls.append((ticker, start))
+        if self.latency:
+            time.sleep(self.latency)
+        df = self.frames.get(ticker)
+        if df is None:
+            return pd.DataFrame()
+        if start is not None:
+            start = pd.Timestamp(start)
+            if df.index.tz is not None:
+                start = start.tz_localize(df.index.tz)
+            df = df[df.index >= start]
+        return df.copy()
+
+
+def to_store_rows(ticker_df, ticker_sym):
+    """Flatten a per-ticker history frame into store rows (trading days only)."""
+    ticker_df = ticker_df.copy()
+    if ticker_df.index.tz is not None:
+        ticker_df.index = ticker_df.index.tz_localize(None)
+    ticker_df.index = ticker_df.index.normalize()
+    ticker_df = ticker_df.sort_index()
+    ticker_df["Company"] = ticker_sym
+    ticker_df.index.name = "Date"
+    return ticker_df.reset_index()
+
+
+def drop_filled_days(df):
+    """
+    Remove the bars the former calendar-day forward fill added: rows that
+    repeat the previous row of the same ticker in every price column.
+    """
+    df = df.sort_values(["Company", "Date"], kind="mergesort")
+    values = [c for c in df.columns if c not in ("Company", "Date")]
+    prev = df.groupby("Company", sort=False)[values].shift(1)
+    same = ((df[values] == prev) | (df[values].isna() & prev.isna())).all(axis=1)
+    repeated = same & prev.notna().any(axis=1)
+    return df[~repeated].reset_index(drop=True)
+
+
+def strip_calendar_fill(store_dir, tickers=None):
+    """
+    Rewrite ticker partitions without their forward-filled calendar days.
+
+    Returns:
+        tuple: (rows before, rows after)
+    """
+    df = read_prices(store_dir, tickers=tickers)
+    if df.empty:
+        return 0, 0
+    stripped = drop_filled_days(df)
+    write_prices(stripped, store_dir)
+    return len(df), len(stripped)
+
+
+def fetch_new_rows(source, ticker_sym, last_date=None, stored_close=None):
+    """
+    Fetch the bars a ticker needs.
+
+    Args:
+        source: Object with a history(ticker, start=None) method.
+        ticker_sym (str): Ticker symbol.
+        last_date (pd.Timestamp, optional): Last stored date; None = full pull.
+        stored_close (float, optional): Stored close on last_date.
+
+    Returns:
+        tuple: (rows, full) where rows is a store-shaped DataFrame (possibly
+               empty) and full tells whether it replaces the ticker's history.
+    """
+    if last_date is None:
+        hist = source.history(ticker_sym)
+        return (to_store_rows(hist, ticker_sym) if not hist.empty else hist), True
+
+    hist = source.history(ticker_sym, start=pd.Timestamp(last_date).strftime("%Y-%m-%d"))
+    if hist.empty:
+        return hist, False
+
+    rows = to_store_rows(hist, ticker_sym)
+    overlap = rows[rows["Date"] == pd.Timestamp(last_date)]
+    new = rows[rows["Date"] > pd.Timestamp(last_date)]
+    if new.empty:
+        return new, False
+
+    readjusted = (
+        stored_close is None
+        or overlap.empty
+        or not np.isclose(overlap["Close"].iloc[0], stored_close, rtol=ADJUSTMENT_TOLERANCE)
+        or (new.get("Dividends", pd.Series(dtype=float)).fillna(0) != 0).any()
+        or (new.get("Stock Splits", pd.Series(dtype=float)).fillna(0) != 0).any()
+    )
+    if readjusted:
+        hist = source.history(ticker_sym)
+        return to_store_rows(hist, ticker_sym), True
+    return new, False
+
+
+def _fetch_concurrently(fn, tickers, max_workers):
+    """
+    Run fn(ticker) over a bounded thread pool.
+
+    Yields (ticker, result, error) in completion order; error is None on
+    success, otherwise the exception message.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(fn, t): t for t in tickers}
+        for fut in as_completed(futures):
+            ticker = futures[fut]
+            try:
+                yield ticker, fut.result(), None
+            except Exception as e:
+                yield ticker, None, f"{type(e).__name__}: {e}"
+
+
+def download_prices(tickers, source=None, max_workers=MAX_WORKERS):
+    """
+    Full-history download of all tickers.
+
+    Per-ticker frames are collected and concatenated once at the end.
+
+    Returns:
+        tuple: (price_df in ticker order, {ticker: failure reason})
+    """
+    source = source or YFinanceSource()
+    frames = {}
+    failures = {}
+
+    def _one(ticker_sym):
+        hist = source.history(ticker_sym)
+        return to_store_rows(hist, ticker_sym) if not hist.empty else None
+
+    for count, (ticker_sym, rows, error) in enumerate(
+            _fetch_concurrently(_one, tickers, max_workers), 1):
+        if error is not None:
+            failures[ticker_sym] = error
+        elif rows is None:
+            failures[ticker_sym] = "no data"
+        else:
+            frames[ticker_sym] = rows
+            print(count, f"{ticker_sym} processed: {len(rows)} rows")
+
+    ordered = [frames[t] for t in tickers if t in frames]
+    price_df = pd.concat(ordered, ignore_index=True) if ordered else pd.DataFrame()
+    return price_df, failures
+
+
+def update_prices(tickers, store_dir, source=None, max_workers=MAX_WORKERS):
+    """
+    Incrementally bring the store up to date.
+
+    Tickers not yet in the store are pulled in full; the others only fetch
+    bars after their last stored date. Fetches run concurrently and each
+    ticker is written as soon as it arrives: appended bars go into new files,
+    and tickers that had to be re-pulled (adjustment changes) are rewritten.
+
+    Returns:
+        tuple: (n_new_rows, {ticker: failure reason})
+    """
+    source = source or YFinanceSource()
+    last = last_dates(store_dir)
+    known = [t for t in tickers if t in last]
+    closes = {}
+    if known:
+        # Only the boundary bar of each known ticker is needed for the overlap check
+        tail = read_prices(store_dir, tickers=known, columns=["Company", "Date", "Close"],
+                           dates={last[t] for t in known})
+        tail = tail[tail["Date"] == tail["Company"].map(last)]
+        closes = dict(zip(tail["Company"], tail["Close"]))
+
+    def _one(ticker_sym):
+        return fetch_new_rows(source, ticker_sym, last.get(ticker_sym), closes.get(ticker_sym))
+
+    n_rows = 0
+    failures = {}
+    for count, (ticker_sym, result, error) in enumerate(
+            _fetch_concurrently(_one, tickers, max_workers), 1):
+        if error is not None:
+            failures[ticker_sym] = error
+            print(f"Failed {ticker_sym}: {error}")
+            continue
+        rows, full = result
+        if rows.empty:
+            if ticker_sym not in last:
+                failures[ticker_sym] = "no data"
+                print(f"No data for ticker {ticker_sym}, skipping.")
+            continue
+        if full:
+            write_prices(rows, store_dir)
+        else:
+            append_prices(rows, store_dir)
+        n_rows += len(rows)
+        print(count, f"{ticker_sym} {'full history' if full else 'updated'}: +{len(rows)} rows")
+    return n_rows, failures
+
+
+def _serial_download(tickers, source):
+    """The original loop: one ticker at a time, concat on every iteration."""
+    price_df = pd.DataFrame()
+    for ticker_sym in tickers:
+        hist = source.history(ticker_sym)
+        if hist.empty:
+            continue
+        price_df = pd.concat([price_df, to_store_rows(hist, ticker_sym)], ignore_index=True)
+    return price_df
+
+
+def _check_incremental(store_dir):
+    """update_prices() against a local source: full pull, append, re-pull, failures."""
+    idx = pd.bdate_range("2020-01-01", "2020-12-31", tz="America/New_York")
+    close = np.linspace(10, 20, len(idx))
+    full = {t: pd.DataFrame({"Open": close * k, "High": close * k, "Low": close * k,
+                             "Close": close * k, "Volume": 1e6, "Dividends": 0.0,
+                             "Stock Splits": 0.0}, index=pd.Index(idx, name="Date"))
+            for k, t in enumerate(["AAA", "BBB", "CCC"], 1)}
+    cut = len(idx) - 20
+    frames = {t: df.iloc[:cut] for t, df in full.items()}
+
+    def stored():
+        return read_prices(store_dir).set_index(["Company", "Date"]).sort_index()
+
+    def expected():
+        rows = pd.concat([to_store_rows(df, t) for t, df in frames.items()])
+        return rows.set_index(["Company", "Date"]).sort_index()[stored().columns]
+
+    # Empty store: full pulls; a ticker without data is reported, not stored
+    source = LocalPriceSource(frames)
+    n_rows, failures = update_prices(list(frames) + ["MISSING"], store_dir, source)
+    assert n_rows == 3 * cut and failures == {"MISSING": "no data"}
+    assert all(start is None for _, start in source.calls)
+    pd.testing.assert_frame_equal(stored(), expected(), check_dtype=False)
+
+    # New bars, unchanged history: only bars after the last stored date, appended
+    frames["AAA"] = full["AAA"].iloc[:cut + 5]
+    source = LocalPriceSource(frames)
+    n_rows, failures = update_prices(list(frames), store_dir, source)
+    assert n_rows == 5 and not failures
+    assert sorted(source.calls) == [(t, idx[cut - 1].strftime("%Y-%m-%d")) for t in frames]
+    pd.testing.assert_frame_equal(stored(), expected(), check_dtype=False)
+
+    # Re-adjusted history (overlap close moved) and a dividend in the new bars:
+    # both tickers are re-pulled in full and rewritten
+    readjusted = full["BBB"].iloc[:cut + 3].copy()
+    readjusted[["Open", "High", "Low", "Close"]] *= 0.98
+    dividend = full["CCC"].iloc[:cut + 3].copy()
+    dividend.iloc[-1, dividend.columns.get_loc("Dividends")] = 0.5
+    frames.update(BBB=readjusted, CCC=dividend)
+    source = LocalPriceSource(frames)
+    n_rows, failures = update_prices(["BBB", "CCC"], store_dir, source)
+    assert n_rows == 2 * (cut + 3) and not failures
+    assert [start for t, start in source.calls if start is None] == [None, None]
+    pd.testing.assert_frame_equal(stored(), expected(), check_dtype=False)
+
+    # No new bars: nothing fetched beyond the overlap, nothing written
+    source = LocalPriceSource(frames)
+    assert update_prices(list(frames), store_dir, source) == (0, {})
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _check_incremental(os.path.join(tmp, "prices"))
+    print("update_prices: full pull, append-only update, re-pull on re-adjustment or "
+          "dividend, 'no data' failures")
+
+    # Benchmark against a local stand-in source with artificial latency
+    n_tickers, latency = 100, 0.05
+    idx = pd.bdate_range("1995-01-01", "2025-12-31", tz="America/New_York")
+    rng = np.random.default_rng(0)
+    frames = {}
+    for i in range(n_tickers):
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.01, len(idx))))
+        frames[f"T{i:03d}"] = pd.DataFrame(
+            {"Open": close, "High": close, "Low": close, "Close": close,
+             "Volume": 1e6, "Dividends": 0.0, "Stock Splits": 0.0},
+            index=pd.Index(idx, name="Date"))
+    tickers = list(frames) + ["MISSING"]
+    source = LocalPriceSource(frames, latency=latency)
+
+    t0 = time.perf_counter()
+    serial = _serial_download(tickers, source)
+    t1 = time.perf_counter()
+    pooled, failures = download_prices(tickers, source)
+    t2 = time.perf_counter()
+
+    pd.testing.assert_frame_equal(serial, pooled)
+    print(f"{n_tickers} tickers x {len(idx)} bars, {latency * 1000:.0f} ms latency: "
+          f"serial {t1 - t0:.2f}s | pool({MAX_WORKERS}) {t2 - t1:.2f}s | failures {failures}")
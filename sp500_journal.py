@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Append-only checkpoint journal for the Selenium scrapers.
+
+Each completed unit of work (a (ticker, report) page, or a ticker) is saved
+as one small pickle shard plus one JSON line in a manifest, so a checkpoint
+costs O(1) no matter how much has been scraped. Crash safety:
+- shards are written to a temp file, fsynced, moved into place with
+  os.replace, and the shard directory is fsynced so the rename is durable;
+- a manifest line is appended (flush + fsync) only after its shard exists;
+- on resume a torn last line or a line whose shard is missing is ignored.
+
+compact() concatenates all shards once at the end into the CSV/Parquet output.
+Run this file to check resuming after a torn manifest line and a lost shard.
+"""
+
+import json
+import os
+import pickle
+
+import pandas as pd
+
+
+def _fsync_dir(path):
+    """Persist the directory entry of a rename (not possible on Windows)."""
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CheckpointJournal:
+    """
+    Journal stored in `root`:
+        root/manifest.jsonl   one record per checkpoint
+        root/shards/<n>.pkl   one DataFrame per completed key
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.shard_dir = os.path.join(root, "shards")
+        self.manifest = os.path.join(root, "manifest.jsonl")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.records = self._load()
+        self._rows = sum(r["rows"] for r in self.records)
+
+    def _load(self):
+        records = []
+        if not os.path.exists(self.manifest):
+            return records
+        good_bytes = 0
+        with open(self.manifest, "rb") as f:
+            data = f.read()
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break  # torn write at the tail
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            shard = rec.get("shard")
+            if shard and not os.path.exists(os.path.join(self.shard_dir, shard)):
+                break
+            records.append(rec)
+            good_bytes += len(line)
+        if good_bytes < len(data):
+            # Drop the unusable tail so later appends start on a clean line
+            with open(self.manifest, "r+b") as f:
+                f.truncate(good_bytes)
+        return records
+
+    def _append_record(self, rec):
+        with open(self.manifest, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.records.append(rec)
+        self._rows += rec["rows"]
+
+    def append(self, key, df, **state):
+        """Persist the rows of one completed key together with the resume state."""
+        shard = f"{len(self.records):07d}.pkl"
+        path = os.path.join(self.shard_dir, shard)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # The manifest may only reference a shard that survives a crash
+        _fsync_dir(self.shard_dir)
+        self._append_record({"key": key, "shard": shard, "rows": len(df), "state": state})
+
+    def save_state(self, **state):
+        """Record resume state without data (e.g. after giving up on a ticker)."""
+        self._append_record({"key": None, "shard": None, "rows": 0, "state": state})
+
+    def state(self):
+        """Latest resume state, or an empty dict for a fresh journal."""
+        return dict(self.records[-1]["state"]) if self.records else {}
+
+    def completed(self):
+        """Keys that have a shard (JSON lists come back as tuples)."""
+        return {tuple(r["key"]) if isinstance(r["key"], list) else r["key"]
+                for r in self.records if r["shard"]}
+
+    def total_rows(self):
+        return self._rows
+
+    def compact(self, csv_path=None, parquet_path=None):
+        """Concatenate all shards once and optionally write the final output."""
+        frames = []
+        for r in self.records:
+            if r["shard"]:
+                with open(os.path.join(self.shard_dir, r["shard"]), "rb") as f:
+                    frames.append(pickle.load(f))
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if csv_path:
+            df.to_csv(csv_path, index=False)
+        if parquet_path:
+            df.to_parquet(parquet_path, index=False)
+        return df
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    def page(ticker, report, n):
+        return pd.DataFrame({"Ticker": ticker, "Report": report, "Value": range(n)})
+
+    keys = [("AAA", "income"), ("AAA", "balance"), ("BBB", "income"), ("BBB", "balance")]
+    with tempfile.TemporaryDirectory() as root:
+        journal = CheckpointJournal(root)
+        assert journal.state() == {} and journal.completed() == set()
+        for i, (ticker, report) in enumerate(keys):
+            journal.append([ticker, report], page(ticker, report, i + 1), ticker_index=i)
+        journal.save_state(ticker_index=4, skipped=["CCC"])
+
+        # Reopen: keys come back as tuples, the data-less record carries the state
+        journal = CheckpointJournal(root)
+        assert journal.completed() == set(keys)
+        assert journal.state() == {"ticker_index": 4, "skipped": ["CCC"]}
+        assert journal.total_rows() == 1 + 2 + 3 + 4
+
+        # Torn tail: the last line is cut mid-record and dropped from the file
+        size = os.path.getsize(journal.manifest)
+        with open(journal.manifest, "r+b") as f:
+            f.truncate(size - 10)
+        journal = CheckpointJournal(root)
+        assert len(journal.records) == 4
+        assert journal.state() == {"ticker_index": 3}
+        with open(journal.manifest, "rb") as f:
+            assert f.read().endswith(b"\n")
+
+        # A lost shard ends the usable journal there; a stray temp shard is ignored
+        os.remove(os.path.join(journal.shard_dir, journal.records[2]["shard"]))
+        with open(os.path.join(journal.shard_dir, "0000009.pkl.tmp"), "wb") as f:
+            f.write(b"partial")
+        journal = CheckpointJournal(root)
+        assert journal.completed() == set(keys[:2])
+        assert journal.state() == {"ticker_index": 1}
+        assert journal.total_rows() == 1 + 2
+
+        # Resume from there; compact() holds every completed page once
+        for i, (ticker, report) in enumerate(keys[2:], start=2):
+            journal.append([ticker, report], page(ticker, report, i + 1), ticker_index=i)
+        journal = CheckpointJournal(root)
+        assert journal.completed() == set(keys) and journal.state() == {"ticker_index": 3}
+        out = journal.compact(csv_path=os.path.join(root, "out.csv"))
+        expected = pd.concat([page(t, r, i + 1) for i, (t, r) in enumerate(keys)],
+                             ignore_index=True)
+        pd.testing.assert_frame_equal(out, expected)
+        pd.testing.assert_frame_equal(pd.read_csv(os.path.join(root, "out.csv")), expected)
+    print("Journal resumes after a torn manifest line and a lost shard")
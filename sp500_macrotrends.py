@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+One-shot capture of macrotrends.net financial statement grids.
+
+The statement pages render a jqxGrid that only materializes the cells in
+view, which is why the old capture dragged the horizontal scrollbar and
+re-parsed the grid's HTML after every step. The complete data is already in
+the browser, though: the grid's own data source (`jqxGrid('getrows')`) and
+the `originalData` array embedded in the page's script. capture_grid() reads
+it with a single execute_script call, falling back to the embedded array in
+the page source, and returns the statement as a DataFrame.
+
+Run this file to check the capture offline against saved-page fixtures.
+"""
+
+import json
+import re
+
+import pandas as pd
+
+GRID_ID = "jqxgrid"
+
+# Returns {source, columns, rows} in one browser round-trip, or null
+GRID_DATA_JS = """
+var grid = window.jQuery ? window.jQuery('#' + arguments[0]) : null;
+if (grid && grid.length && grid.jqxGrid) {
+    try {
+        var cols = grid.jqxGrid('columns').records
+            .filter(function (c) { return c.datafield && !c.hidden; })
+            .map(function (c) { return {datafield: c.datafield, text: c.text || ''}; });
+        var rows = grid.jqxGrid('getrows').map(function (r) {
+            var o = {};
+            cols.forEach(function (c) { o[c.datafield] = r[c.datafield]; });
+            return o;
+        });
+        return {source: 'api', columns: cols, rows: rows};
+    } catch (e) {}
+}
+if (window.originalData) {
+    return {source: 'embedded', columns: null, rows: window.originalData};
+}
+return null;
+"""
+
+_EMBEDDED_RE = re.compile(r"var\s+originalData\s*=\s*(\[.*?\])\s*;", re.S)
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_TAG_RE = re.compile(r"<[^>]+>")
+LABEL_FIELD = "field_name"
+
+
+def parse_embedded_grid(html):
+    """Grid payload from the `var originalData = [...]` script of a saved page, or None."""
+    m = _EMBEDDED_RE.search(html)
+    if m is None:
+        return None
+    return {"source": "embedded", "columns": None, "rows": json.loads(m.group(1))}
+
+
+def grid_frame(payload):
+    """
+    Statement table from a grid payload.
+
+    Args:
+        payload (dict): {'columns': [{'datafield', 'text'}] or None, 'rows': [dict]}.
+
+    Returns:
+        pd.DataFrame: Metric label column followed by one column per period
+        (newest first, as displayed); values as strings.
+    """
+    rows = payload["rows"]
+    if payload["columns"]:
+        fields = [c["datafield"] for c in payload["columns"]]
+        texts = {c["datafield"]: c["text"] for c in payload["columns"]}
+    else:
+        fields = list(rows[0]) if rows else [LABEL_FIELD]
+        texts = {}
+    periods = sorted((f for f in fields if _DATE_RE.match(f)), reverse=True)
+    label = LABEL_FIELD if LABEL_FIELD in fields else fields[0]
+
+    labels = [_TAG_RE.sub("", str(r.get(label, ""))).strip() for r in rows]
+    data = {texts.get(label) or label: labels}
+    for p in periods:
+        data[texts.get(p) or p] = ["" if r.get(p) is None else str(r.get(p)) for r in rows]
+    return pd.DataFrame(data)
+
+
+def capture_grid(driver, grid_id=GRID_ID):
+    """
+    Whole grid in one round-trip through the grid API or the embedded data.
+
+    Returns:
+        pd.DataFrame or None: None when the page exposes neither.
+    """
+    payload = driver.execute_script(GRID_DATA_JS, grid_id)
+    if not payload or not payload.get("rows"):
+        payload = parse_embedded_grid(driver.page_source)
+    if not payload or not payload.get("rows"):
+        return None
+    return grid_frame(payload)
+
+
+def fixture_grid_page(metrics, periods):
+    """Saved-page stand-in: embedded originalData plus an (unrendered) grid div."""
+    rows = []
+    for name, values in metrics.items():
+        row = {LABEL_FIELD: f"<a href='/stocks/charts/AAPL/apple/{name.lower()}'>{name}</a>",
+               "popup_icon": "<div class='ajax-chart'></div>"}
+        row.update(zip(periods, values))
+        rows.append(row)
+    return ("<html><head><script>\n"
+            f"var originalData = {json.dumps(rows)};\n"
+            "</script></head><body><div id='jqxgrid'></div></body></html>")
+
+
+class _FixtureDriver:
+    """Enough of a WebDriver for capture_grid() against a saved page."""
+
+    def __init__(self, html, api_payload=None):
+        self.page_source = html
+        self.api_payload = api_payload
+        self.round_trips = 0
+
+    def execute_script(self, script, *args):
+        self.round_trips += 1
+        return self.api_payload
+
+
+if __name__ == "__main__":
+    import time
+
+    periods = [f"{y}-{m}" for y in range(2024, 2008, -1) for m in ("12-31", "09-30", "06-30", "03-31")]
+    metrics = {f"Metric {i}": [f"{1000 + i * 7 + j:.2f}" for j in range(len(periods))]
+               for i in range(40)}
+    metrics["Shares Outstanding"] = [""] * len(periods)
+    page = fixture_grid_page(metrics, periods)
+
+    expected = pd.DataFrame({LABEL_FIELD: list(metrics),
+                             **{p: [v[j] for v in metrics.values()] for j, p in enumerate(periods)}})
+
+    # Embedded-array path (grid API unavailable)
+    driver = _FixtureDriver(page)
+    t0 = time.perf_counter()
+    df = capture_grid(driver)
+    elapsed = time.perf_counter() - t0
+    pd.testing.assert_frame_equal(df, expected)
+
+    # Grid API path: columns come back in display order with header texts
+    api_columns = ([{"datafield": LABEL_FIELD, "text": ""}]
+                   + [{"datafield": p, "text": p} for p in periods])
+    api_rows = [dict(zip([LABEL_FIELD] + periods, [name] + values)) for name, values in metrics.items()]
+    driver = _FixtureDriver("<html></html>", {"source": "api", "columns": api_columns, "rows": api_rows})
+    pd.testing.assert_frame_equal(capture_grid(driver), expected)
+    assert driver.round_trips == 1
+
+    assert capture_grid(_FixtureDriver("<html></html>")) is None
+    print(f"OK: {df.shape[0]} rows x {df.shape[1] - 1} periods captured in "
+          f"{elapsed * 1000:.1f} ms, {driver.round_trips} browser round-trip")
@@ -7,16 +7,48 @@ Created on Tue Sep  2 19:11:53 2025
 
 import numpy as np
 import pandas as pd
-from dateutil.relativedelta import relativedelta
-import ta
 import ctypes
+import os
+import sys
 from datetime import datetime
+from sp500_features import MERGE_TRANSFORMS, add_lag_features, transform_lags
+from sp500_incremental import (KEY, PRICE_COLUMNS, affected_rows, changed_tickers, code_fingerprint,
+                               financial_hashes, last_targets, load_state, price_fingerprints,
+                               replace_tickers, save_state, universe_hashes, upsert)
+from sp500_metrics import compute_quarter_metrics
+from sp500_numeric import clean_numeric_column
+from sp500_pit import load_filings, point_in_time_dates
+from sp500_rolling import write_daily_features
+from sp500_schema import apply_schema, concat_frames, fill_missing, read_artifact, report_memory
+from sp500_store import read_prices
+from sp500_universe import load_universe, symbols
+from sp500_wide import concat_long, encode_long, encode_wide, long_to_wide
 
 run_stamp = datetime.now().strftime("%d%m%Y")  # {timestamp}
-prices_path = "sp500_prices_04012026.csv"
-financials_path = "sp500_financials_03012026.csv"
-financials_0_path = "sp500_financials_01092025.csv"
-names_path = "sp500_names_03012026.csv"
+# Paths can be overridden by the pipeline runner (sp500_pipeline.py)
+prices_store = os.getenv("SP500_PRICE_STORE", "sp500_prices")  # Parquet store written by sp500_prices.py
+financials_path = os.getenv("SP500_FINANCIALS", "sp500_financials_03012026.csv")
+financials_0_path = os.getenv("SP500_FINANCIALS_0", "sp500_financials_01092025.csv")
+merge_state_dir = os.getenv("SP500_MERGE_STATE", "sp500_merge_state")
+# Full rebuild by default; `--incremental` (or SP500_MERGE_MODE=incremental)
+# recomputes only the ticker-quarters whose inputs changed since the last run
+incremental = "--incremental" in sys.argv[1:] or os.getenv("SP500_MERGE_MODE") == "incremental"
+# `--daily` (or SP500_MERGE_MODE=daily) writes rolling daily features for every
+# ticker-day to SP500_DAILY (Parquet parts) instead of the quarter merge
+daily = "--daily" in sys.argv[1:] or os.getenv("SP500_MERGE_MODE") == "daily"
+daily_dir = os.getenv("SP500_DAILY", "sp500_daily")
+# Quarter statistics over trading days (as-of windows); SP500_CALENDAR_FILL=1
+# reproduces the statistics of the former forward-filled calendar-day prices
+calendar_fill = os.getenv("SP500_CALENDAR_FILL") == "1"
+# SP500_POINT_IN_TIME=1 dates every quarter's financials at the first trading day
+# after its 10-Q filing (SP500_REPORT_DATES, from sp500_dates.py) instead of the
+# fiscal period end, with the price statistics taken on that day
+point_in_time = os.getenv("SP500_POINT_IN_TIME") == "1"
+report_dates_path = os.getenv("SP500_REPORT_DATES", "report_dates.csv")
+# Code the merged output depends on; a change forces a full rebuild
+MERGE_CODE = ["sp500_merge.py", "sp500_metrics.py", "sp500_numeric.py", "sp500_schema.py",
+              "sp500_wide.py", "sp500_incremental.py", "sp500_features.py",
+              "sp500_indicators.py", "sp500_pit.py", "sp500_store.py", "sp500_universe.py"]
 
 # tell Windows to stay awake
 ctypes.windll.kernel32.SetThreadExecutionState(0x80000000 | 0x00000001)
@@ -56,280 +88,207 @@ def restructure_df(df):
     # Concatenate the two DataFrames and return the result
     return pd.concat([df_base, df_new], ignore_index=True)[['Ticker', 'Date', 'Metric', 'Value']]
 
-def compute_quarter_metrics(df, dates):
-    df = df.copy()
-    df["Date"] = pd.to_datetime(df["Date"].astype(str).str[:10], errors="coerce")
-    df.sort_values(["Company", "Date"], inplace=True, kind="mergesort")
-
-    results = []
-
-    for ticker, sub in df.groupby("Company", sort=False):
-        sub = sub.loc[sub["Date"].notna()]
-        if sub.empty:
-            continue
-
-        dates_arr = sub["Date"].to_numpy(dtype="datetime64[ns]")
-
-        # Use float64 accumulators to reduce cancellation
-        close = sub["Close"].to_numpy(dtype=np.float64)
-        vol   = sub["Volume"].to_numpy(dtype=np.float64)
-        div   = sub["Dividends"].to_numpy(dtype=np.float64)
-
-        macd = ta.trend.MACD(close=sub["Close"], window_slow=60, window_fast=30, window_sign=30)
-        macd_line   = macd.macd().to_numpy()
-        macd_signal = macd.macd_signal().to_numpy()
-        macd_hist   = macd.macd_diff().to_numpy()
-        rsi = ta.momentum.RSIIndicator(close=sub["Close"], window=60).rsi().to_numpy()
-
-        # cumulative sums in float64
-        csum_close  = np.cumsum(close)
-        csum_close2 = np.cumsum(close * close)
-        csum_vol    = np.cumsum(vol)
-        csum_vol2   = np.cumsum(vol * vol)
-        csum_div    = np.cumsum(div)
-        csum_div_nz = np.cumsum((div != 0).astype(np.int64))
-
-        s_dates = pd.Series(dates_arr)
-        mask_targets = s_dates.dt.strftime("%m-%d").isin(dates)
-        if not mask_targets.any():
-            continue
-        target_end_pos = s_dates[mask_targets].groupby(s_dates[mask_targets]).tail(1).index.to_numpy()
-
-        # small helper
-        def _range(csum, ei, si):
-            return csum[ei] - (csum[si-1] if si > 0 else 0.0)
-
-        for ei in target_end_pos:
-            end_date = dates_arr[ei]
-            if pd.isna(end_date):
-                continue
-
-            start_date = pd.Timestamp(end_date).replace(day=1) - relativedelta(months=2)
-            si = dates_arr.searchsorted(np.datetime64(start_date, "ns"), side="left")
-            if si > ei:
-                continue
-
-            cnt = ei - si + 1
-            if cnt <= 0:
-                continue
-
-            # price stats
-            sum_close  = _range(csum_close,  ei, si)
-            sum_close2 = _range(csum_close2, ei, si)
-            mean_close = sum_close / cnt
-
-            if cnt > 1:
-                # sample variance via cumsums
-                var_num   = sum_close2 - (sum_close * sum_close) / cnt
-                var_close = var_num / (cnt - 1)
-
-                # clamp tiny negatives caused by FP error
-                if var_close < 0:
-                    if var_close > -1e-12:
-                        var_close = 0.0
-                    else:
-                        var_close = np.nan
-                std_close = np.sqrt(var_close) if np.isfinite(var_close) else np.nan
-            else:
-                std_close = np.nan
-
-            w_close = close[si:ei+1]
-            median_close = float(np.median(w_close))
-            min_close    = float(np.min(w_close))
-            max_close    = float(np.max(w_close))
-
-            # volume stats
-            sum_vol  = _range(csum_vol,  ei, si)
-            sum_vol2 = _range(csum_vol2, ei, si)
-            mean_vol = sum_vol / cnt
-            if cnt > 1:
-                var_num_v = sum_vol2 - (sum_vol * sum_vol) / cnt
-                var_vol   = var_num_v / (cnt - 1)
-                if var_vol < 0:
-                    if var_vol > -1e-12:
-                        var_vol = 0.0
-                    else:
-                        var_vol = np.nan
-                std_vol = np.sqrt(var_vol) if np.isfinite(var_vol) else np.nan
-            else:
-                std_vol = np.nan
-
-            w_vol = vol[si:ei+1]
-            median_vol = float(np.median(w_vol))
-            min_vol    = int(np.min(w_vol))
-            max_vol    = int(np.max(w_vol))
-
-            # dividends
-            sum_div      = float(_range(csum_div, ei, si))
-            cnt_div_nz   = int(_range(csum_div_nz, ei, si))
-            mean_div_ex_zero = (sum_div / cnt_div_nz) if cnt_div_nz > 0 else 0.0
-
-            results.append({
-                "Ticker": ticker,
-                "Date": pd.Timestamp(end_date),
-                "ClosePrice": float(close[ei]),
-                "MinPrice": min_close,
-                "MaxPrice": max_close,
-                "StdPrice": float(std_close),
-                "MeanPrice": float(mean_close),
-                "MedianPrice": median_close,
-                "MinVolume": min_vol,
-                "MaxVolume": max_vol,
-                "StdVolume": float(std_vol),
-                "MeanVolume": float(mean_vol),
-                "MedianVolume": median_vol,
-                "SumDividends": sum_div,
-                "MeanDividends": float(mean_div_ex_zero),
-                "CountDividends": cnt_div_nz,
-                "RSI": float(rsi[ei]),
-                "MACD": float(macd_line[ei]),
-                "MACD_Signal": float(macd_signal[ei]),
-                "MACD_Hist": float(macd_hist[ei]),
-            })
-
-    return pd.DataFrame(results)
-
-def clean_numeric_column(series, percent_to_decimal=True):
+def prepare_financials(financials):
     """
-    Clean a Series of messy numeric strings and return numeric dtype.
-    If percent_to_decimal=True, values ending with '%' are converted to decimals (e.g. '12%' -> 0.12).
-    """
-    s = series.astype(str).str.strip()
-
-    # remove $ and commas
-    s = s.str.replace(r'[\$,]', '', regex=True)
-
-    # convert parentheses to negative numbers: "(1,234)" -> "-1234"
-    s = s.str.replace(r'^\((.*)\)$', r'-\1', regex=True)
+    Long financials (Ticker, Date, Variable, Value) from the raw stockanalysis
+    rows, with Quarter and Fiscal year as extra variables.
 
-    # Optionally convert percent strings to decimal
-    if percent_to_decimal:
-        pct_mask = s.str.endswith('%')
-        # strip '%' and convert the rest
-        numeric = pd.to_numeric(s.str.rstrip('%'), downcast='float', errors='coerce')
-        numeric.loc[pct_mask] = numeric.loc[pct_mask] / 100.0
-        return numeric
-
-def calc_quarterly_pct_diff(df, ticker_col='ticker', date_col='date', lags=[1, 4]):
+    Values are parsed over the whole frame at once (the float downcast is
+    decided per column), so ticker subsets are taken from the result.
     """
-    Calculate the percentage change for each numeric column by ticker between periods 
-    for given lags. For each numeric column, it computes the percent change for each lag 
-    and appends new columns named "<col>_pct_diff_<lag>".
-
-    The first row for each ticker is NaN for each lag since there's no previous period.
+    financials.loc[:, ['Ticker', 'Metric', 'Fiscal Quarter']
+                   ].drop_duplicates(inplace=True)
+
+    # Formatting string and dates columns
+    financials_clean = financials[~financials['Period Ending'].str.contains(
+        'Quarters')]
+    financials_clean = financials_clean[financials_clean['Fiscal Quarter'].str.contains(
+        'Q')]
+    financials_clean = financials_clean[financials_clean['Fiscal Quarter'] != 'Current']
+    financials_clean = fill_missing(financials_clean, 0)
+    financials_clean['Date'] = pd.to_datetime(
+        financials_clean['Period Ending'].str[8:], format='%b %d, %Y', errors='coerce')
+    financials_clean.drop(columns=['Period Ending'], inplace=True)
+    # financials_clean.drop(columns=['Unnamed: 0'], inplace=True)
+    financials_clean[['Quarter', 'Fiscal year']
+                     ] = financials_clean['Fiscal Quarter'].str.split(' ', expand=True)
+    financials_clean['Quarter'] = financials_clean['Quarter'].str[1:].astype(
+        int)        # Remove 'Q' and convert to int
+    financials_clean['Fiscal year'] = financials_clean['Fiscal year'].astype(
+        int)        # Convert year to int
+    financials_clean.drop(columns=['Fiscal Quarter'], inplace=True)
+
+    # Move Quarter/Fiscal year into Metric/Value rows so financials are long-form.
+    financials_fiscal = restructure_df(financials_clean)
+    financials_fiscal.columns = ['Ticker', 'Date', 'Variable', 'Value']
+    financials_fiscal.reset_index(drop=True, inplace=True)
+
+    # Financial values parsed once per distinct string
+    financials_fiscal['Value'] = clean_numeric_column(financials_fiscal['Value'])
+    return financials_fiscal
+
+def build_levels(financials_fiscal, prices, names, dates):
+    """
+    Quarter rows of the merge before the pct diffs: financials and price
+    metrics per (Ticker, Date) plus the ticker's universe metadata.
 
     Args:
-        df (pd.DataFrame): The input DataFrame.
-        ticker_col (str): Column name for ticker identifiers.
-        date_col (str): Column name for date/time variable.
-        lags (list): List of lag values (in periods) for which to compute the percent change.
+        financials_fiscal (pd.DataFrame): Output of prepare_financials().
+        prices (pd.DataFrame): Daily prices ('Company', 'Date', 'Close', 'Volume', 'Dividends').
+        names (pd.DataFrame): Universe snapshot.
+        dates (array-like): Quarter-end month-day strings ('MM-DD').
 
     Returns:
-        pd.DataFrame: A copy of 'df' with new percentage change columns appended.
+        pd.DataFrame: One row per (Ticker, Date), sorted by Ticker and Date.
     """
-    # Sort by ticker/date to ensure correct chronological order
-    df = df.sort_values(by=[ticker_col, date_col]).copy()
-
-    # Identify numeric columns (exclude ticker/date from numeric, if present)
-    numeric_cols = df.select_dtypes(
-        include=[np.number]).columns.difference([ticker_col, date_col])
-
-    # Build a dict of new columns; each key corresponds to a new Series
-    new_cols = {}
-
-    # For each numeric column, compute percent change for each specified lag
-    for col in numeric_cols:
-        for lag in lags:
-            new_col_name = f"{col}_pct_diff_{lag}"
-            new_cols[new_col_name] = df.groupby(
-                ticker_col)[col].pct_change(periods=lag)
-
-    # Convert the dict to a DataFrame, aligning on the original index, then concat once
-    df_new = pd.DataFrame(new_cols, index=df.index)
-    df = pd.concat([df, df_new], axis=1)
+    # Aggregate price values; coded straight into long format (no string melt)
+    targets = financials_fiscal[['Ticker', 'Date']].drop_duplicates() if point_in_time else None
+    prices_agg = compute_quarter_metrics(prices, dates, calendar_fill=calendar_fill,
+                                         targets=targets)
+    prices_long = encode_wide(prices_agg, id_vars=['Ticker', 'Date'])
+    # Coded long financials (categorical Ticker/Variable, float Value)
+    financials_long = encode_long(financials_fiscal)
+    del prices_agg
+
+    # Concatenate financial and price data; for a repeated (Ticker, Date, Variable)
+    # the later row wins, then scatter straight into the wide matrix
+    sp500_merged = concat_long([financials_long, prices_long])
+    del financials_long, prices_long
+    sp500_wide = long_to_wide(sp500_merged)
+    del sp500_merged
+    report_memory("wide", sp500_wide=sp500_wide)
+
+    # A ticker subset (incremental runs) may lack price or equity rows altogether
+    for col in ['Shareholders\' Equity', 'ClosePrice']:
+        if col not in sp500_wide.columns:
+            sp500_wide[col] = np.nan
+    sp500_wide_clean = sp500_wide.dropna(
+        subset=['Shareholders\' Equity', 'ClosePrice'])
+    sp500_df = sp500_wide_clean.fillna(0)
+
+    # Adding meta data for a ticker
+    return sp500_df.merge(
+        names[['Symbol', 'GICS Sector', 'GICS Sub-Industry', 'Founded']], how='left', left_on='Ticker', right_on='Symbol')
+
+def build_diff(sp500_df_names):
+    """
+    Merged output from the quarter rows: 1st and 4th pct differences, rows
+    without both price differences dropped, gaps filled with 0.
+    """
+    sp500_diff = add_lag_features(
+        sp500_df_names, MERGE_TRANSFORMS, ticker_col='Ticker', date_col='Date')
+    sp500_diff.dropna(subset=['ClosePrice_pct_diff_1',
+                      'ClosePrice_pct_diff_4'], inplace=True)
+    sp500_diff = fill_missing(sp500_diff, 0)
+    sp500_diff.drop(columns=['Symbol'], axis=1, inplace=True)
+    sp500_diff['Founded'] = sp500_diff['Founded'].str[0:4].astype('int')
+    return sp500_diff
+
+def incremental_update(state, rebuild):
+    """
+    Rebuild the quarter rows of `rebuild` tickers and upsert the affected
+    output rows into the persisted state.
 
-    return df
+    Returns:
+        tuple: (levels, diff), or None when a full rebuild is needed (new columns).
+    """
+    if not rebuild:
+        return state['levels'], state['diff']
+    levels_old = state['levels']
+    financials_t = financials_fiscal[financials_fiscal['Ticker'].isin(rebuild)]
+    prices_t = apply_schema(read_prices(prices_store, tickers=[t for t in tickers if t in rebuild],
+                                        columns=PRICE_COLUMNS), "price_inputs")
+    if financials_t.empty:
+        levels_t = levels_old.iloc[:0]
+    else:
+        levels_t = build_levels(financials_t, prices_t, names, dates)
+    if len(levels_t.columns.difference(levels_old.columns)):
+        return None
+    # Variables the subset never reports are 0 for its rows, as in a full merge
+    missing = levels_old.columns.difference(levels_t.columns)
+    levels_t = levels_t.reindex(columns=levels_old.columns)
+    levels_t[missing] = levels_t[missing].fillna(0)
+
+    keys, removed = affected_rows(levels_old[levels_old['Ticker'].isin(rebuild)], levels_t,
+                                  lags=transform_lags(MERGE_TRANSFORMS))
+    levels = replace_tickers(levels_old, levels_t, rebuild)
+    rows = build_diff(levels_t).merge(keys, on=KEY) if len(keys) else state['diff'].iloc[:0]
+    print(f"Upserting {len(rows)} rows ({len(keys)} affected, {len(removed)} removed) "
+          f"for {len(rebuild)} tickers")
+    return levels, upsert(state['diff'], rows, pd.concat([keys, removed]), levels)
 
 # Import
 
-prices = pd.read_csv(prices_path, index_col=0, parse_dates=True, low_memory=False)
-prices.rename(columns={"index": "Date"}, inplace=True)
+# Compact dtypes from the schema registry (categorical strings; prices stay
+# float64 for the quarter metrics)
+names = apply_schema(load_universe(), "names")
+tickers = symbols(names, "dash")
 
-names = pd.read_csv(names_path)
+if daily:
+    n_rows = write_daily_features(prices_store, tickers, daily_dir)
+    print(f"Wrote {n_rows} daily feature rows to {daily_dir}")
+    ctypes.windll.kernel32.SetThreadExecutionState(0x80000000)
+    sys.exit(0)
 
 # Merging old data with new and rremove duplicates
-financials = pd.read_csv(financials_path, low_memory=False)
-financials_0 = pd.read_csv(financials_0_path, low_memory=False)
-financials = pd.concat([financials, financials_0], axis=0,
-                       ignore_index=True).drop_duplicates()
-
-financials.loc[:, ['Ticker', 'Metric', 'Fiscal Quarter']
-               ].drop_duplicates(inplace=True)
-
-# Formatting string and dates columns
-financials_clean = financials[~financials['Period Ending'].str.contains(
-    'Quarters')]
-financials_clean = financials_clean[financials_clean['Fiscal Quarter'].str.contains(
-    'Q')]
-financials_clean = financials_clean[financials_clean['Fiscal Quarter'] != 'Current']
-financials_clean.fillna(0, inplace=True)
-financials_clean['Date'] = pd.to_datetime(
-    financials_clean['Period Ending'].str[8:], format='%b %d, %Y', errors='coerce')
-financials_clean.drop(columns=['Period Ending'], inplace=True)
-# financials_clean.drop(columns=['Unnamed: 0'], inplace=True)
-financials_clean[['Quarter', 'Fiscal year']
-                 ] = financials_clean['Fiscal Quarter'].str.split(' ', expand=True)
-financials_clean['Quarter'] = financials_clean['Quarter'].str[1:].astype(
-    int)        # Remove 'Q' and convert to int
-financials_clean['Fiscal year'] = financials_clean['Fiscal year'].astype(
-    int)        # Convert year to int
-financials_clean.drop(columns=['Fiscal Quarter'], inplace=True)
-
-# Move Quarter/Fiscal year into Metric/Value rows so financials are long-form.
-financials_fiscal = restructure_df(financials_clean)
-financials_fiscal.columns = ['Ticker', 'Date', 'Variable', 'Value']
-financials_fiscal.reset_index(drop=True, inplace=True)
+financials = read_artifact(financials_path, "financials")
+financials_0 = read_artifact(financials_0_path, "financials")
+financials = concat_frames([financials, financials_0]).drop_duplicates()
+report_memory("load", financials=financials, names=names)
+
+financials_fiscal = prepare_financials(financials)
+del financials, financials_0
+
+if point_in_time:
+    trading_days = read_prices(prices_store, tickers=tickers, columns=['Company', 'Date'])
+    financials_fiscal, filing_counts = point_in_time_dates(
+        financials_fiscal, load_filings(report_dates_path), trading_days)
+    print("Filing dates: " + ", ".join(f"{n} {k}" for k, n in filing_counts.items()))
+    del trading_days
 
 # Derive the list of dates
 dates = financials_fiscal['Date'].astype('str').str[5:].unique()
 
-# Aggregate price values and reshaping into long format
-prices_agg = compute_quarter_metrics(prices, dates)
-prices_agg_melt = prices_agg.melt(id_vars=['Ticker', 'Date'])
-prices_agg_melt.columns = ['Ticker', 'Date', 'Variable', 'Value']
-
-# Concatenate financial nad proce data
-sp500_merged = pd.concat([financials_fiscal, prices_agg_melt], axis=0)
-sp500_merged = (sp500_merged
-                .sort_values(['Ticker','Date','Variable'])
-                .drop_duplicates(['Ticker','Date','Variable'], keep='last'))
-sp500_merged['Value'] = clean_numeric_column(sp500_merged['Value'])
-sp500_merged['Date'] = sp500_merged['Date'].astype('str').str[:10]
-
-# Reshaping merged df to wide format and drop duplicates
-sp500_wide = sp500_merged[['Ticker', 'Date', 'Variable', 'Value']].pivot_table(
-    index=["Ticker", "Date"], columns="Variable", values="Value", observed=True, aggfunc='first')
-sp500_wide.reset_index(inplace=True)
-
-sp500_wide_clean = sp500_wide.dropna(
-    subset=['Shareholders\' Equity', 'ClosePrice'])
-sp500_df = sp500_wide_clean.fillna(0)
-
-# Adding meta data for a ticker
-sp500_df_names = sp500_df.merge(
-    names[['Symbol', 'GICS Sector', 'GICS Sub-Industry', 'Founded']], how='left', left_on='Ticker', right_on='Symbol')
-
-# Calculate 1st and 4th differences and tidying the final df
-sp500_diff = calc_quarterly_pct_diff(
-    sp500_df_names, ticker_col='Ticker', date_col='Date')
-sp500_diff.dropna(subset=['ClosePrice_pct_diff_1',
-                  'ClosePrice_pct_diff_4'], inplace=True)
-sp500_diff.fillna(0, inplace=True)
-sp500_diff.drop(columns=['Symbol'], axis=1, inplace=True)
-sp500_diff['Founded'] = sp500_diff['Founded'].str[0:4].astype('int')
-
-# Save result as CSV
-sp500_diff.to_csv(f'D:/GitHub/sp500/sp500_diff_{run_stamp}.csv')
+# Input fingerprints per (Ticker, quarter) / ticker, compared with the last run
+code_files = [os.path.join(os.path.dirname(os.path.abspath(__file__)), f) for f in MERGE_CODE]
+if point_in_time:
+    # New filings move quarters to other days: rebuild in full
+    code_files.append(report_dates_path)
+code = code_fingerprint(code_files) + ("-calendar" if calendar_fill else "") \
+    + ("-pit" if point_in_time else "")
+financial_fp = financial_hashes(financials_fiscal)
+universe_fp = universe_hashes(names)
+price_targets = last_targets(financials_fiscal)
+state = load_state(merge_state_dir, code) if incremental else None
+if incremental and state is None:
+    print("No usable merge state: full rebuild")
+
+result = None
+if state is not None:
+    price_fp = price_fingerprints(prices_store, tickers, price_targets, state['prices'])
+    rebuild, counts = changed_tickers(state, financial_fp, universe_fp, price_fp,
+                                      dict(zip(names['Symbol'].astype(str), tickers)))
+    print("Changed inputs: " + ", ".join(f"{n} {k}" for k, n in counts.items()))
+    result = incremental_update(state, rebuild)
+    if result is None:
+        print("New variables in the rebuilt rows: full rebuild")
+
+if result is None:
+    # Only the columns and tickers the quarter metrics need
+    prices_raw = read_prices(prices_store, tickers=tickers, columns=PRICE_COLUMNS)
+    price_fp = price_fingerprints(prices_store, tickers, price_targets, prices=prices_raw)
+    prices = apply_schema(prices_raw, "price_inputs")
+    del prices_raw
+    report_memory("prices", prices=prices)
+    sp500_levels = build_levels(financials_fiscal, prices, names, dates)
+    del prices
+    sp500_diff = build_diff(sp500_levels)
+else:
+    sp500_levels, sp500_diff = result
+
+# Save result as CSV, and the state for the next incremental run
+sp500_diff.to_csv(os.getenv('SP500_DIFF', f'D:/GitHub/sp500/sp500_diff_{run_stamp}.csv'))
+save_state(merge_state_dir, code, sp500_levels, sp500_diff, financial_fp, universe_fp, price_fp)
 
 # restore normal sleep behavior
-ctypes.windll.kernel32.SetThreadExecutionState(0x80000000)
\ No newline at end of file
+ctypes.windll.kernel32.SetThreadExecutionState(0x80000000)
@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""
+Quarter-window price statistics for the S&P 500 merge.
+
+compute_quarter_metrics() works on all tickers at once: the daily price
+frame is sorted once by (Company, Date), every quarter-end window becomes a
+[start, end] slice of that single sorted array, and sums/std come from
+per-ticker cumulative sums while median/min/max come from a padded,
+row-sorted window matrix. The result is assembled column by column.
+
+Prices are stored on trading days only. Quarter-end targets are calendar
+dates; each one is resolved with an as-of search to the last trading day on
+or before it, and its window covers the trading days from the first day of
+the month two months earlier. calendar_fill=True instead forward-fills every
+ticker to all calendar days first (weekend and holiday bars repeated), which
+reproduces the statistics of the former ffilled price files exactly.
+
+RSI and MACD come from sp500_indicators.compute_indicators, which runs the
+recurrences for all tickers together and returns only the quarter-end rows.
+
+Run this file directly to check the batched engine against the original
+per-ticker loop on synthetic prices.
+"""
+
+import numpy as np
+import pandas as pd
+import ta
+from dateutil.relativedelta import relativedelta
+
+from sp500_indicators import compute_indicators
+
+# Windows are gathered into a (n_windows, max_window_len) matrix; process them
+# in chunks so memory stays bounded on 30 years x 500 tickers.
+WINDOW_CHUNK = 32768
+
+METRIC_COLUMNS = [
+    "Ticker", "Date", "ClosePrice", "MinPrice", "MaxPrice", "StdPrice",
+    "MeanPrice", "MedianPrice", "MinVolume", "MaxVolume", "StdVolume",
+    "MeanVolume", "MedianVolume", "SumDividends", "MeanDividends",
+    "CountDividends", "RSI", "MACD", "MACD_Signal", "MACD_Hist",
+]
+
+
+def _window_sums(values, si, ei, seg_starts, seg_of_window):
+    """
+    Sum of values[si:ei + 1] for every window (si <= ei), in one np.add.reduceat
+    call over the interleaved window bounds; no loop over tickers.
+
+    Each window is summed on its own (pairwise, as np.sum), not as a
+    difference of per-ticker running sums, so results differ from the former
+    cumsum by rounding: the last bits of sums and means, up to ~1e-10
+    relative for std, whose s2 - s * s / n cancels. As with those running
+    sums, a missing value makes every later window of its ticker NaN.
+    """
+    padded = np.append(values, values.dtype.type(0))
+    bounds = np.empty(2 * len(si), dtype=np.int64)
+    bounds[0::2] = si
+    bounds[1::2] = ei + 1
+    sums = np.add.reduceat(padded, bounds)[0::2]
+    if values.dtype.kind == "f":
+        missing = np.isnan(values)
+        if missing.any():
+            rows = np.where(missing, np.arange(len(values)), len(values))
+            first_missing = np.minimum.reduceat(rows, seg_starts)
+            sums[first_missing[seg_of_window] <= ei] = np.nan
+    return sums
+
+
+def _sample_std(s, s2, cnt):
+    """Sample std from window sums, clamping tiny negative variances to 0."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = (s2 - (s * s) / cnt) / (cnt - 1)
+    var = np.where((var < 0) & (var > -1e-12), 0.0, var)
+    var = np.where(var < 0, np.nan, var)
+    std = np.sqrt(np.where(np.isfinite(var), var, np.nan))
+    return np.where(cnt > 1, std, np.nan)
+
+
+def _nullable_int(values):
+    """
+    Window minima/maxima as Int64, <NA> where the window had no valid value
+    (a plain int64 cast would turn NaN into INT64_MIN).
+    """
+    finite = np.isfinite(values)
+    return pd.arrays.IntegerArray(np.where(finite, values, 0).astype(np.int64), ~finite)
+
+
+def _window_order_stats(values, si, ei):
+    """
+    Median, min and max of values[si:ei+1] for every window.
+
+    Windows may overlap (different fiscal calendars), so instead of reduceat
+    each window is gathered into an inf-padded row and the rows are sorted.
+    """
+    n = len(si)
+    median = np.empty(n)
+    vmin = np.empty(n)
+    vmax = np.empty(n)
+    for c0 in range(0, n, WINDOW_CHUNK):
+        s = si[c0:c0 + WINDOW_CHUNK]
+        e = ei[c0:c0 + WINDOW_CHUNK]
+        cnt = e - s + 1
+        width = int(cnt.max())
+        offs = np.arange(width)
+        idx = s[:, None] + offs[None, :]
+        valid = offs[None, :] < cnt[:, None]
+        win = np.where(valid, values[np.minimum(idx, len(values) - 1)], np.inf)
+        has_nan = np.isnan(win).any(axis=1)
+        win.sort(axis=1)
+        rows = np.arange(len(s))
+        lo = win[rows, (cnt - 1) // 2]
+        hi = win[rows, cnt // 2]
+        median[c0:c0 + len(s)] = np.where(has_nan, np.nan, (lo + hi) / 2)
+        vmin[c0:c0 + len(s)] = np.where(has_nan, np.nan, win[:, 0])
+        vmax[c0:c0 + len(s)] = np.where(has_nan, np.nan, win[rows, cnt - 1])
+    return median, vmin, vmax
+
+
+def fill_calendar_days(frame):
+    """
+    Forward-fill a (Company, Date)-sorted frame of trading days to every
+    calendar day between each ticker's first and last bar.
+
+    Same result as reindexing each ticker to a daily range and calling
+    ffill(), as the price download used to do before storing.
+    """
+    values = [c for c in frame.columns if c not in ("Company", "Date")]
+    tickers = frame["Company"].to_numpy()
+    n = len(frame)
+    new_seg = np.ones(n, dtype=bool)
+    new_seg[1:] = tickers[1:] != tickers[:-1]
+    seg_starts = np.flatnonzero(new_seg)
+    seg_id = np.cumsum(new_seg) - 1
+    # Missing values inside a ticker take the previous bar's value, like ffill()
+    filled = frame[values].groupby(seg_id).ffill()
+
+    days = frame["Date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    seg_ends = np.append(seg_starts[1:], n) - 1
+    first, last = days[seg_starts], days[seg_ends]
+    lengths = last - first + 1
+    offsets = np.cumsum(lengths) - lengths
+    cal_seg = np.repeat(np.arange(len(seg_starts)), lengths)
+    cal_days = first[cal_seg] + np.arange(lengths.sum()) - offsets[cal_seg]
+
+    day0 = days.min()
+    key = seg_id.astype(np.int64) * (1 << 32) + (days - day0)
+    rows = np.searchsorted(key, cal_seg.astype(np.int64) * (1 << 32) + (cal_days - day0),
+                           side="right") - 1
+    out = filled.iloc[rows].reset_index(drop=True)
+    out.insert(0, "Date", cal_days.astype("datetime64[D]").astype("datetime64[ns]"))
+    out.insert(0, "Company", tickers[rows])
+    return out
+
+
+def _calendar_targets(first_days, last_days, dates):
+    """
+    Quarter-end calendar days (month-day in `dates`) between each ticker's
+    first and last bar (int days since epoch).
+
+    Returns:
+        tuple: (segment index, day as int days since epoch) per target, in
+               segment then date order.
+    """
+    codes = _month_day_codes(dates)
+    if len(codes) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    y0 = first_days.min().astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64)
+    y1 = last_days.max().astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64)
+    months = ((np.arange(y0, y1 + 1)[:, None] * 12 + codes[None, :] // 100 - 1)
+              .astype("datetime64[M]"))
+    days = months.astype("datetime64[D]") + (codes[None, :] % 100 - 1)
+    # Impossible days ("02-30", "02-29" outside leap years) spill into the next month: drop them
+    candidates = np.sort(days[days.astype("datetime64[M]") == months]).astype(np.int64)
+    lo = np.searchsorted(candidates, first_days.astype(np.int64), side="left")
+    hi = np.searchsorted(candidates, last_days.astype(np.int64), side="right")
+    counts = hi - lo
+    seg = np.repeat(np.arange(len(counts)), counts)
+    pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + lo[seg]
+    return seg, candidates[pos]
+
+
+def _explicit_targets(seg_tickers, targets):
+    """
+    Segment index and int day of explicit ('Ticker', 'Date') targets, in
+    segment then date order; tickers without prices are dropped.
+    """
+    seg = pd.Index(seg_tickers).get_indexer(targets["Ticker"].astype(seg_tickers.dtype))
+    days = targets["Date"].to_numpy(dtype="datetime64[D]").astype(np.int64)
+    keep = (seg >= 0) & ~np.isnat(targets["Date"].to_numpy(dtype="datetime64[D]"))
+    pairs = np.unique(np.stack([seg[keep], days[keep]], axis=1), axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _month_day_codes(dates):
+    """Turn 'MM-DD' strings into MM*100+DD integer codes, skipping junk."""
+    codes = []
+    for d in dates:
+        d = str(d)
+        if len(d) == 5 and d[2] == "-" and d[:2].isdigit() and d[3:].isdigit():
+            codes.append(int(d[:2]) * 100 + int(d[3:]))
+    return np.unique(np.array(codes, dtype=np.int64))
+
+
+def compute_quarter_metrics(df, dates, calendar_fill=False, targets=None):
+    """
+    Compute quarter-window price, volume and dividend statistics for all tickers.
+
+    For every ticker and every calendar day whose month-day is in `dates`
+    (between the ticker's first and last bar), the window runs from the first
+    day of the month two months earlier up to the last bar on or before that
+    day. Targets whose window holds no bar are skipped. Explicit per-ticker
+    targets (e.g. point-in-time filing days) replace the month-day calendar.
+
+    Args:
+        df (pd.DataFrame): Daily prices with 'Company', 'Date', 'Close',
+                           'Volume' and 'Dividends' columns.
+        dates (array-like): Quarter-end month-day strings ('MM-DD').
+        calendar_fill (bool): Forward-fill to calendar days first, which
+            reproduces the statistics of the former ffilled price files.
+        targets (pd.DataFrame, optional): 'Ticker', 'Date' window ends used
+            instead of `dates`.
+
+    Returns:
+        pd.DataFrame: One row per (Ticker, quarter-end Date) with the columns
+                      listed in METRIC_COLUMNS.
+    """
+    if pd.api.types.is_datetime64_any_dtype(df["Date"]):
+        # Already typed (e.g. read from the Parquet price store): skip the text round-trip
+        date_col = df["Date"]
+        if date_col.dt.tz is not None:
+            date_col = date_col.dt.tz_localize(None)
+        date_col = date_col.dt.normalize()
+    else:
+        date_col = pd.to_datetime(df["Date"].astype(str).str[:10], errors="coerce")
+    keep = date_col.notna().to_numpy() & df["Company"].notna().to_numpy()
+    frame = pd.DataFrame({
+        "Company": df["Company"].to_numpy()[keep],
+        "Date": date_col.to_numpy(dtype="datetime64[ns]")[keep],
+        "Close": df["Close"].to_numpy(dtype=np.float64)[keep],
+        "Volume": df["Volume"].to_numpy(dtype=np.float64)[keep],
+        "Dividends": df["Dividends"].to_numpy(dtype=np.float64)[keep],
+    })
+    frame.sort_values(["Company", "Date"], inplace=True, kind="mergesort")
+    if frame.empty:
+        return pd.DataFrame(columns=METRIC_COLUMNS)
+    if calendar_fill:
+        frame = fill_calendar_days(frame)
+
+    tickers = frame["Company"].to_numpy()
+    dates_arr = frame["Date"].to_numpy()
+    close = frame["Close"].to_numpy()
+    vol = frame["Volume"].to_numpy()
+    div = frame["Dividends"].to_numpy()
+    n = len(frame)
+
+    # Ticker segments over the single sorted array
+    new_seg = np.ones(n, dtype=bool)
+    new_seg[1:] = tickers[1:] != tickers[:-1]
+    seg_starts = np.flatnonzero(new_seg)
+    seg_id = np.cumsum(new_seg) - 1
+
+    # Calendar targets per ticker; window ends and starts via as-of searches
+    # on one composite (ticker, day) key
+    days = dates_arr.astype("datetime64[D]").astype(np.int64)
+    seg_ends = np.append(seg_starts[1:], n) - 1
+    if targets is None:
+        target_seg, target_days = _calendar_targets(days[seg_starts], days[seg_ends], dates)
+    else:
+        target_seg, target_days = _explicit_targets(tickers[seg_starts], targets)
+    day0 = days.min()
+    key = seg_id.astype(np.int64) * (1 << 32) + (days - day0)
+    seg_key = target_seg.astype(np.int64) * (1 << 32)
+    ei = np.searchsorted(key, seg_key + (target_days - day0), side="right") - 1
+    start_days = (target_days.astype("datetime64[D]").astype("datetime64[M]") - 2) \
+        .astype("datetime64[D]").astype(np.int64) - day0
+    si = np.searchsorted(key, seg_key + np.maximum(start_days, 0), side="left")
+    has_bar = ei >= si
+    ei, si, target_days = ei[has_bar], si[has_bar], target_days[has_bar]
+    if len(ei) == 0:
+        return pd.DataFrame(columns=METRIC_COLUMNS)
+    cnt = ei - si + 1
+
+    seg_of_window = seg_id[ei]
+
+    def window_sum(values):
+        return _window_sums(values, si, ei, seg_starts, seg_of_window)
+
+    sum_close = window_sum(close)
+    sum_vol = window_sum(vol)
+    sum_div = window_sum(div)
+    cnt_div_nz = window_sum((div != 0).astype(np.int64))
+
+    median_close, min_close, max_close = _window_order_stats(close, si, ei)
+    median_vol, min_vol, max_vol = _window_order_stats(vol, si, ei)
+
+    ind = compute_indicators(seg_starts, close, rows=ei)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_div = np.where(cnt_div_nz > 0, sum_div / cnt_div_nz, 0.0)
+
+    return pd.DataFrame({
+        "Ticker": tickers[ei],
+        "Date": target_days.astype("datetime64[D]").astype("datetime64[ns]"),
+        "ClosePrice": close[ei],
+        "MinPrice": min_close,
+        "MaxPrice": max_close,
+        "StdPrice": _sample_std(sum_close, window_sum(close * close), cnt),
+        "MeanPrice": sum_close / cnt,
+        "MedianPrice": median_close,
+        "MinVolume": _nullable_int(min_vol),
+        "MaxVolume": _nullable_int(max_vol),
+        "StdVolume": _sample_std(sum_vol, window_sum(vol * vol), cnt),
+        "MeanVolume": sum_vol / cnt,
+        "MedianVolume": median_vol,
+        "SumDividends": sum_div,
+        "MeanDividends": mean_div,
+        "CountDividends": cnt_div_nz,
+        "RSI": ind["RSI"],
+        "MACD": ind["MACD"],
+        "MACD_Signal": ind["MACD_Signal"],
+        "MACD_Hist": ind["MACD_Hist"],
+    }, columns=METRIC_COLUMNS)
+
+
+def _compute_quarter_metrics_reference(df, dates, asof=False):
+    """
+    Original per-ticker, per-window loop; kept to check the batched engine.
+    With asof=True, targets are calendar days resolved to the last bar on or
+    before them (trading-day prices) instead of bars on the target day.
+    """
+    df = df.copy()
+    df["Date"] = pd.to_datetime(df["Date"].astype(str).str[:10], errors="coerce")
+    df.sort_values(["Company", "Date"], inplace=True, kind="mergesort")
+
+    results = []
+
+    for ticker, sub in df.groupby("Company", sort=False):
+        sub = sub.loc[sub["Date"].notna()]
+        if sub.empty:
+            continue
+
+        dates_arr = sub["Date"].to_numpy(dtype="datetime64[ns]")
+
+        close = sub["Close"].to_numpy(dtype=np.float64)
+        vol   = sub["Volume"].to_numpy(dtype=np.float64)
+        div   = sub["Dividends"].to_numpy(dtype=np.float64)
+
+        macd = ta.trend.MACD(close=sub["Close"], window_slow=60, window_fast=30, window_sign=30)
+        macd_line   = macd.macd().to_numpy()
+        macd_signal = macd.macd_signal().to_numpy()
+        macd_hist   = macd.macd_diff().to_numpy()
+        rsi = ta.momentum.RSIIndicator(close=sub["Close"], window=60).rsi().to_numpy()
+
+        csum_close  = np.cumsum(close)
+        csum_close2 = np.cumsum(close * close)
+        csum_vol    = np.cumsum(vol)
+        csum_vol2   = np.cumsum(vol * vol)
+        csum_div    = np.cumsum(div)
+        csum_div_nz = np.cumsum((div != 0).astype(np.int64))
+
+        if asof:
+            calendar = pd.date_range(dates_arr[0], dates_arr[-1], freq="D")
+            target_dates = calendar[calendar.strftime("%m-%d").isin(dates)].to_numpy()
+            target_end_pos = dates_arr.searchsorted(target_dates, side="right") - 1
+        else:
+            s_dates = pd.Series(dates_arr)
+            mask_targets = s_dates.dt.strftime("%m-%d").isin(dates)
+            if not mask_targets.any():
+                continue
+            target_end_pos = s_dates[mask_targets].groupby(s_dates[mask_targets]).tail(1).index.to_numpy()
+            target_dates = dates_arr[target_end_pos]
+
+        def _range(csum, ei, si):
+            return csum[ei] - (csum[si-1] if si > 0 else 0.0)
+
+        for ei, end_date in zip(target_end_pos, target_dates):
+            start_date = pd.Timestamp(end_date).replace(day=1) - relativedelta(months=2)
+            si = dates_arr.searchsorted(np.datetime64(start_date, "ns"), side="left")
+            cnt = ei - si + 1
+            if cnt < 1:
+                continue
+
+            sum_close  = _range(csum_close,  ei, si)
+            sum_close2 = _range(csum_close2, ei, si)
+            if cnt > 1:
+                var_close = (sum_close2 - (sum_close * sum_close) / cnt) / (cnt - 1)
+                if var_close < 0:
+                    var_close = 0.0 if var_close > -1e-12 else np.nan
+                std_close = np.sqrt(var_close) if np.isfinite(var_close) else np.nan
+            else:
+                std_close = np.nan
+
+            sum_vol  = _range(csum_vol,  ei, si)
+            sum_vol2 = _range(csum_vol2, ei, si)
+            if cnt > 1:
+                var_vol = (sum_vol2 - (sum_vol * sum_vol) / cnt) / (cnt - 1)
+                if var_vol < 0:
+                    var_vol = 0.0 if var_vol > -1e-12 else np.nan
+                std_vol = np.sqrt(var_vol) if np.isfinite(var_vol) else np.nan
+            else:
+                std_vol = np.nan
+
+            w_close = close[si:ei+1]
+            w_vol = vol[si:ei+1]
+            sum_div    = float(_range(csum_div, ei, si))
+            cnt_div_nz = int(_range(csum_div_nz, ei, si))
+
+            results.append({
+                "Ticker": ticker,
+                "Date": pd.Timestamp(end_date),
+                "ClosePrice": float(close[ei]),
+                "MinPrice": float(np.min(w_close)),
+                "MaxPrice": float(np.max(w_close)),
+                "StdPrice": float(std_close),
+                "MeanPrice": float(sum_close / cnt),
+                "MedianPrice": float(np.median(w_close)),
+                "MinVolume": int(np.min(w_vol)),
+                "MaxVolume": int(np.max(w_vol)),
+                "StdVolume": float(std_vol),
+                "MeanVolume": float(sum_vol / cnt),
+                "MedianVolume": float(np.median(w_vol)),
+                "SumDividends": sum_div,
+                "MeanDividends": (sum_div / cnt_div_nz) if cnt_div_nz > 0 else 0.0,
+                "CountDividends": cnt_div_nz,
+                "RSI": float(rsi[ei]),
+                "MACD": float(macd_line[ei]),
+                "MACD_Signal": float(macd_signal[ei]),
+                "MACD_Hist": float(macd_hist[ei]),
+            })
+
+    return pd.DataFrame(results)
+
+
+def synthetic_prices(n_tickers=20, start="2015-01-01", end="2020-12-31", seed=0, freq="B"):
+    """
+    Random-walk daily prices in the price store layout: trading days
+    (weekdays) by default, freq="D" for the former ffilled calendar-day files.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(n_tickers):
+        idx = pd.date_range(pd.Timestamp(start) + pd.Timedelta(days=int(rng.integers(0, 400))),
+                            end, freq=freq)
+        close = 50 * np.exp(np.cumsum(rng.normal(0, 0.01, len(idx))))
+        frames.append(pd.DataFrame({
+            "Date": idx,
+            "Open": close, "High": close, "Low": close, "Close": close,
+            "Volume": rng.integers(1_000, 1_000_000, len(idx)).astype(float),
+            "Dividends": np.where(rng.random(len(idx)) < 0.01, 0.25, 0.0),
+            "Stock Splits": 0.0,
+            "Company": f"T{i:04d}",
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    import time
+
+    # Trading days with holiday gaps and a few missing values
+    rng = np.random.default_rng(1)
+    prices = synthetic_prices()
+    prices = prices[rng.random(len(prices)) > 0.03].reset_index(drop=True)
+    prices.loc[rng.choice(len(prices), 20, replace=False), "Close"] = np.nan
+    quarter_ends = ["03-31", "06-30", "09-30", "12-31", "01-31", "10-28", "02-29"]
+
+    t0 = time.perf_counter()
+    expected = _compute_quarter_metrics_reference(prices, quarter_ends, asof=True)
+    t1 = time.perf_counter()
+    actual = compute_quarter_metrics(prices, quarter_ends)
+    t_trading = time.perf_counter() - t1
+    pd.testing.assert_frame_equal(actual, expected[METRIC_COLUMNS], check_dtype=False)
+    print(f"Trading days, as-of windows: {len(actual)} rows | loop {t1 - t0:.2f}s | "
+          f"batched {t_trading:.2f}s")
+
+    # Explicit targets (point-in-time dates) give the same rows for the same days
+    targets = actual[["Ticker", "Date"]].sample(frac=1, random_state=0)
+    explicit = compute_quarter_metrics(prices, None, targets=targets)
+    pd.testing.assert_frame_equal(explicit, actual)
+    print("Explicit targets match the month-day calendar")
+
+    # A window without any valid volume gives <NA>, not INT64_MIN
+    gap = prices.copy()
+    gap.loc[gap["Company"] == gap["Company"].iloc[0], "Volume"] = np.nan
+    gap_metrics = compute_quarter_metrics(gap, quarter_ends)
+    first = gap_metrics["Ticker"] == gap["Company"].iloc[0]
+    assert gap_metrics.loc[first, ["MinVolume", "MaxVolume"]].isna().all().all()
+    assert (gap_metrics.loc[~first, "MinVolume"] >= 0).all()
+    print("Windows without volume give <NA> MinVolume/MaxVolume")
+
+    # Compatibility: the former download ffilled every ticker to calendar days
+    filled = pd.concat([
+        g.set_index("Date").pipe(lambda t: t.reindex(
+            pd.date_range(t.index.min(), t.index.max(), freq="D")).ffill())
+        .rename_axis("Date").reset_index()
+        for _, g in prices.groupby("Company")], ignore_index=True)
+    expected = _compute_quarter_metrics_reference(filled, quarter_ends)
+    t0 = time.perf_counter()
+    compat = compute_quarter_metrics(prices, quarter_ends, calendar_fill=True)
+    t1 = time.perf_counter()
+    pd.testing.assert_frame_equal(compat, expected[METRIC_COLUMNS], check_dtype=False)
+    print(f"calendar_fill=True matches the ffilled files: {len(prices):,} stored rows instead of "
+          f"{len(filled):,} (+{len(filled) / len(prices) - 1:.0%} with calendar days) | "
+          f"trading {t_trading:.2f}s vs calendar {t1 - t0:.2f}s")
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline runner: names -> prices / dates / financials / extra -> merge.
+
+Each stage declares the artifacts it reads and writes. Artifacts are passed
+to the stage scripts as SP500_* environment variables, so stages no longer
+depend on hard-coded dated file names. A stage is skipped when the content
+hashes of its inputs (including its own script and the local sp500_* modules
+it imports) match the last successful run and its outputs still exist;
+scraping stages also re-run once their TTL has expired. Independent stages
+run in parallel as soon as the stages they depend on have finished, except
+a stage that would prompt on the terminal, which runs alone. Every stage is
+timed.
+
+    python sp500_pipeline.py                 # run what is out of date
+    python sp500_pipeline.py --force prices  # re-run prices and what changes downstream
+    python sp500_pipeline.py --dry-run       # show the plan only
+    python sp500_pipeline.py --self-check    # check skipping and scheduling on stub stages
+"""
+
+import argparse
+import ast
+import contextlib
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+STATE_FILE = "pipeline_state.json"
+DAY = 24 * 3600
+
+# Artifact name -> (environment variable, default path)
+ARTIFACTS = {
+    "universe": ("SP500_UNIVERSE_DIR", "universe"),
+    "cik_map": (None, "ticker.txt"),
+    "prices": ("SP500_PRICE_STORE", "sp500_prices"),
+    "report_dates": ("SP500_REPORT_DATES", "report_dates.csv"),
+    "financials": ("SP500_FINANCIALS", "sp500_financials.csv"),
+    "financials_0": ("SP500_FINANCIALS_0", "sp500_financials_01092025.csv"),
+    "extra": ("SP500_EXTRA", "sp500_extra.csv"),
+    "diff": ("SP500_DIFF", "sp500_diff.csv"),
+}
+
+
+class Stage:
+    """
+    One pipeline step.
+
+    Args:
+        name (str): Stage name.
+        script (str): Python script run as a subprocess.
+        inputs (list): Artifact names read by the stage.
+        outputs (list): Artifact names written by the stage.
+        ttl (float, optional): Seconds after which a stage fed by external
+            sources is re-run even with unchanged inputs.
+        conditional_inputs (dict): {artifact name: environment variable};
+            the artifact is an input only while the variable is "1".
+        prompts_for (tuple): Environment variables the script asks for on
+            the terminal when they are unset; it then runs alone.
+    """
+
+    def __init__(self, name, script, inputs=(), outputs=(), ttl=None,
+                 conditional_inputs=None, prompts_for=()):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.ttl = ttl
+        self.conditional_inputs = dict(conditional_inputs or {})
+        self.prompts_for = tuple(prompts_for)
+
+    def active_inputs(self):
+        """Declared inputs plus the conditional ones switched on in the environment."""
+        return self.inputs + [name for name, var in self.conditional_inputs.items()
+                              if os.getenv(var) == "1"]
+
+    def interactive(self):
+        return any(not os.getenv(var) for var in self.prompts_for)
+
+
+STAGES = [
+    Stage("names", "sp500_names.py", outputs=["universe"], ttl=7 * DAY),
+    Stage("prices", "sp500_prices.py", inputs=["universe"], outputs=["prices"], ttl=DAY),
+    Stage("dates", "sp500_dates.py", inputs=["universe", "cik_map"], outputs=["report_dates"], ttl=7 * DAY),
+    Stage("financials", "sp500_financials.py", inputs=["universe"], outputs=["financials"], ttl=30 * DAY,
+          prompts_for=("APP_EMAIL", "APP_PASSWORD")),
+    Stage("extra", "sp500_extra.py", inputs=["universe"], outputs=["extra"], ttl=30 * DAY),
+    Stage("merge", "sp500_merge.py", inputs=["prices", "financials", "financials_0", "universe"],
+          outputs=["diff"], conditional_inputs={"report_dates": "SP500_POINT_IN_TIME"}),
+]
+
+
+def artifact_path(name):
+    env, default = ARTIFACTS[name]
+    return os.getenv(env, default) if env else default
+
+
+class ContentHasher:
+    """
+    SHA-256 of files and directories, memoized on (path, size, mtime).
+
+    `used` holds the memo entries of the files hashed by this instance; saving
+    only those keeps the memo from growing with every past file version.
+    """
+
+    def __init__(self, memo=None):
+        self.memo = memo if memo is not None else {}
+        self.used = {}
+
+    def file(self, path):
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+        if key not in self.memo:
+            h = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            self.memo[key] = h.hexdigest()
+        self.used[key] = self.memo[key]
+        return self.memo[key]
+
+    def path(self, path):
+        """Hash of a file, or of every file under a directory; None if missing."""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                h.update(os.path.relpath(full, path).encode())
+                h.update(self.file(full).encode())
+        return h.hexdigest()
+
+
+def _load_state():
+    if not os.path.exists(STATE_FILE):
+        return {"stages": {}, "hash_memo": {}}
+    with open(STATE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(state):
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def local_imports(script):
+    """
+    Modules next to `script` that it imports, directly or through each
+    other (any import statement, including ones inside functions).
+
+    Returns:
+        list: Sorted file paths, without the script itself.
+    """
+    found = set()
+    _collect_imports(os.path.abspath(script), found)
+    found.discard(os.path.abspath(script))
+    return sorted(found)
+
+
+def _collect_imports(script, found):
+    base = os.path.dirname(script)
+    with open(script, "rb") as f:
+        tree = ast.parse(f.read(), filename=script)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            path = os.path.join(base, name.split(".")[0] + ".py")
+            if path not in found and os.path.isfile(path):
+                found.add(path)
+                _collect_imports(path, found)
+
+
+def input_fingerprint(stage, hasher):
+    """Hashes of everything a stage depends on, including its code and the local modules it imports."""
+    fp = {"script": hasher.path(stage.script)}
+    for path in local_imports(stage.script):
+        fp["module " + os.path.basename(path)] = hasher.path(path)
+    for name in stage.active_inputs():
+        fp[name] = hasher.path(artifact_path(name))
+    return fp
+
+
+def needs_run(stage, record, fingerprint, force):
+    """Reason to run a stage, or None to skip it."""
+    if stage.name in force:
+        return "forced"
+    if record is None:
+        return "never run"
+    if record["inputs"] != fingerprint:
+        changed = [k for k in fingerprint if record["inputs"].get(k) != fingerprint[k]]
+        return "inputs changed: " + ", ".join(changed)
+    if any(not os.path.exists(artifact_path(o)) for o in stage.outputs):
+        return "output missing"
+    if stage.ttl is not None and time.time() - record["finished_at"] > stage.ttl:
+        return "ttl expired"
+    return None
+
+
+def _run_script(stage, env):
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, stage.script], env=env)
+    return proc.returncode, time.perf_counter() - t0
+
+
+def run_pipeline(stages=STAGES, force=(), workers=4, dry_run=False):
+    """
+    Run out-of-date stages in dependency order, independent ones in parallel.
+
+    Returns:
+        dict: {stage name: (status, seconds)}
+    """
+    state = _load_state()
+    hasher = ContentHasher(state.setdefault("hash_memo", {}))
+    producers = {o: s.name for s in stages for o in s.outputs}
+    deps = {s.name: {producers[i] for i in s.active_inputs() if i in producers} for s in stages}
+    by_name = {s.name: s for s in stages}
+    env = dict(os.environ)
+    for name, (var, _) in ARTIFACTS.items():
+        if var:
+            env[var] = artifact_path(name)
+
+    pending = set(by_name)
+    done, failed = set(), set()
+    summary = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                if deps[name] & failed:
+                    pending.discard(name)
+                    failed.add(name)
+                    summary[name] = ("blocked", 0.0)
+                    continue
+                if not deps[name] <= done:
+                    continue
+                stage = by_name[name]
+                # A stage that prompts on the terminal does not share it
+                if running and (stage.interactive() or any(
+                        by_name[n].interactive() for n, _ in running.values())):
+                    continue
+                pending.discard(name)
+                # Hash inputs only now: upstream stages have finished writing them
+                fingerprint = input_fingerprint(stage, hasher)
+                reason = needs_run(stage, state["stages"].get(name), fingerprint, force)
+                if reason is None or dry_run:
+                    print(f"[{name}] {'would run (' + reason + ')' if reason else 'up to date, skipped'}")
+                    done.add(name)
+                    summary[name] = ("skipped" if reason is None else "planned", 0.0)
+                    continue
+                print(f"[{name}] running ({reason})")
+                running[pool.submit(_run_script, stage, env)] = (name, fingerprint)
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name, fingerprint = running.pop(fut)
+                code, seconds = fut.result()
+                if code == 0:
+                    done.add(name)
+                    state["stages"][name] = {"inputs": fingerprint, "finished_at": time.time(),
+                                             "seconds": seconds}
+                    _save_state(state)
+                    summary[name] = ("ok", seconds)
+                else:
+                    failed.add(name)
+                    summary[name] = (f"failed (exit {code})", seconds)
+                print(f"[{name}] {summary[name][0]} in {seconds:.1f}s")
+
+    # Files not hashed in this run (older versions, removed artifacts) leave the memo
+    state["hash_memo"] = hasher.used
+    _save_state(state)
+    print("\nStage timings:")
+    for stage in stages:
+        status, seconds = summary.get(stage.name, ("not run", 0.0))
+        print(f"  {stage.name:<11} {status:<18} {seconds:8.1f}s")
+    return summary
+
+
+_STUB_STAGE = """
+import os, sys, time
+import {helper}
+started = time.time()
+time.sleep({seconds})
+out = os.environ["{out_var}"]
+with open(out, "w") as f:
+    f.write("{name}")
+with open("runs.log", "a") as f:
+    f.write(f"{name} {{started}} {{time.time()}}\\n")
+"""
+
+
+def _self_check():
+    """
+    Run stub stages in a temp dir: skip on unchanged hashes, re-run after an
+    imported module changes or a TTL expires, run independent stages in
+    parallel and a prompting stage alone, and prune the hash memo.
+    """
+    stages = [
+        Stage("names", "stub_names.py", outputs=["universe"], ttl=DAY),
+        Stage("prices", "stub_prices.py", inputs=["universe"], outputs=["prices"]),
+        Stage("dates", "stub_dates.py", inputs=["universe"], outputs=["report_dates"]),
+        Stage("financials", "stub_financials.py", inputs=["universe"], outputs=["financials"],
+              prompts_for=("SP500_CHECK_UNSET",)),
+    ]
+    scripts = {"names": ("SP500_UNIVERSE_DIR", "stub_helper_a"),
+               "prices": ("SP500_PRICE_STORE", "stub_helper_b"),
+               "dates": ("SP500_REPORT_DATES", "stub_helper_a"),
+               "financials": ("SP500_FINANCIALS", "stub_helper_a")}
+    env_backup = dict(os.environ)
+    cwd = os.getcwd()
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run_pipeline(stages, workers=4)
+        return {name: status for name, (status, _) in summary.items()}
+
+    def runs():
+        with open("runs.log") as f:
+            rows = [line.split() for line in f]
+        return {name: (float(start), float(end)) for name, start, end in rows}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            os.chdir(tmp)
+            for var, _ in ARTIFACTS.values():
+                if var:
+                    os.environ.pop(var, None)
+            os.environ.pop("SP500_CHECK_UNSET", None)
+            # Artifacts are plain files here; the names stage writes the "universe" file
+            for helper in ("stub_helper_a", "stub_helper_b"):
+                with open(helper + ".py", "w") as f:
+                    f.write("VERSION = 1\n")
+            for stage in stages:
+                out_var, helper = scripts[stage.name]
+                with open(stage.script, "w") as f:
+                    f.write(_STUB_STAGE.format(helper=helper, seconds=0.5, out_var=out_var,
+                                               name=stage.name))
+
+            assert set(run().values()) == {"ok"}
+            first = runs()
+            # prices and dates overlap; financials prompts and shares the terminal with none
+            assert first["prices"][0] < first["dates"][1] and first["dates"][0] < first["prices"][1]
+            assert all(first["financials"][0] >= first[n][1] or first["financials"][1] <= first[n][0]
+                       for n in ("names", "prices", "dates"))
+
+            os.remove("runs.log")
+            assert set(run().values()) == {"skipped"} and not os.path.exists("runs.log")
+
+            # A module imported by one stage changes: only that stage re-runs
+            with open("stub_helper_b.py", "w") as f:
+                f.write("VERSION = 2\n")
+            assert run() == {"names": "skipped", "prices": "ok", "dates": "skipped",
+                             "financials": "skipped"}
+
+            # Expired TTL: names re-runs; its output is unchanged, so nothing follows
+            with open(STATE_FILE) as f:
+                state = json.load(f)
+            state["stages"]["names"]["finished_at"] -= 2 * DAY
+            state["hash_memo"]["/gone|1|1"] = "stale"
+            _save_state(state)
+            assert run() == {"names": "ok", "prices": "skipped", "dates": "skipped",
+                             "financials": "skipped"}
+
+            # The memo holds exactly the files hashed in the last run (scripts, modules, inputs)
+            with open(STATE_FILE) as f:
+                memo = json.load(f)["hash_memo"]
+            hashed = {os.path.abspath(p) for p in ["universe", "stub_helper_a.py", "stub_helper_b.py"]
+                      + [s.script for s in stages]}
+            assert {key.split("|")[0] for key in memo} == hashed, sorted(memo)
+            assert len(memo) == len(hashed)
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env_backup)
+    print("Pipeline: skips unchanged stages, re-runs on module edits and TTL expiry, "
+          "runs a prompting stage alone, prunes the hash memo")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--force", nargs="*", default=[], help="stages to re-run regardless of hashes")
+    parser.add_argument("--workers", type=int, default=4, help="stages run in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without running")
+    parser.add_argument("--self-check", action="store_true", help="check the runner on stub stages")
+    args = parser.parse_args()
+    if args.self_check:
+        _self_check()
+        sys.exit(0)
+    summary = run_pipeline(force=set(args.force), workers=args.workers, dry_run=args.dry_run)
+    sys.exit(1 if any(s[0].startswith(("failed", "blocked")) for s in summary.values()) else 0)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Shared adaptive rate limiter and concurrent task runner for the scrapers.
+
+AdaptiveRateLimiter keeps per-host state shared by all worker threads:
+- a request rate (req/s) and an in-flight limit, both AIMD-tuned: additive
+  increase after successes, multiplicative decrease on every 429 or 5xx;
+- a host-wide pause: a 429's Retry-After (seconds or HTTP date) stops every
+  worker for that host, not only the one that got it;
+- per-host stats: request count, 429 count, latency percentiles and the time
+  spent throttled.
+
+run_grid() runs a function over a list of tasks on a bounded thread pool.
+Run this file to exercise both against a local server that answers 429.
+"""
+
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
+def parse_retry_after(value, default):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+        return max(0.0, (retry_time - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+
+def jittered_backoff(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class _HostState:
+    def __init__(self, rate, max_in_flight):
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.next_slot = 0.0
+        self.paused_until = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.latencies = []
+
+
+class AdaptiveRateLimiter:
+    """
+    Args:
+        rate (float): Initial requests per second per host.
+        min_rate / max_rate (float): Bounds for the AIMD rate.
+        max_in_flight (int): Upper bound on concurrent requests per host.
+        increase (float): Additive rate increase per success.
+        decrease (float): Multiplicative factor applied on a 429 or 5xx.
+        default_retry_after (float): Pause when a 429 has no Retry-After.
+    """
+
+    def __init__(self, rate=2.0, min_rate=0.1, max_rate=20.0, max_in_flight=8,
+                 increase=0.1, decrease=0.5, default_retry_after=20.0):
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_in_flight_cap = max_in_flight
+        self.increase = increase
+        self.decrease = decrease
+        self.default_retry_after = default_retry_after
+        self.cond = threading.Condition()
+        self.hosts = defaultdict(lambda: _HostState(self.initial_rate, self.max_in_flight_cap))
+
+    def acquire(self, url):
+        """Block until a request to url's host may start; returns the host key."""
+        host = urlsplit(url).netloc
+        with self.cond:
+            st = self.hosts[host]
+            while True:
+                now = time.monotonic()
+                wait = max(st.paused_until, st.next_slot) - now
+                if st.in_flight < st.max_in_flight and wait <= 0:
+                    st.in_flight += 1
+                    st.next_slot = max(now, st.next_slot) + 1.0 / st.rate
+                    return host
+                self.cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, host, status, latency, retry_after=None):
+        """Record a finished request and adapt the host's rate/concurrency."""
+        with self.cond:
+            st = self.hosts[host]
+            st.in_flight -= 1
+            st.requests += 1
+            st.latencies.append(latency)
+            if status == 429:
+                st.throttled += 1
+                pause = parse_retry_after(retry_after, self.default_retry_after)
+                until = time.monotonic() + pause
+                if until > st.paused_until:
+                    st.throttled_seconds += until - max(st.paused_until, time.monotonic())
+                    st.paused_until = until
+            if status == 429 or status >= 500:
+                # 5xx (overload, dropped connections) backs off without the host pause
+                st.rate = max(self.min_rate, st.rate * self.decrease)
+                st.max_in_flight = max(1, int(st.max_in_flight * self.decrease))
+            else:
+                st.rate = min(self.max_rate, st.rate + self.increase)
+                # Grow concurrency back one slot per ~1/increase successes
+                if st.max_in_flight < self.max_in_flight_cap and random.random() < self.increase:
+                    st.max_in_flight += 1
+            self.cond.notify_all()
+
+    def report(self):
+        """Per-host request latency and throttling stats."""
+        with self.cond:
+            for host, st in self.hosts.items():
+                lat = np.array(st.latencies) * 1000 if st.latencies else np.zeros(1)
+                print(f"{host}: requests={st.requests}, 429s={st.throttled} "
+                      f"({st.throttled / max(st.requests, 1):.1%}), "
+                      f"latency p50={np.percentile(lat, 50):.0f}ms p95={np.percentile(lat, 95):.0f}ms, "
+                      f"throttled {st.throttled_seconds:.1f}s, rate={st.rate:.2f}/s, "
+                      f"in-flight limit={st.max_in_flight}")
+
+
+def limited_get(session, limiter, url, headers=None, max_retries=8, **kwargs):
+    """
+    GET through the limiter, retrying 429s (after the shared pause) and 5xx
+    (with jittered backoff).
+
+    Returns:
+        requests.Response: The last response received.
+    """
+    for attempt in range(max_retries + 1):
+        host = limiter.acquire(url)
+        t0 = time.monotonic()
+        status, retry_after = 599, None
+        try:
+            response = session.get(url, headers=headers, **kwargs)
+            status = response.status_code
+            retry_after = response.headers.get("Retry-After")
+        finally:
+            limiter.release(host, status, time.monotonic() - t0, retry_after)
+        if status == 429 and attempt < max_retries:
+            continue  # acquire() waits out the host-wide pause
+        if status >= 500 and attempt < max_retries:
+            time.sleep(jittered_backoff(attempt))
+            continue
+        return response
+    return response
+
+
+def run_grid(tasks, fn, workers=8):
+    """
+    Run fn(task) for every task on a bounded thread pool.
+
+    Returns:
+        tuple: ({task: result}, {task: error message})
+    """
+    results, failures = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, t): t for t in tasks}
+        for fut in as_completed(futures):
+            task = futures[fut]
+            try:
+                results[task] = fut.result()
+            except Exception as e:
+                failures[task] = f"{type(e).__name__}: {e}"
+    return results, failures
+
+
+if __name__ == "__main__":
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    import requests
+
+    # AIMD: 429 and 5xx halve the rate, successes add `increase`, within bounds
+    aimd = AdaptiveRateLimiter(rate=4.0, min_rate=0.5, max_rate=5.0, max_in_flight=4,
+                               increase=0.5, decrease=0.5, default_retry_after=0)
+    host = aimd.acquire("http://example.test/a")
+    aimd.release(host, 429, 0.01, retry_after="0")
+    assert aimd.hosts[host].rate == 2.0 and aimd.hosts[host].max_in_flight == 2
+    aimd.release(host, 503, 0.01)
+    assert aimd.hosts[host].rate == 1.0 and aimd.hosts[host].paused_until <= time.monotonic()
+    for _ in range(3):
+        aimd.release(host, 500, 0.01)
+    assert aimd.hosts[host].rate == 0.5  # min_rate
+    rates = []
+    for _ in range(20):
+        aimd.release(host, 200, 0.01)
+        rates.append(aimd.hosts[host].rate)
+    assert rates[:3] == [1.0, 1.5, 2.0] and max(rates) == rates[-1] == 5.0
+    assert aimd.hosts[host].max_in_flight <= 4
+    assert aimd.hosts[host].throttled == 1
+    print("AIMD: 429/5xx cut the rate, successes restore it, bounded by min/max_rate")
+
+    # Stand-in server allowing ~20 req/s, answering 429 + Retry-After above that
+    allowed_per_second = 20
+    window = []
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            now = time.monotonic()
+            with lock:
+                window[:] = [t for t in window if now - t < 1.0]
+                over = len(window) >= allowed_per_second
+                if not over:
+                    window.append(now)
+            time.sleep(0.02)
+            if over:
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.end_headers()
+                return
+            body = b"<table class='table'><tr><td>2024</td><td>1</td></tr></table>"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    limiter = AdaptiveRateLimiter(rate=50, max_rate=100, max_in_flight=16, default_retry_after=1)
+    session = requests.Session()
+    grid = [(v, t) for v in ("eps", "market-cap", "shares") for t in range(60)]
+
+    t0 = time.perf_counter()
+    results, failures = run_grid(
+        grid, lambda task: limited_get(session, limiter, f"{base}/{task[0]}/{task[1]}").status_code,
+        workers=16)
+    print(f"{len(grid)} tasks in {time.perf_counter() - t0:.1f}s, "
+          f"ok={sum(s == 200 for s in results.values())}, failures={len(failures)}")
+    limiter.report()
+    st = limiter.hosts[urlsplit(base).netloc]
+    assert not failures and all(s == 200 for s in results.values())
+    assert st.throttled > 0 and st.rate <= limiter.max_rate
+    assert st.requests == len(grid) + st.throttled
+    httpd.shutdown()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Declared schemas (compact dtypes) for the pipeline artifacts, applied at load.
+
+Ticker, Company, Metric, Variable and GICS strings repeat millions of times,
+so they are loaded as categoricals. Prices and features use float32, small
+integers use int16/int32, and dates are parsed to datetime64. Prices that
+feed a computation (quarter metrics, indicators, rolling features) load as
+"price_inputs" instead, which keeps them float64 so the compact dtypes only
+shrink what is stored, never change model inputs. Columns not
+listed in a schema take its `default` dtype, when one is set; otherwise
+pandas infers them.
+
+Each stage can report the memory held by its frames and by the process.
+With a budget (SP500_MEMORY_BUDGET_MB or budget_mb=...), it fails fast with
+MemoryBudgetExceeded before the next step allocates more.
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import psutil
+except ImportError:  # optional: falls back to /proc on Linux
+    psutil = None
+
+Schema = namedtuple("Schema", ["dtypes", "dates", "default"])
+
+SCHEMAS = {
+    # Daily prices (CSV export / Parquet store)
+    "prices": Schema(
+        dtypes={"Company": "category", "Open": "float32", "High": "float32", "Low": "float32",
+                "Close": "float32", "Volume": "float64", "Dividends": "float32",
+                "Stock Splits": "float32"},
+        dates=["Date"], default=None),
+    # Daily prices as computation inputs: categorical tickers, float64 values
+    "price_inputs": Schema(
+        dtypes={"Company": "category", "Open": "float64", "High": "float64", "Low": "float64",
+                "Close": "float64", "Volume": "float64", "Dividends": "float64",
+                "Stock Splits": "float64"},
+        dates=["Date"], default=None),
+    # Long stockanalysis financials; Value stays text (parsed in the merge)
+    "financials": Schema(
+        dtypes={"Unnamed: 0": "int32", "Ticker": "category", "Metric": "category",
+                "Fiscal Quarter": "category", "Period Ending": "category", "Value": "category"},
+        dates=[], default=None),
+    # Universe snapshot
+    "names": Schema(
+        dtypes={"Symbol": "category", "Security": "category", "GICS Sector": "category",
+                "GICS Sub-Industry": "category", "Headquarters Location": "category",
+                "CIK": "int32", "Founded": "category"},
+        dates=["Date added"], default=None),
+    # Merged features (sp500_diff); every other column is a float feature
+    "diff": Schema(
+        dtypes={"Unnamed: 0": "int32", "Ticker": "category", "GICS Sector": "category",
+                "GICS Sub-Industry": "category", "Founded": "int16"},
+        dates=["Date"], default="float32"),
+    # SEC filing dates (sp500_dates)
+    "filings": Schema(
+        dtypes={"Unnamed: 0": "int32", "Form Type": "category", "Ticker": "category"},
+        dates=["Filing Date", "Report Date"], default=None),
+    # Daily rolling features (sp500_rolling); every other column is a float feature
+    "daily": Schema(
+        dtypes={"Ticker": "category"},
+        dates=["Date"], default="float32"),
+}
+
+MEMORY_BUDGET_MB = float(os.getenv("SP500_MEMORY_BUDGET_MB", "0")) or None
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """A stage holds more memory than the configured budget."""
+
+
+def _dtypes_for(columns, schema):
+    dtypes = {}
+    for col in columns:
+        if col in schema.dates:
+            continue
+        dtype = schema.dtypes.get(col, schema.default)
+        if dtype is not None:
+            dtypes[col] = dtype
+    return dtypes
+
+
+def read_artifact(path, artifact, **kwargs):
+    """
+    pd.read_csv with the artifact's schema applied while parsing.
+
+    Args:
+        path (str): CSV path.
+        artifact (str): Key of SCHEMAS.
+        **kwargs: Passed to pd.read_csv.
+    """
+    schema = SCHEMAS[artifact]
+    columns = pd.read_csv(path, nrows=0, **kwargs).columns
+    dates = [c for c in schema.dates if c in columns]
+    return pd.read_csv(path, dtype=_dtypes_for(columns, schema), parse_dates=dates,
+                       date_format="%Y-%m-%d", **kwargs)
+
+
+def apply_schema(df, artifact):
+    """Cast an in-memory frame to the artifact's schema (columns present only)."""
+    schema = SCHEMAS[artifact]
+    casts = {c: t for c, t in _dtypes_for(df.columns, schema).items()
+             if str(df[c].dtype) != t and not (c not in schema.dtypes and df[c].dtype != np.float64)}
+    out = df.astype(casts) if casts else df
+    for col in schema.dates:
+        if col in out.columns and not pd.api.types.is_datetime64_any_dtype(out[col]):
+            out = out.assign(**{col: pd.to_datetime(out[col], errors="coerce")})
+    return out
+
+
+def compact_floats(df, dtype="float32"):
+    """float64 columns -> dtype (float32 by default)."""
+    cols = df.select_dtypes(include=[np.float64]).columns
+    return df.astype({c: dtype for c in cols}) if len(cols) else df
+
+
+def concat_frames(frames):
+    """pd.concat that keeps categorical columns categorical (categories unified)."""
+    frames = list(frames)
+    cat_cols = [c for c in frames[0].columns
+                if all(c in f.columns and isinstance(f[c].dtype, pd.CategoricalDtype) for f in frames)]
+    for col in cat_cols:
+        categories = union_categoricals([f[col] for f in frames], ignore_order=True).categories
+        frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def fill_missing(df, value=0):
+    """DataFrame.fillna(value) that also works on categorical columns (returns a new frame)."""
+    fills, filled = {}, {}
+    for col in df.columns:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            if s.isna().any():
+                if value not in s.cat.categories:
+                    s = s.cat.add_categories([value])
+                filled[col] = s.fillna(value)
+        else:
+            fills[col] = value
+    out = df.assign(**filled) if filled else df
+    return out.fillna(fills)
+
+
+def process_rss():
+    """Resident set size of this process in bytes, or None if unknown."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def report_memory(stage, budget_mb=MEMORY_BUDGET_MB, **frames):
+    """
+    Print the memory of each frame and of the process; enforce the budget.
+
+    The budget is checked against the process RSS when it is known, and
+    against the frames' total otherwise.
+
+    Returns:
+        int: Total bytes held by the frames.
+
+    Raises:
+        MemoryBudgetExceeded: The budget (MB) is exceeded.
+    """
+    sizes = {name: int(f.memory_usage(deep=True).sum()) for name, f in frames.items()}
+    total = sum(sizes.values())
+    rss = process_rss()
+    parts = ", ".join(f"{name} {size / 2**20:.1f} MB" for name, size in sizes.items())
+    print(f"[memory] {stage}: {parts or '-'} | frames {total / 2**20:.1f} MB"
+          + (f", process RSS {rss / 2**20:.1f} MB" if rss is not None else ""))
+    used = rss if rss is not None else total
+    if budget_mb is not None and used > budget_mb * 2**20:
+        raise MemoryBudgetExceeded(
+            f"{stage}: {used / 2**20:.1f} MB exceeds the {budget_mb:.0f} MB budget")
+    return total
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from sp500_wide import synthetic_long, long_to_wide, encode_long
+
+    # Merged-features-like CSV: tickers, dates, sectors and a few hundred float columns
+    wide = long_to_wide(encode_long(synthetic_long(n_tickers=500, n_dates=40, n_vars=300)))
+    wide = wide.fillna(0)
+    wide["GICS Sector"] = np.array(["Industrials", "Health Care", "Utilities"], dtype=object)[
+        np.arange(len(wide)) % 3]
+    wide["GICS Sub-Industry"] = wide["GICS Sector"] + " sub"
+    wide["Founded"] = 1900 + np.arange(len(wide)) % 120
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sp500_diff.csv")
+        wide.to_csv(path)
+        plain = pd.read_csv(path, low_memory=False)
+        typed = read_artifact(path, "diff")
+    before = report_memory("plain read_csv", budget_mb=None, df=plain)
+    after = report_memory("schema read", budget_mb=None, df=typed)
+    print(f"{before / after:.1f}x smaller")
+    assert list(plain.columns) == list(typed.columns)
+    np.testing.assert_allclose(typed.select_dtypes("number").to_numpy(np.float64),
+                               plain[typed.select_dtypes("number").columns].to_numpy(np.float64),
+                               rtol=1e-6)
+    try:
+        report_memory("budget check", budget_mb=after / 2**20 / 2, df=typed)
+    except MemoryBudgetExceeded as e:
+        print("Budget enforced:", e)
+    else:
+        raise AssertionError("report_memory must raise MemoryBudgetExceeded over budget")
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Batch scoring over a snapshot of every ticker's latest feature row.
+
+The snapshot holds the rows at each ticker's latest Date in the merged
+features (sp500_diff). It is built in one groupby pass, persisted as
+Parquet, and updated from new merge output by replacing only the tickers
+whose rows are at least as recent. The CatBoost model is loaded once from
+its native .cbm file, and the snapshot's feature Pool is built once in the
+model's feature order. A request then only slices rows and runs the trees,
+and every request's latency is recorded for p50/p99 reporting.
+
+    python sp500_scoring.py snapshot sp500_diff.csv    # build / update the snapshot
+    python sp500_scoring.py predict AAPL MSFT          # score tickers (all by default)
+    python sp500_scoring.py serve --port 8500          # GET /predict?tickers=AAPL,MSFT,
+                                                       # /latency, /reload
+    python sp500_scoring.py check                      # self-check on synthetic features
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from sp500_schema import apply_schema, concat_frames, read_artifact
+
+try:
+    from catboost import CatBoostRegressor, Pool
+except ImportError:  # only needed to score
+    CatBoostRegressor = Pool = None
+
+SNAPSHOT_PATH = os.getenv("SP500_SNAPSHOT", "sp500_snapshot.parquet")
+MODEL_PATH = os.getenv("SP500_MODEL", "sp500_best_catboost_model.cbm")
+PREDICTION_COLUMN = "Predicted price change pct"
+
+# Columns the models are not trained on
+DROP_COLUMNS = ["Unnamed: 0", "Quarter_pct_diff_1", "Quarter_pct_diff_4",
+                "Fiscal year_pct_diff_1", "Fiscal year_pct_diff_4", "Fiscal year"]
+
+
+def prepare_features(df):
+    """
+    Model inputs from the merged features: infinite pct diffs set to 0,
+    unused columns dropped and Quarter as a categorical feature.
+    """
+    df = df.drop(columns=[c for c in DROP_COLUMNS if c in df.columns])
+    df = df.replace([np.inf, -np.inf], 0)
+    df['Quarter'] = df['Quarter'].astype('int64').astype('category')
+    return df
+
+
+def latest_rows(df, ticker_col="Ticker", date_col="Date"):
+    """
+    Rows at each ticker's latest date, tickers in order of first appearance.
+
+    Args:
+        df (pd.DataFrame): Feature rows of many tickers and dates.
+        ticker_col (str): Column name for ticker identifiers.
+        date_col (str): Column name for date/time variable.
+
+    Returns:
+        pd.DataFrame: The latest rows with a fresh RangeIndex.
+    """
+    latest = df.groupby(ticker_col, sort=False, observed=True)[date_col].transform("max")
+    rows = np.flatnonzero((df[date_col] == latest).to_numpy())
+    codes = pd.factorize(df[ticker_col])[0][rows]
+    rows = rows[np.argsort(codes, kind="stable")]
+    return df.iloc[rows].reset_index(drop=True)
+
+
+def update_snapshot(snapshot, rows, ticker_col="Ticker", date_col="Date"):
+    """
+    Snapshot with `rows` applied: for every ticker, its latest row, and on
+    equal dates the one from `rows`.
+
+    Args:
+        snapshot (pd.DataFrame or None): Current snapshot (one row per ticker).
+        rows (pd.DataFrame): New merge output, all of it or only new rows.
+
+    Returns:
+        tuple: (snapshot, number of tickers with a newer row or new to the snapshot)
+    """
+    if snapshot is None or snapshot.empty:
+        fresh = latest_rows(rows, ticker_col, date_col)
+        return fresh.drop_duplicates(ticker_col, keep="last").reset_index(drop=True), \
+            fresh[ticker_col].nunique()
+    # Only rows at least as recent as the ticker's snapshot row can win
+    current = snapshot.set_index(snapshot[ticker_col].astype(str))[date_col]
+    since = rows[ticker_col].astype(str).map(current).to_numpy(dtype="datetime64[ns]")
+    dates = rows[date_col].to_numpy(dtype="datetime64[ns]")
+    candidates = np.isnat(since) | (dates >= since)
+    if not candidates.any():
+        return snapshot, 0
+    newer = rows[np.isnat(since) | (dates > since)]
+    merged = latest_rows(concat_frames([snapshot, rows[candidates]]), ticker_col, date_col)
+    merged = merged.drop_duplicates(ticker_col, keep="last").reset_index(drop=True)
+    return merged, newer[ticker_col].nunique()
+
+
+def read_features(path):
+    """Merged features from the CSV export or a Parquet copy (e.g. the merge state)."""
+    if path.endswith(".parquet"):
+        return apply_schema(pd.read_parquet(path), "diff")
+    return read_artifact(path, "diff")
+
+
+def load_snapshot(path=SNAPSHOT_PATH, required=False):
+    """
+    Persisted snapshot, or None if there is none yet.
+
+    Raises:
+        FileNotFoundError: No snapshot and `required` (scoring needs one).
+    """
+    if not os.path.exists(path):
+        if required:
+            raise FileNotFoundError(f"No snapshot at {path}; build it first with "
+                                    f"'python sp500_scoring.py snapshot <sp500_diff.csv>'")
+        return None
+    return apply_schema(pd.read_parquet(path), "diff")
+
+
+def save_snapshot(snapshot, path=SNAPSHOT_PATH):
+    tmp_path = path + ".tmp"
+    snapshot.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def load_model(path=MODEL_PATH):
+    """CatBoost model from its native .cbm file (CatBoostRegressor.save_model)."""
+    if CatBoostRegressor is None:
+        raise ImportError("catboost is required for scoring")
+    model = CatBoostRegressor()
+    model.load_model(path, format="cbm")
+    return model
+
+
+class LatencyRecorder:
+    """Wall-clock latency of every request, summarized as percentiles."""
+
+    def __init__(self):
+        self.samples = []
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        if not self.samples:
+            return {"requests": 0}
+        ms = np.asarray(self.samples) * 1000
+        return {"requests": len(ms), "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p99_ms": round(float(np.percentile(ms, 99)), 3),
+                "max_ms": round(float(ms.max()), 3)}
+
+
+class SnapshotScorer:
+    """
+    Predictions for the tickers of a snapshot from a model loaded once.
+
+    Args:
+        model: Fitted CatBoost model (feature_names_ set at fit time).
+        snapshot (pd.DataFrame): Prepared latest rows (prepare_features()).
+    """
+
+    def __init__(self, model, snapshot):
+        self.model = model
+        self.latency = LatencyRecorder()
+        self.set_snapshot(snapshot)
+
+    def set_snapshot(self, snapshot):
+        """Lay out the snapshot's feature matrix once, in the model's feature order."""
+        snapshot = snapshot.reset_index(drop=True)
+        features = snapshot[list(self.model.feature_names_)]
+        cat_features = self.model.get_cat_feature_indices()
+        self.tickers = snapshot["Ticker"].astype(str).to_numpy()
+        self.positions = pd.Index(self.tickers)
+        self.pool = Pool(features, cat_features=cat_features)
+
+    def predict(self, tickers=None):
+        """
+        Predicted price change (in %) of `tickers` (all by default), highest
+        first; unknown tickers are left out.
+        """
+        t0 = time.perf_counter()
+        if tickers is None:
+            rows, data = np.arange(len(self.tickers)), self.pool
+        else:
+            rows = self.positions.get_indexer([str(t) for t in tickers])
+            rows = rows[rows >= 0]
+            data = self.pool.slice(rows)
+        preds = self.model.predict(data) if len(rows) else np.array([])
+        out = pd.DataFrame({"Ticker": self.tickers[rows], PREDICTION_COLUMN: preds * 100}) \
+            .sort_values(by=PREDICTION_COLUMN, ascending=False)
+        self.latency.record(time.perf_counter() - t0)
+        return out
+
+
+async def serve(scorer, host="127.0.0.1", port=8500, snapshot_path=SNAPSHOT_PATH):
+    """
+    Local HTTP endpoint:
+        GET /predict?tickers=AAPL,MSFT  predictions (all tickers without the parameter)
+        GET /latency                    p50/p99 of the requests so far
+        GET /reload                     re-read the snapshot file (model stays loaded)
+    """
+    from aiohttp import web
+
+    async def predict(request):
+        tickers = request.query.get("tickers")
+        out = scorer.predict(tickers.split(",") if tickers else None)
+        return web.json_response({"predictions": out.to_dict(orient="records"),
+                                  "latency": scorer.latency.summary()})
+
+    async def latency(request):
+        return web.json_response(scorer.latency.summary())
+
+    async def reload(request):
+        try:
+            snapshot = load_snapshot(snapshot_path, required=True)
+        except FileNotFoundError as e:
+            return web.json_response({"error": str(e)}, status=404)
+        scorer.set_snapshot(prepare_features(snapshot))
+        return web.json_response({"tickers": len(scorer.tickers)})
+
+    app = web.Application()
+    app.router.add_get("/predict", predict)
+    app.router.add_get("/latency", latency)
+    app.router.add_get("/reload", reload)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving {len(scorer.tickers)} tickers on http://{host}:{port}/predict")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _notebook_latest_rows(df):
+    """The notebooks' former per-ticker mask/concat loop."""
+    predict_df = pd.DataFrame()
+    for ticker in df['Ticker'].unique():
+        ticker_df = df[df['Ticker'] == ticker]
+        max_date = ticker_df['Date'].max()
+        last_row = ticker_df.loc[ticker_df['Date'] == max_date, :].copy()
+        predict_df = pd.concat([predict_df, last_row], ignore_index=True)
+    return predict_df
+
+
+def _synthetic_features(n_tickers=40, n_quarters=12, seed=0):
+    """Interleaved feature rows; tickers end on different quarters."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2022-03-31", periods=n_quarters, freq="QE")
+    rows = []
+    for i in range(n_tickers):
+        for d in dates[:n_quarters - i % 3]:
+            rows.append((f"T{i:03d}", d, d.quarter))
+    df = pd.DataFrame(rows, columns=["Ticker", "Date", "Quarter"])
+    df["Fiscal year"] = df["Date"].dt.year
+    df["Revenue_pct_diff_1"] = rng.normal(size=len(df))
+    df["ClosePrice_pct_diff_4"] = rng.normal(size=len(df))
+    df.loc[df.sample(frac=0.01, random_state=seed).index, "Revenue_pct_diff_1"] = np.inf
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def _self_check():
+    df = _synthetic_features()
+    # A ticker with two rows on its latest date keeps both, as the loop did
+    df = pd.concat([df, df[df["Ticker"] == "T005"].nlargest(1, "Date")], ignore_index=True)
+    pd.testing.assert_frame_equal(latest_rows(df), _notebook_latest_rows(df))
+
+    snapshot, changed = update_snapshot(None, df)
+    assert len(snapshot) == df["Ticker"].nunique() == changed
+    last = snapshot.set_index("Ticker")["Date"]
+    new = pd.DataFrame({
+        "Ticker": ["T001", "T002", "T003", "T999"],
+        "Date": [last["T001"] + pd.offsets.QuarterEnd(), last["T002"] - pd.offsets.QuarterEnd(),
+                 last["T003"], pd.Timestamp("2025-03-31")],
+        "Quarter": 1, "Fiscal year": 2025,
+        "Revenue_pct_diff_1": [1.0, 2.0, 3.0, 4.0], "ClosePrice_pct_diff_4": 0.5,
+    })
+    updated, changed = update_snapshot(snapshot, new)
+    # T001 newer and T999 new count as changed; T003's same-date row replaces
+    # the old one; T002's older row is ignored
+    assert changed == 2 and len(updated) == len(snapshot) + 1
+    by_ticker = updated.set_index("Ticker")
+    assert by_ticker.loc["T001", "Date"] == new.loc[0, "Date"]
+    assert by_ticker.loc["T002", "Revenue_pct_diff_1"] == snapshot.set_index("Ticker").loc[
+        "T002", "Revenue_pct_diff_1"]
+    assert by_ticker.loc["T003", "Revenue_pct_diff_1"] == 3.0
+    rebuilt = update_snapshot(None, pd.concat([df, new], ignore_index=True))[0]
+    pd.testing.assert_frame_equal(updated, rebuilt)
+    unchanged, changed = update_snapshot(updated, new.iloc[[1]])
+    assert unchanged is updated and changed == 0
+    print(f"latest_rows matches the notebook loop; update_snapshot applies only "
+          f"newer-or-equal rows ({len(updated)} tickers)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "snapshot.parquet")
+        assert load_snapshot(path) is None
+        try:
+            load_snapshot(path, required=True)
+        except FileNotFoundError as e:
+            assert path in str(e)
+        else:
+            raise AssertionError("a missing snapshot must raise FileNotFoundError")
+        save_snapshot(updated, path)
+        assert len(load_snapshot(path, required=True)) == len(updated)
+
+    if CatBoostRegressor is None:
+        print("catboost not installed: predict() check skipped")
+        return
+    features = prepare_features(df)
+    selected = ["Quarter", "Revenue_pct_diff_1", "ClosePrice_pct_diff_4"]
+    model = CatBoostRegressor(iterations=20, depth=3, random_seed=0, verbose=False)
+    model.fit(features[selected], np.random.default_rng(1).normal(size=len(features)),
+              cat_features=["Quarter"])
+    prepared = prepare_features(updated)
+    scorer = SnapshotScorer(model, prepared)
+    expected = pd.Series(model.predict(prepared[selected]) * 100,
+                         index=prepared["Ticker"].astype(str))
+    out = scorer.predict(["T001", "NOPE", "T999", "T010"])
+    assert list(out["Ticker"]) == list(expected[["T001", "T999", "T010"]]
+                                      .sort_values(ascending=False).index)
+    np.testing.assert_allclose(out[PREDICTION_COLUMN], expected[out["Ticker"]].to_numpy())
+    assert scorer.predict(["NOPE"]).empty
+    assert len(scorer.predict()) == len(updated)
+    print(f"predict() matches the model on the snapshot rows, unknown tickers left out; "
+          f"{scorer.latency.summary()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--snapshot", default=SNAPSHOT_PATH, help="snapshot Parquet file")
+    parser.add_argument("--model", default=MODEL_PATH, help="CatBoost .cbm model")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("snapshot", help="build or update the snapshot from merge output")
+    p.add_argument("source", help="sp500_diff CSV or Parquet")
+    p = sub.add_parser("predict", help="print predictions")
+    p.add_argument("tickers", nargs="*", help="tickers to score (all by default)")
+    p.add_argument("--repeat", type=int, default=100, help="requests timed for p50/p99")
+    p = sub.add_parser("serve", help="serve predictions over HTTP")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8500)
+    sub.add_parser("check", help="check the snapshot and scorer on synthetic features")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        _self_check()
+    elif args.command == "snapshot":
+        t0 = time.perf_counter()
+        snapshot, changed = update_snapshot(load_snapshot(args.snapshot), read_features(args.source))
+        save_snapshot(snapshot, args.snapshot)
+        print(f"Snapshot: {len(snapshot)} tickers, {changed} with newer rows "
+              f"({time.perf_counter() - t0:.2f}s)")
+    else:
+        snapshot = prepare_features(load_snapshot(args.snapshot, required=True))
+        scorer = SnapshotScorer(load_model(args.model), snapshot)
+        if args.command == "predict":
+            for _ in range(args.repeat):
+                out = scorer.predict(args.tickers or None)
+            print(out.to_string(index=False))
+            print(scorer.latency.summary())
+        else:
+            asyncio.run(serve(scorer, args.host, args.port, args.snapshot))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Async SEC EDGAR submissions fetcher.
+
+One pooled aiohttp client is shared by all requests, and a global token
+bucket keeps the whole run under SEC's fair-access limit of 10 requests per
+second. Every ticker is fetched independently, so a missing CIK or a failed
+request is reported for that ticker only. Filings older than the `recent`
+block are followed through the paginated `filings.files` documents.
+
+With an HttpCache (sp500_http), unchanged submissions are served from disk
+or revalidated with a conditional request instead of re-downloaded.
+
+SEC asks for a descriptive User-Agent with a contact address; set
+SEC_USER_AGENT in the environment. Run this file to check pagination, the
+rate cap, per-ticker failures and the 429 retry against a local stand-in.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+import pandas as pd
+
+SEC_BASE_URL = "https://data.sec.gov"
+SEC_RATE_LIMIT = 10  # requests per second, across all workers
+USER_AGENT = os.getenv("SEC_USER_AGENT", "sp500 research admin@example.com")
+MAX_CONNECTIONS = 10
+MAX_RETRIES = 3
+
+FILING_COLUMNS = ["Form Type", "Filing Date", "Report Date", "Ticker"]
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def _get_json(session, bucket, url, cache=None):
+    """GET a JSON document, retrying 429/5xx with backoff (Retry-After honoured)."""
+    entry = cache.lookup(url) if cache is not None else None
+    if entry is not None and entry["fresh"]:
+        return json.loads(cache.read(entry))
+    conditional = cache.validators(entry) if entry is not None else {}
+
+    for attempt in range(MAX_RETRIES + 1):
+        await bucket.acquire()
+        async with session.get(url, headers=conditional) as response:
+            if response.status == 304 and entry is not None:
+                return json.loads(cache.read(entry, revalidated=True))
+            if response.status == 200:
+                body = await response.read()
+                if cache is not None:
+                    cache.store(url, body, response.headers)
+                return json.loads(body)
+            if response.status in (429, 500, 502, 503, 504) and attempt < MAX_RETRIES:
+                retry_after = response.headers.get("Retry-After", "")
+                await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 2 ** attempt)
+                continue
+            response.raise_for_status()
+    raise RuntimeError(f"Retries exhausted for {url}")
+
+
+def _filings_frame(block, form_type):
+    """Select one form type from a columnar submissions block (recent or a page)."""
+    df = pd.DataFrame({
+        "Form Type": block.get("form", []),
+        "Filing Date": block.get("filingDate", []),
+        "Report Date": block.get("reportDate", [""] * len(block.get("form", []))),
+    })
+    return df[df["Form Type"] == form_type]
+
+
+async def _ticker_filings(session, bucket, base_url, ticker, cik, form_type, count, cache):
+    data = await _get_json(session, bucket, f"{base_url}/submissions/CIK{cik}.json", cache)
+    filings = data.get("filings", {})
+    frames = [_filings_frame(filings.get("recent", {}), form_type)]
+    for page in filings.get("files", []):
+        if count is not None and sum(len(f) for f in frames) >= count:
+            break
+        block = await _get_json(session, bucket, f"{base_url}/submissions/{page['name']}", cache)
+        frames.append(_filings_frame(block, form_type))
+    df = pd.concat(frames, ignore_index=True)
+    if count is not None:
+        df = df.head(count)
+    df["Ticker"] = ticker
+    return df
+
+
+async def fetch_filing_dates(tickers, cik_dict, form_type="10-Q", count=None,
+                             base_url=SEC_BASE_URL, rate=SEC_RATE_LIMIT, cache=None):
+    """
+    Filing dates of `form_type` for all tickers.
+
+    Args:
+        tickers (iterable): Ticker symbols (looked up lower-case in cik_dict).
+        cik_dict (dict): {ticker: 10-digit CIK} from load_cik_mapping().
+        form_type (str): SEC form, e.g. '10-Q'.
+        count (int, optional): Newest filings to keep per ticker; None = all.
+        base_url (str): Submissions host (a local stand-in in tests).
+        rate (float): Global requests per second.
+        cache (HttpCache, optional): On-disk response cache.
+
+    Returns:
+        tuple: (DataFrame with FILING_COLUMNS, {ticker: failure reason})
+    """
+    # capacity=1: no bursts, so no 1-second window ever exceeds `rate`
+    bucket = TokenBucket(rate, capacity=1)
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=60)
+    headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"}
+    failures = {}
+    tickers = list(tickers)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+        async def one(ticker):
+            cik = cik_dict.get(ticker.lower())
+            if not cik:
+                failures[ticker] = "CIK not found"
+                return None
+            try:
+                return await _ticker_filings(session, bucket, base_url, ticker, cik,
+                                             form_type, count, cache)
+            except Exception as e:
+                failures[ticker] = f"{type(e).__name__}: {e}"
+                return None
+
+        results = await asyncio.gather(*(one(t) for t in tickers))
+
+    frames = [r for r in results if r is not None]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=FILING_COLUMNS)
+    return df[FILING_COLUMNS], failures
+
+
+async def _serve_stand_in(n_tickers, pages_per_ticker, throttle=(), missing=()):
+    """
+    Local SEC stand-in: recent block plus paginated history per CIK. Each
+    document in `throttle` answers 429 with Retry-After: 1 once; documents in
+    `missing` answer 404.
+    """
+    from aiohttp import web
+
+    hits = []
+    throttled = set()
+
+    def block(start):
+        days = pd.date_range("2000-01-01", periods=40, freq="45D") + pd.Timedelta(days=start)
+        return {"form": ["10-Q", "8-K"] * 20,
+                "filingDate": [d.strftime("%Y-%m-%d") for d in days],
+                "reportDate": [d.strftime("%Y-%m-%d") for d in days]}
+
+    async def handler(request):
+        name = request.match_info["name"]
+        hits.append((time.monotonic(), name))
+        if name in throttle and name not in throttled:
+            throttled.add(name)
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if name in missing:
+            return web.Response(status=404)
+        if "-submissions-" in name:
+            return web.json_response(block(int(name[-8:-5]) * 2000))
+        files = [{"name": f"{name[:-5]}-submissions-{i:03d}.json"} for i in range(1, pages_per_ticker + 1)]
+        return web.json_response({"filings": {"recent": block(0), "files": files}})
+
+    app = web.Application()
+    app.router.add_get("/submissions/{name}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}", hits
+
+
+async def _demo():
+    n_tickers, pages = 15, 2
+    throttled_page = "CIK0000000003-submissions-002.json"
+    runner, base_url, hits = await _serve_stand_in(
+        n_tickers, pages, throttle={throttled_page}, missing={"CIK0000000007.json"})
+    cik_dict = {f"t{i}": f"{i:010d}" for i in range(n_tickers)}
+    tickers = [f"T{i}" for i in range(n_tickers)] + ["NOCIK"]
+    t0 = time.perf_counter()
+    df, failures = await fetch_filing_dates(tickers, cik_dict, base_url=base_url)
+    elapsed = time.perf_counter() - t0
+
+    # Failures stay with their ticker: no CIK, and a 404 on one submissions file
+    assert set(failures) == {"NOCIK", "T7"}, failures
+    assert failures["NOCIK"] == "CIK not found"
+    assert failures["T7"].startswith("ClientResponseError"), failures["T7"]
+    # Every other ticker followed both pages: 20 10-Qs in recent and in each page
+    per_ticker = df.groupby("Ticker").size()
+    assert set(per_ticker.index) == {f"T{i}" for i in range(n_tickers)} - {"T7"}
+    assert (per_ticker == 20 * (1 + pages)).all(), per_ticker
+    assert (df["Form Type"] == "10-Q").all()
+    page_hits = [name for _, name in hits if "-submissions-" in name]
+    assert len(page_hits) == (n_tickers - 1) * pages + 1  # + the 429 retry
+    # The 429 was retried once, after its Retry-After
+    retry = [t for t, name in hits if name == throttled_page]
+    assert len(retry) == 2 and retry[1] - retry[0] >= 1.0, retry
+    # No 1-second window holds more than SEC_RATE_LIMIT requests
+    times = [t for t, _ in hits]
+    peak = max(sum(1 for h in times if s <= h < s + 1) for s in times)
+    assert peak <= SEC_RATE_LIMIT, peak
+
+    # count= stops before the pages once the recent block holds enough
+    hits.clear()
+    head, head_failures = await fetch_filing_dates(["T1"], cik_dict, count=15, base_url=base_url)
+    assert len(head) == 15 and not head_failures
+    assert [name for _, name in hits] == ["CIK0000000001.json"]
+    await runner.cleanup()
+    print(f"{len(df)} filings for {len(per_ticker)} tickers, {len(times)} requests "
+          f"in {elapsed:.1f}s (peak {peak} req/s), failures: {failures}")
+
+
+if __name__ == "__main__":
+    asyncio.run(_demo())
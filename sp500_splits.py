@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Per-ticker time-series cross-validation splitters for the prediction notebooks.
+
+Every split is computed from two vectors: each row's position within its
+ticker (group cumcount) and its ticker's row count (group size). A split is
+then one boolean mask over the rows in ticker order, with no Python loop
+over tickers. Index arrays are memoized by a fingerprint of the Ticker
+column and the splitter's parameters, so the repeated split() calls from
+BayesSearchCV / ShapRFECV on the same data are served from the cache.
+Cached arrays are read-only.
+
+- SinglePointTimeSeriesSplitByTicker: forward-expanding, one test row per
+  ticker and split (positions N-k ... N-1), as the notebooks used so far.
+- MultiPointTimeSeriesSplitByTicker: `test_size` consecutive test rows per
+  ticker and split, with `purge` rows dropped before the test block.
+- PurgedKFoldByTicker: contiguous per-ticker blocks; training rows on both
+  sides of the test block, minus `purge` rows before it and `embargo` rows
+  after it.
+
+All splitters take X with a 'Ticker' column, sorted by time within each
+ticker. Run this file to check the single-point splitter against the former
+notebook class and to time both.
+"""
+
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Memoized splits: (splitter, parameters, fingerprint) -> [(train, test), ...]
+SPLIT_CACHE_SIZE = 32
+_split_cache = OrderedDict()
+
+
+def _fingerprint(tickers):
+    """Content hash of the Ticker column (values and order)."""
+    hashed = pd.util.hash_pandas_object(pd.Series(tickers), index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+
+def _ticker_layout(tickers):
+    """
+    Rows grouped by ticker (first-appearance order, row order within a
+    ticker), with each row's cumcount and group size in that order.
+    """
+    codes = pd.factorize(tickers)[0]
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes)
+    starts = np.cumsum(sizes) - sizes
+    size = np.repeat(sizes, sizes)
+    pos = np.arange(len(codes)) - np.repeat(starts, sizes)
+    return order, pos, size
+
+
+class _TickerSplit(ABC):
+    """Input checks, memoization and the scikit-learn splitter interface."""
+
+    def __init__(self, n_splits=3):
+        if n_splits < 1:
+            raise ValueError(f"n_splits must be >= 1, got {n_splits}")
+        self.n_splits = n_splits
+
+    def _params(self):
+        return (self.n_splits,)
+
+    @abstractmethod
+    def _masks(self, pos, size):
+        """Yield (train mask, test mask) over the rows in ticker order."""
+
+    def split(self, X, y=None, groups=None):
+        if not isinstance(X, pd.DataFrame):
+            raise ValueError(
+                "X must be a pandas DataFrame with 'Ticker' column")
+        if 'Ticker' not in X.columns:
+            raise ValueError("DataFrame must have a 'Ticker' column")
+
+        # IMPORTANT: X must be sorted by time within each ticker BEFORE calling split.
+        tickers = X['Ticker'].to_numpy()
+        key = (type(self).__name__, self._params(), _fingerprint(tickers))
+        splits = _split_cache.get(key)
+        if splits is None:
+            order, pos, size = _ticker_layout(tickers)
+            splits = []
+            for train, test in self._masks(pos, size):
+                if test.any():
+                    pair = (order[train], order[test])
+                    for idx in pair:
+                        idx.flags.writeable = False
+                    splits.append(pair)
+            _split_cache[key] = splits
+            while len(_split_cache) > SPLIT_CACHE_SIZE:
+                _split_cache.popitem(last=False)
+        else:
+            _split_cache.move_to_end(key)
+        yield from splits
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.n_splits
+
+
+class MultiPointTimeSeriesSplitByTicker(_TickerSplit):
+    """
+    Forward-expanding, `test_size` test rows per split (per ticker).
+    For each ticker with N rows, split i (0-based) of k tests positions
+    N-(k-i)*m ... N-(k-i-1)*m-1 and trains on the positions before them,
+    except the last `purge` (rows whose labels overlap the test period).
+    Tickers with N <= k*m + purge rows are left out.
+    """
+
+    def __init__(self, n_splits=3, test_size=1, purge=0):
+        super().__init__(n_splits)
+        if test_size < 1 or purge < 0:
+            raise ValueError(f"test_size must be >= 1 and purge >= 0, got {test_size}, {purge}")
+        self.test_size = test_size
+        self.purge = purge
+
+    def _params(self):
+        return (self.n_splits, self.test_size, self.purge)
+
+    def _masks(self, pos, size):
+        k, m = self.n_splits, self.test_size
+        eligible = size > k * m + self.purge
+        for i in range(k):
+            test_start = size - (k - i) * m
+            test = eligible & (pos >= test_start) & (pos < test_start + m)
+            train = eligible & (pos < test_start - self.purge)
+            yield train, test
+
+
+class SinglePointTimeSeriesSplitByTicker(MultiPointTimeSeriesSplitByTicker):
+    """
+    Forward-expanding, single-point test per split (per ticker).
+    For each ticker with N rows and n_splits = k, the test positions are:
+    N-k, N-k+1, ..., N-1  (0-based within that ticker).
+    """
+
+    def __init__(self, n_splits=3, purge=0):
+        super().__init__(n_splits, test_size=1, purge=purge)
+
+
+class PurgedKFoldByTicker(_TickerSplit):
+    """
+    K contiguous blocks per ticker; split i tests block i and trains on the
+    other blocks, without the `purge` rows before the test block (labels
+    overlapping it) and the `embargo` rows after it (serial correlation).
+    Tickers with fewer than k rows are left out.
+    """
+
+    def __init__(self, n_splits=3, purge=0, embargo=0):
+        super().__init__(n_splits)
+        if purge < 0 or embargo < 0:
+            raise ValueError(f"purge and embargo must be >= 0, got {purge}, {embargo}")
+        self.purge = purge
+        self.embargo = embargo
+
+    def _params(self):
+        return (self.n_splits, self.purge, self.embargo)
+
+    def _masks(self, pos, size):
+        k = self.n_splits
+        eligible = size >= k
+        for i in range(k):
+            test_start = (i * size + k - 1) // k
+            test_end = ((i + 1) * size + k - 1) // k
+            test = eligible & (pos >= test_start) & (pos < test_end)
+            train = eligible & ((pos < test_start - self.purge) | (pos >= test_end + self.embargo))
+            yield train, test
+
+
+class _NotebookSplit:
+    """The notebooks' former splitter (per-ticker loop), kept for the self-check."""
+
+    def __init__(self, n_splits=3):
+        self.n_splits = n_splits
+
+    def split(self, X, y=None, groups=None):
+        tickers = X['Ticker'].to_numpy()
+        unique_tickers = pd.unique(tickers)
+        ticker_to_pos = {t: np.where(tickers == t)[0] for t in unique_tickers}
+        for i in range(self.n_splits):
+            train_idx, test_idx = [], []
+            for t, pos in ticker_to_pos.items():
+                n = len(pos)
+                if n <= self.n_splits:
+                    continue
+                test_pos_in_ticker = n - self.n_splits + i
+                test_idx.append(pos[test_pos_in_ticker])
+                train_idx.extend(pos[:test_pos_in_ticker])
+            if test_idx:
+                yield np.array(train_idx), np.array(test_idx)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 120, 500)
+    tickers = np.repeat([f"T{i:03d}" for i in range(500)], lengths)
+    X = pd.DataFrame({"Ticker": tickers, "x": rng.random(len(tickers))})
+    # Interleaved tickers too: positions follow row order within each ticker
+    shuffled = X.sample(frac=1, random_state=0).reset_index(drop=True)
+    shuffled["Ticker"] = shuffled["Ticker"].astype("category")
+
+    for frame in (X, shuffled, X.head(30)):
+        for k in (1, 4, 8):
+            expected = list(_NotebookSplit(k).split(frame))
+            got = list(SinglePointTimeSeriesSplitByTicker(k).split(frame))
+            assert len(got) == len(expected)
+            for (tr, te), (etr, ete) in zip(got, expected):
+                np.testing.assert_array_equal(tr, etr)
+                np.testing.assert_array_equal(te, ete)
+    print("SinglePointTimeSeriesSplitByTicker matches the notebook splitter")
+
+    for train, test in MultiPointTimeSeriesSplitByTicker(4, test_size=2, purge=1).split(X):
+        t_tr, t_te = X["Ticker"].to_numpy()[train], X["Ticker"].to_numpy()[test]
+        assert len(test) == 2 * len(np.unique(t_te)) and np.isin(t_tr, t_te).all()
+    for train, test in PurgedKFoldByTicker(5, purge=2, embargo=3).split(X):
+        assert not np.intersect1d(train, test).size
+    try:
+        _TickerSplit(3)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("_TickerSplit without _masks must not be instantiable")
+    print("Multi-point and purged k-fold splits are disjoint")
+
+    n_calls = 50
+    t0 = time.perf_counter()
+    for _ in range(n_calls):
+        list(_NotebookSplit(8).split(X))
+    t1 = time.perf_counter()
+    _split_cache.clear()
+    list(SinglePointTimeSeriesSplitByTicker(8).split(X))
+    t2 = time.perf_counter()
+    for _ in range(n_calls - 1):
+        list(SinglePointTimeSeriesSplitByTicker(8).split(X))
+    t3 = time.perf_counter()
+    print(f"{len(X):,} rows, 500 tickers, 8 splits x {n_calls} calls: notebook loop "
+          f"{(t1 - t0) / n_calls * 1000:.1f} ms/call | vectorized first call "
+          f"{(t2 - t1) * 1000:.1f} ms | cached {(t3 - t2) / (n_calls - 1) * 1000:.2f} ms/call")
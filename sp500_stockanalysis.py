@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Browserless fetch backend for stockanalysis.com quarterly financial tables.
+
+After logging in once with Selenium, the session cookies are copied into a
+pooled requests.Session and every page is fetched over plain HTTP with
+`?p=quarterly`, so there is no "Quarters" click and no fixed sleep. The table
+is parsed straight from the response; callers fall back to the browser when
+the request fails or the table is missing.
+
+FixtureServer serves saved pages from memory on localhost so the backend can
+be exercised offline; run this file to do so.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sp500_tables import read_table
+
+BASE_URL = "https://stockanalysis.com"
+POOL_SIZE = 8
+
+
+class TableNotFound(Exception):
+    """The page was fetched but has no #main-table (e.g. login wall, bad ticker)."""
+
+
+def make_session(cookies=(), user_agent=None, pool_size=POOL_SIZE):
+    """
+    Pooled HTTP session with retries on transient errors.
+
+    Args:
+        cookies (iterable): Selenium-style cookie dicts (name, value, domain, path).
+        user_agent (str, optional): User-Agent to send (use the browser's).
+        pool_size (int): Connections kept alive per host.
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if user_agent:
+        session.headers["User-Agent"] = user_agent
+    for c in cookies:
+        session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path", "/"))
+    return session
+
+
+def session_from_driver(driver, pool_size=POOL_SIZE):
+    """Reuse an authenticated Selenium session (cookies + User-Agent) over HTTP."""
+    user_agent = driver.execute_script("return navigator.userAgent;")
+    return make_session(driver.get_cookies(), user_agent=user_agent, pool_size=pool_size)
+
+
+def quarterly_url(ticker, report, base_url=BASE_URL):
+    path = f"/stocks/{ticker.lower()}/financials/"
+    if report:
+        path += f"{report}/"
+    return f"{base_url}{path}?p=quarterly"
+
+
+def parse_main_table(html):
+    """Parse #main-table into a DataFrame indexed by metric name."""
+    try:
+        ticker_df = read_table(html, id="main-table")
+    except ValueError as e:
+        raise TableNotFound(str(e)) from e
+    ticker_df.set_index(ticker_df.columns[0], inplace=True)
+    return ticker_df
+
+
+def fetch_quarterly_table(session, ticker, report, base_url=BASE_URL, timeout=20):
+    """
+    Fetch and parse one quarterly financial table.
+
+    Raises:
+        requests.HTTPError: Non-2xx response after retries.
+        TableNotFound: The page has no #main-table.
+    """
+    response = session.get(quarterly_url(ticker, report, base_url), timeout=timeout)
+    response.raise_for_status()
+    return parse_main_table(response.text)
+
+
+def table_to_long(ticker_df, ticker):
+    """Stack the (Fiscal Quarter, Period Ending) columns into long rows."""
+    long = ticker_df.stack(level=[0, 1], future_stack=True).reset_index(name="Value")
+    long.columns = ["Metric", "Fiscal Quarter", "Period Ending", "Value"]
+    long = long[long["Value"] != "Upgrade"]
+    long["Ticker"] = ticker
+    return long
+
+
+class FixtureServer:
+    """
+    Local stand-in for stockanalysis.com.
+
+    Args:
+        pages (dict): {url path (with query): html}.
+        require_cookie (str, optional): Cookie name that must be sent, to
+            check that browser cookies are reused; otherwise 401.
+    """
+
+    def __init__(self, pages, require_cookie=None):
+        self.pages = pages
+        self.require_cookie = require_cookie
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                cookie = self.headers.get("Cookie", "")
+                if server.require_cookie and f"{server.require_cookie}=" not in cookie:
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+                body = server.pages.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                data = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def fixture_table_html(metrics, quarters):
+    """Minimal #main-table page in stockanalysis' two-row header layout."""
+    head1 = "".join(f"<th>{q}</th>" for q, _ in quarters)
+    head2 = "".join(f"<th>{p}</th>" for _, p in quarters)
+    rows = "".join(
+        f"<tr><td>{m}</td>" + "".join(f"<td>{v}</td>" for v in values) + "</tr>"
+        for m, values in metrics.items())
+    return ("<html><body><table id='main-table'><thead>"
+            f"<tr><th>Fiscal Quarter</th>{head1}</tr>"
+            f"<tr><th>Period Ending</th>{head2}</tr>"
+            f"</thead><tbody>{rows}</tbody></table></body></html>")
+
+
+if __name__ == "__main__":
+    quarters = [("Q3 2025", "Sep 27, 2025"), ("Q2 2025", "Jun 28, 2025")]
+    html = fixture_table_html(
+        {"Revenue": ["102,466", "94,036"], "EPS (Diluted)": ["1.85", "Upgrade"]}, quarters)
+    pages = {"/stocks/aapl/financials/?p=quarterly": html}
+    with FixtureServer(pages, require_cookie="session") as srv:
+        session = make_session([{"name": "session", "value": "x", "domain": "127.0.0.1"}])
+        table = fetch_quarterly_table(session, "AAPL", "", srv.base_url)
+        assert table.shape == (2, 2)
+        assert list(table.index) == ["Revenue", "EPS (Diluted)"]
+        assert list(table.columns) == quarters
+        # Numeric columns are typed as pd.read_html does; "Upgrade" keeps Q2 as text
+        assert table.loc["Revenue", quarters[0]] == 102466.0
+        assert table.loc["Revenue", quarters[1]] == "94036"
+
+        long = table_to_long(table, "AAPL")
+        assert list(long.columns) == ["Metric", "Fiscal Quarter", "Period Ending", "Value", "Ticker"]
+        assert long[["Metric", "Fiscal Quarter", "Period Ending"]].values.tolist() == [
+            ["Revenue", "Q3 2025", "Sep 27, 2025"], ["Revenue", "Q2 2025", "Jun 28, 2025"],
+            ["EPS (Diluted)", "Q3 2025", "Sep 27, 2025"]]
+        assert long["Value"].astype(float).tolist() == [102466.0, 94036.0, 1.85]
+        assert (long["Ticker"] == "AAPL").all()
+        assert srv.requests == ["/stocks/aapl/financials/?p=quarterly"]
+
+        for sess, report, status in ((session, "ratios", 404), (make_session(), "", 401)):
+            try:
+                fetch_quarterly_table(sess, "AAPL", report, srv.base_url)
+                raise AssertionError("expected an HTTP error")
+            except requests.HTTPError as e:
+                assert e.response.status_code == status
+        try:
+            parse_main_table("<html><body><table id='other'></table></body></html>")
+            raise AssertionError("expected TableNotFound")
+        except TableNotFound:
+            pass
+    print("Quarterly table fetched over HTTP with the browser cookie and parsed to long rows; "
+          "missing page -> 404, no cookie -> 401, no #main-table -> TableNotFound")
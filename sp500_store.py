@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Ticker-partitioned Parquet store for daily prices.
+
+Layout: <store_dir>/Company=<TICKER>/part-*.parquet (hive partitioning), one
+small columnar file per ticker instead of one giant CSV. Reads are
+memory-mapped and project only the requested columns and tickers, so the
+merge never parses dates/floats from text.
+
+Convert an existing CSV once with:
+    python sp500_store.py sp500_prices_04012026.csv sp500_prices
+"""
+
+import os
+import sys
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+PRICE_COLUMNS = ["Date", "Open", "High", "Low", "Close", "Volume",
+                 "Dividends", "Stock Splits", "Company"]
+
+PARTITIONING = ds.partitioning(pa.schema([("Company", pa.string())]), flavor="hive")
+
+
+def _to_table(df):
+    """Normalize a price frame to the store schema (naive dates, float prices)."""
+    df = df.copy()
+    if "Date" not in df.columns and "index" in df.columns:
+        df.rename(columns={"index": "Date"}, inplace=True)
+    dates = pd.to_datetime(df["Date"].astype(str).str[:10], errors="coerce") \
+        if df["Date"].dtype == object else pd.to_datetime(df["Date"])
+    if getattr(dates.dt, "tz", None) is not None:
+        dates = dates.dt.tz_localize(None)
+    df["Date"] = dates.dt.normalize().astype("datetime64[ns]")
+    df["Company"] = df["Company"].astype(str)
+    cols = [c for c in PRICE_COLUMNS if c in df.columns]
+    for c in cols:
+        if c not in ("Date", "Company"):
+            df[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+    return pa.Table.from_pandas(df[cols], preserve_index=False)
+
+
+def write_prices(df, store_dir, basename="part-{i}.parquet"):
+    """
+    Write a price frame into the store, replacing the partitions of the
+    tickers present in `df` and leaving all other tickers untouched.
+
+    Args:
+        df (pd.DataFrame): Daily prices with at least 'Date' and 'Company'.
+        store_dir (str): Root directory of the store.
+        basename (str): File name template inside each ticker partition.
+    """
+    ds.write_dataset(
+        _to_table(df), store_dir, format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=basename,
+        existing_data_behavior="delete_matching",
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+
+
+def append_prices(df, store_dir):
+    """
+    Add new rows to the store without touching existing files: each call
+    writes one extra Parquet file into every affected ticker partition.
+    """
+    ds.write_dataset(
+        _to_table(df), store_dir, format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{uuid.uuid4().hex[:12]}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+    )
+
+
+def compact_prices(store_dir, tickers=None):
+    """Rewrite ticker partitions that accumulated appended files into one file each."""
+    df = read_prices(store_dir, tickers=tickers)
+    if not df.empty:
+        write_prices(df, store_dir)
+
+
+def _dataset(store_dir):
+    fs = pafs.LocalFileSystem(use_mmap=True)
+    return ds.dataset(os.path.abspath(store_dir), format="parquet",
+                      partitioning=PARTITIONING, filesystem=fs)
+
+
+def read_prices(store_dir, tickers=None, columns=None, dates=None):
+    """
+    Load prices from the store.
+
+    Args:
+        store_dir (str): Root directory of the store.
+        tickers (list, optional): Only these tickers (partition pruning).
+        columns (list, optional): Only these columns (column projection).
+        dates (iterable, optional): Only the rows on these days (row filter,
+            pushed down to the Parquet scan).
+
+    Returns:
+        pd.DataFrame: Prices sorted by 'Company' and 'Date'.
+    """
+    dataset = _dataset(store_dir)
+    filt = ds.field("Company").isin(list(tickers)) if tickers is not None else None
+    if dates is not None:
+        days = pa.array(pd.to_datetime(list(dates)).to_numpy(dtype="datetime64[ns]"))
+        on_days = ds.field("Date").isin(days)
+        filt = on_days if filt is None else filt & on_days
+    table = dataset.to_table(columns=columns, filter=filt)
+    df = table.to_pandas()
+    sort_cols = [c for c in ("Company", "Date") if c in df.columns]
+    if sort_cols:
+        df.sort_values(sort_cols, inplace=True, kind="mergesort")
+        df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def last_dates(store_dir):
+    """
+    Last stored Date per ticker, read from Parquet footer statistics so no
+    price data is scanned.
+
+    Returns:
+        dict: {ticker: pd.Timestamp}; empty if the store does not exist yet.
+    """
+    if not os.path.isdir(store_dir):
+        return {}
+    out = {}
+    for frag in _dataset(store_dir).get_fragments():
+        ticker = ds.get_partition_keys(frag.partition_expression).get("Company")
+        meta = frag.metadata
+        col = meta.schema.names.index("Date")
+        for rg in range(meta.num_row_groups):
+            stats = meta.row_group(rg).column(col).statistics
+            if stats is None or not stats.has_min_max:
+                # No statistics: fall back to reading this fragment's dates
+                top = frag.to_table(columns=["Date"]).column("Date").to_pandas().max()
+            else:
+                top = pd.Timestamp(stats.max)
+            if pd.notna(top) and (ticker not in out or top > out[ticker]):
+                out[ticker] = top
+    return out
+
+
+def partition_files(store_dir):
+    """
+    Files of every ticker partition with their size and mtime, from a
+    directory listing only (no Parquet footers are read).
+
+    Returns:
+        dict: {ticker: [(file name, size, mtime_ns), ...]}; empty if the store
+        does not exist yet.
+    """
+    if not os.path.isdir(store_dir):
+        return {}
+    out = {}
+    for frag in _dataset(store_dir).get_fragments():
+        ticker = ds.get_partition_keys(frag.partition_expression).get("Company")
+        st = os.stat(frag.path)
+        out.setdefault(ticker, []).append((os.path.basename(frag.path), st.st_size, st.st_mtime_ns))
+    return {ticker: sorted(files) for ticker, files in out.items()}
+
+
+def csv_to_store(csv_path, store_dir):
+    """Convert a legacy sp500_prices_*.csv into the partitioned store."""
+    df = pd.read_csv(csv_path, index_col=0, low_memory=False)
+    write_prices(df, store_dir)
+    return len(df)
+
+
+if __name__ == "__main__":
+    n = csv_to_store(sys.argv[1], sys.argv[2])
+    print(f"Stored {n} rows from {sys.argv[1]} in {sys.argv[2]}")
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTML table extraction for the scrapers.
+
+Pages are parsed once with lxml's C HTML parser (plain etree elements), and tables are located with
+compiled XPath selectors, cached per (id, class). Rows are walked directly,
+so there is no BeautifulSoup pass, no re-serialization to a string and no
+second parse inside pd.read_html. Cells are read column by column, and
+numeric-looking columns are converted in one vectorized step. The result is
+a typed frame, with a MultiIndex header when the table has several header
+rows, and it matches what pd.read_html returns for the same table.
+
+    read_table(html, id="constituents")           # Wikipedia
+    read_table(html, id="main-table")             # stockanalysis
+    read_tables(html, css_class="table")          # macrotrends history pages
+    grid_cells(html)                              # rendered jqxGrid div cells
+
+Run this file for the benchmark against the previous BeautifulSoup /
+read_html paths on saved-page fixtures.
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from lxml import etree
+
+_ROWS = etree.XPath("./thead/tr | ./tbody/tr | ./tfoot/tr | ./tr")
+_CELLS = etree.XPath("./td | ./th")
+_TEXT = etree.XPath("string()", smart_strings=False)
+_PARSER = etree.HTMLParser()
+_GRID_ROWS = etree.XPath("//div[@role='row'][@id]")
+_GRID_CELLS = etree.XPath(".//div[@role='gridcell']")
+_LEFT_RE = re.compile(r"left:\s*(\d+)px")
+# read_html drops thousands separators from any value made only of these characters
+_NUMBER_CHARS_RE = re.compile(r"[-^0-9,.]+")
+_DECIMAL_RE = re.compile(r"[.eE]")
+
+# Same tokens pd.read_html treats as missing
+NA_VALUES = frozenset(["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+                       "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+                       "n/a", "nan", "null"])
+
+
+@lru_cache(maxsize=None)
+def table_selector(id=None, css_class=None):
+    """Compiled XPath matching <table> elements by id and/or class token."""
+    conditions = []
+    if id is not None:
+        conditions.append(f"@id='{id}'")
+    if css_class is not None:
+        conditions.append(f"contains(concat(' ', normalize-space(@class), ' '), ' {css_class} ')")
+    predicate = f"[{' and '.join(conditions)}]" if conditions else ""
+    return etree.XPath(f"//table{predicate}")
+
+
+def parse_html(html):
+    """lxml document for an HTML string; pass it to several extractions to parse only once."""
+    return etree.fromstring(html, _PARSER)
+
+
+def _cell_text(cell):
+    return " ".join(_TEXT(cell).split())
+
+
+def _expand_rows(rows):
+    """Cell texts per row with colspan/rowspan repeated, as pd.read_html does."""
+    out, carry = [], {}
+    for tr in rows:
+        texts, col = [], 0
+        for cell in _CELLS(tr):
+            while col in carry:
+                text, left = carry[col]
+                texts.append(text)
+                carry[col] = (text, left - 1) if left > 1 else None
+                if carry[col] is None:
+                    del carry[col]
+                col += 1
+            text = _cell_text(cell)
+            colspan = int(cell.get("colspan", 1) or 1)
+            rowspan = int(cell.get("rowspan", 1) or 1)
+            for _ in range(colspan):
+                if rowspan > 1:
+                    carry[col] = (text, rowspan - 1)
+                texts.append(text)
+                col += 1
+        while col in carry:
+            text, left = carry[col]
+            texts.append(text)
+            if left > 1:
+                carry[col] = (text, left - 1)
+            else:
+                del carry[col]
+            col += 1
+        out.append(texts)
+    return out
+
+
+def _typed_columns(cells):
+    """
+    Column arrays for a (rows x columns) object array of cell texts.
+
+    All cells are cleaned in one flat pass and converted in one vectorized
+    call; a column becomes int64 / float64 when every non-missing value is
+    numeric, and keeps its (thousands-stripped) strings otherwise.
+    """
+    shape = cells.shape
+    text = np.array([np.nan if v in NA_VALUES
+                     else v.replace(",", "") if _NUMBER_CHARS_RE.fullmatch(v) else v
+                     for v in cells.ravel().tolist()], dtype=object)
+    missing = pd.isna(text)
+    numeric = pd.to_numeric(text, errors="coerce").astype("float64")
+    decimal = np.fromiter((isinstance(v, str) and _DECIMAL_RE.search(v) is not None for v in text),
+                          dtype=bool, count=text.size)
+
+    text, missing = text.reshape(shape), missing.reshape(shape)
+    numeric, decimal = numeric.reshape(shape), decimal.reshape(shape)
+    is_numeric = ~(~missing & np.isnan(numeric)).any(axis=0) & ~missing.all(axis=0)
+    is_int = is_numeric & ~missing.any(axis=0) & ~decimal.any(axis=0)
+
+    columns = []
+    for j in range(shape[1]):
+        if is_int[j]:
+            columns.append(numeric[:, j].astype("int64"))
+        elif is_numeric[j]:
+            columns.append(numeric[:, j])
+        else:
+            columns.append(text[:, j])
+    return columns
+
+
+def _dedupe(names):
+    """'x', 'x' -> 'x', 'x.1' like read_html's duplicate header handling."""
+    seen, out = {}, []
+    for name in names:
+        n = seen.get(name, 0)
+        out.append(f"{name}.{n}" if n else name)
+        seen[name] = n + 1
+    return out
+
+
+def table_frame(table, typed=True):
+    """
+    DataFrame from an lxml <table> element.
+
+    Header rows are the <thead> rows, or, without a <thead>, the leading rows
+    made only of <th> cells.
+    """
+    rows = _ROWS(table)
+    is_head = [tr.getparent().tag == "thead" for tr in rows]
+    if not any(is_head):
+        for i, tr in enumerate(rows):
+            cells = _CELLS(tr)
+            if not cells or any(c.tag != "th" for c in cells):
+                break
+            is_head[i] = True
+    texts = _expand_rows(rows)
+    header = [t for t, h in zip(texts, is_head) if h]
+    body = [t for t, h in zip(texts, is_head) if not h]
+
+    width = max((len(t) for t in texts), default=0)
+    body = [t + [""] * (width - len(t)) for t in body]
+    header = [t + [""] * (width - len(t)) for t in header]
+    if len(header) > 1:
+        columns = pd.MultiIndex.from_arrays(header)
+    elif header:
+        columns = pd.Index(_dedupe(header[0]))
+    else:
+        columns = pd.RangeIndex(width)
+
+    cells = np.empty((len(body), width), dtype=object)
+    if body:
+        cells[:] = body
+    data = _typed_columns(cells) if typed and cells.size else list(cells.T)
+    df = pd.DataFrame(dict(enumerate(data)), index=pd.RangeIndex(len(body)))
+    df.columns = columns
+    return df
+
+
+def read_tables(html, id=None, css_class=None, typed=True):
+    """
+    All matching tables as DataFrames, in document order.
+
+    Args:
+        html (str or lxml element): Page source, or a document from parse_html().
+        id (str, optional): Table id attribute.
+        css_class (str, optional): One class token of the table.
+        typed (bool): Convert numeric columns (pd.read_html semantics).
+
+    Raises:
+        ValueError: No table matches (same as pd.read_html).
+    """
+    doc = parse_html(html) if isinstance(html, str) else html
+    tables = table_selector(id, css_class)(doc)
+    if not tables:
+        raise ValueError(f"No tables found matching id={id!r} class={css_class!r}")
+    return [table_frame(t, typed=typed) for t in tables]
+
+
+def read_table(html, id=None, css_class=None, index=0, typed=True):
+    """The index-th matching table (see read_tables)."""
+    return read_tables(html, id=id, css_class=css_class, typed=typed)[index]
+
+
+def grid_cells(html, additional_offset=0):
+    """
+    Cells of a rendered div grid (jqxGrid): {row id: {left offset: text}}.
+
+    Offsets come from each cell's inline `left: Npx` style, shifted by
+    additional_offset (the grid's horizontal scroll) to make them absolute.
+    """
+    doc = parse_html(html) if isinstance(html, str) else html
+    data = {}
+    for row in _GRID_ROWS(doc):
+        cells = data.setdefault(row.get("id"), {})
+        for cell in _GRID_CELLS(row):
+            m = _LEFT_RE.search(cell.get("style", ""))
+            cells[(int(m.group(1)) if m else 0) + additional_offset] = _TEXT(cell).strip()
+    return data
+
+
+# -------------------------------
+# Saved-page fixtures and benchmark
+# -------------------------------
+def fixture_wikipedia_page(n_rows=503):
+    """Wikipedia constituents page: the target table among layout and change-log tables."""
+    sectors = ["Industrials", "Health Care", "Information Technology", "Utilities"]
+    rows = "".join(
+        f"<tr><td><a href='/q/T{i}'>T{i}</a></td><td>Company {i}, Inc.</td><td>{sectors[i % 4]}</td>"
+        f"<td>Sub {i % 37}</td><td>City {i % 91}, State</td><td>{1957 + i % 60}-03-04</td>"
+        f"<td>{1000 + i * 17:010d}</td><td>{1850 + i % 170}{' (1832)' if i % 50 == 0 else ''}</td></tr>"
+        for i in range(n_rows))
+    changes = "".join(f"<tr><td>2024-0{1 + i % 9}-01</td><td>A{i}</td><td>B{i}</td></tr>"
+                      for i in range(400))
+    nav = "<table class='nav'><tr><td>" + "<a href='#'>x</a>" * 200 + "</td></tr></table>"
+    return ("<html><body>" + nav + "<table class='wikitable sortable' id='constituents'><thead><tr>"
+            "<th>Symbol</th><th>Security</th><th>GICS Sector</th><th>GICS Sub-Industry</th>"
+            "<th>Headquarters Location</th><th>Date added</th><th>CIK</th><th>Founded</th>"
+            f"</tr></thead><tbody>{rows}</tbody></table>"
+            "<table class='wikitable' id='changes'><thead><tr><th>Date</th><th>Added</th>"
+            f"<th>Removed</th></tr></thead><tbody>{changes}</tbody></table></body></html>")
+
+
+def fixture_macrotrends_page(n_quarters=64):
+    """macrotrends history page: annual and quarterly `table` tables with a spanning title header."""
+    def table(title, n):
+        rows = "".join(f"<tr><td style='text-align:center'>{2025 - i // 4}-{('12', '09', '06', '03')[i % 4]}-30</td>"
+                       f"<td style='text-align:center'>${(i * 0.37) % 9:.2f}</td></tr>" for i in range(n))
+        return (f"<table class='historical_data_table table'><thead><tr><th colspan='2'>{title}</th></tr>"
+                f"</thead><tbody>{rows}</tbody></table>")
+    return ("<html><body>" + table("Annual EPS", n_quarters // 4)
+            + table("Quarterly EPS", n_quarters) + "</body></html>")
+
+
+def fixture_grid_html(n_rows=40, n_cols=12, width=120):
+    """Rendered jqxGrid segment: div rows/cells positioned by inline left offsets."""
+    rows = "".join(
+        f"<div role='row' id='row{r}jqxgrid'>" + "".join(
+            f"<div role='gridcell' style='left: {c * width}px; width: {width}px;'>"
+            f"<div>${r * 10 + c:,}.00</div></div>" for c in range(n_cols)) + "</div>"
+        for r in range(n_rows))
+    return f"<div id='contenttablejqxgrid'>{rows}</div>"
+
+
+def _bench(fn, repeat):
+    import time
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return result, best
+
+
+if __name__ == "__main__":
+    from io import StringIO
+
+    from bs4 import BeautifulSoup
+
+    from sp500_stockanalysis import fixture_table_html
+
+    def old_wikipedia(html):
+        soup = BeautifulSoup(html, "html.parser")
+        return pd.read_html(StringIO(str(soup.find("table", {"id": "constituents"}))))[0]
+
+    def old_macrotrends(html):
+        soup = BeautifulSoup(html, "html.parser")
+        return pd.read_html(StringIO(str(soup.find_all("table", {"class": "table"}))))[1]
+
+    def old_grid(html):
+        soup = BeautifulSoup(html, "html.parser")
+        data = {}
+        for row in soup.find_all("div", {"role": "row"}):
+            data.setdefault(row.get("id"), {})
+            for cell in row.find_all("div", {"role": "gridcell"}):
+                m = re.search(r"left:\s*(\d+)px", cell.get("style", ""))
+                data[row.get("id")][int(m.group(1)) if m else 0] = cell.get_text(strip=True)
+        return data
+
+    quarters = [(f"Q{4 - i % 4} {2025 - i // 4}", f"Dec {i + 1}, {2025 - i // 4}") for i in range(40)]
+    metrics = {f"Metric {m}": [f"{(m + 1) * (q + 3) * 1013:,}" for q in range(40)] for m in range(60)}
+    metrics["EPS (Diluted)"] = ["1.85", "Upgrade"] * 20
+
+    cases = [
+        ("wikipedia", fixture_wikipedia_page(), old_wikipedia,
+         lambda h: read_table(h, id="constituents")),
+        ("stockanalysis", fixture_table_html(metrics, quarters),
+         lambda h: pd.read_html(StringIO(h), attrs={"id": "main-table"})[0],
+         lambda h: read_table(h, id="main-table")),
+        ("macrotrends", fixture_macrotrends_page(), old_macrotrends,
+         lambda h: read_tables(h, css_class="table")[1]),
+    ]
+    for name, html, old, new in cases:
+        expected, t_old = _bench(lambda: old(html), 5)
+        got, t_new = _bench(lambda: new(html), 5)
+        pd.testing.assert_frame_equal(got, expected)
+        print(f"{name:<14} {len(html) / 1024:7.0f} KB  old {t_old * 1000:7.1f} ms  "
+              f"new {t_new * 1000:6.1f} ms  ({t_old / t_new:4.1f}x)")
+
+    grid = fixture_grid_html()
+    expected, t_old = _bench(lambda: old_grid(grid), 5)
+    got, t_new = _bench(lambda: grid_cells(grid), 5)
+    assert got == expected
+    print(f"{'jqxgrid cells':<14} {len(grid) / 1024:7.0f} KB  old {t_old * 1000:7.1f} ms  "
+          f"new {t_new * 1000:6.1f} ms  ({t_old / t_new:4.1f}x)")
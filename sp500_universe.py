@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+S&P 500 universe (constituents) loader shared by every pipeline stage.
+
+Stages read the newest local snapshot (a small CSV) and never touch the
+network. A refresh (sp500_names.py, or load_universe(refresh=True)) fetches
+the Wikipedia page through the HTTP cache, parses only the #constituents
+table (sp500_tables), and writes a new versioned snapshot
+`sp500_universe_<YYYYMMDD>_<hash8>.csv` when the content actually changed.
+
+Symbol variants used by the consumers:
+    "wiki"  BRK.B  stockanalysis.com, names/merge metadata
+    "dash"  BRK-B  Yahoo Finance, SEC ticker.txt, macrotrends financials
+    "dot"   BRK.B  macrotrends chart pages
+"""
+
+import glob
+import hashlib
+import os
+from datetime import datetime
+import pandas as pd
+
+from sp500_tables import read_table
+
+UNIVERSE_DIR = os.getenv("SP500_UNIVERSE_DIR", "universe")
+WIKI_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+WIKI_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36"
+}
+
+
+def _snapshots(snapshot_dir):
+    return sorted(glob.glob(os.path.join(snapshot_dir, "sp500_universe_*.csv")))
+
+
+def parse_constituents(html):
+    """Parse only the #constituents table of the Wikipedia page."""
+    sp500 = read_table(html, id="constituents")
+    sp500["Symbol"] = sp500["Symbol"].astype(str).str.strip().str.upper()
+    return sp500
+
+
+def refresh_universe(snapshot_dir=UNIVERSE_DIR, session=None):
+    """
+    Fetch the constituents and store a new snapshot if they changed.
+
+    Returns:
+        tuple: (DataFrame, snapshot path)
+    """
+    from sp500_http import CachedSession
+
+    session = session or CachedSession()
+    response = session.get(WIKI_URL, headers=WIKI_HEADERS)
+    response.raise_for_status()
+    sp500 = parse_constituents(response.text)
+
+    csv_bytes = sp500.to_csv(index=False).encode("utf-8")
+    digest = hashlib.sha256(csv_bytes).hexdigest()[:8]
+    existing = _snapshots(snapshot_dir)
+    if existing and existing[-1].endswith(f"_{digest}.csv"):
+        return sp500, existing[-1]
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = os.path.join(snapshot_dir,
+                        f"sp500_universe_{datetime.now().strftime('%Y%m%d')}_{digest}.csv")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(csv_bytes)
+    os.replace(tmp_path, path)
+    return sp500, path
+
+
+def load_universe(snapshot_dir=UNIVERSE_DIR, refresh=False):
+    """
+    Newest constituents snapshot; fetches one only if none exists or refresh=True.
+
+    Returns:
+        pd.DataFrame: Wikipedia constituents columns with upper-case 'Symbol'.
+    """
+    existing = _snapshots(snapshot_dir)
+    if refresh or not existing:
+        return refresh_universe(snapshot_dir)[0]
+    return pd.read_csv(existing[-1])
+
+
+def symbols(universe, style="wiki"):
+    """
+    Ticker list in the variant a consumer expects.
+
+    Args:
+        universe (pd.DataFrame): Output of load_universe().
+        style (str): 'wiki' (BRK.B), 'dash' (BRK-B) or 'dot' (BRK.B from BRK-B).
+    """
+    s = universe["Symbol"].astype(str).str.upper()
+    if style == "dash":
+        s = s.str.replace(".", "-", regex=False)
+    elif style == "dot":
+        s = s.str.replace("-", ".", regex=False)
+    elif style != "wiki":
+        raise ValueError(f"Unknown symbol style: {style}")
+    return s.tolist()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Integer-coded long table and direct long -> wide build for the merge.
+
+The merge used to concatenate financials and price metrics as string
+Ticker/Date/Variable/Value columns, then sort and deduplicate on those
+strings and reshape with pivot_table(aggfunc='first'). Here the long table
+stores Ticker and Variable as categoricals, Date as datetime64 and Value as
+float. The wide matrix is built by computing one int64 cell key per row,
+keeping the last row per key, and scattering the values straight into a
+preallocated (rows x variables) array. No string sort and no groupby are
+involved.
+
+Run this file for the equivalence check against pivot_table and the
+peak-memory regression check.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+LONG_COLUMNS = ["Ticker", "Date", "Variable", "Value"]
+
+
+def encode_long(df, ticker="Ticker", date="Date", variable="Variable", value="Value"):
+    """
+    Coded long table from a long frame with numeric values.
+
+    Rows with a missing ticker or variable, or a date that does not parse,
+    are dropped (pivot_table dropped them too, or they never matched price
+    metrics).
+
+    Returns:
+        pd.DataFrame: LONG_COLUMNS with categorical Ticker/Variable,
+        day-normalized datetime64 Date and float Value.
+    """
+    dates = pd.to_datetime(df[date], errors="coerce")
+    keep = (dates.notna() & df[ticker].notna() & df[variable].notna()).to_numpy()
+    values = pd.to_numeric(df[value], errors="coerce").to_numpy()[keep]
+    return pd.DataFrame({
+        "Ticker": pd.Categorical(df[ticker].to_numpy()[keep]),
+        "Date": dates[keep].dt.normalize().to_numpy(),
+        "Variable": pd.Categorical(df[variable].to_numpy()[keep]),
+        "Value": values.astype(np.result_type(values.dtype, np.float32)),
+    })
+
+
+def encode_wide(df, id_vars=("Ticker", "Date")):
+    """
+    Coded long table straight from a wide numeric frame, in df.melt() row
+    order, without building string Variable/Value columns first.
+    """
+    ticker, date = id_vars
+    value_cols = [c for c in df.columns if c not in id_vars]
+    dates = pd.to_datetime(df[date], errors="coerce")
+    keep = dates.notna().to_numpy()
+    n, k = int(keep.sum()), len(value_cols)
+    tickers = pd.Categorical(df[ticker].to_numpy()[keep])
+    values = df[value_cols].to_numpy(dtype=np.float64)[keep]
+    return pd.DataFrame({
+        "Ticker": pd.Categorical.from_codes(np.tile(tickers.codes, k), categories=tickers.categories),
+        "Date": np.tile(dates[keep].dt.normalize().to_numpy(), k),
+        "Variable": pd.Categorical.from_codes(np.repeat(np.arange(k), n), categories=value_cols),
+        "Value": values.ravel(order="F"),
+    })
+
+
+def concat_long(frames):
+    """Concatenate coded long tables, unifying (and sorting) the categories."""
+    frames = [f for f in frames if len(f)]
+    return pd.DataFrame({
+        "Ticker": union_categoricals([f["Ticker"] for f in frames], sort_categories=True),
+        "Date": np.concatenate([f["Date"].to_numpy() for f in frames]),
+        "Variable": union_categoricals([f["Variable"] for f in frames], sort_categories=True),
+        "Value": np.concatenate([f["Value"].to_numpy() for f in frames]),
+    })
+
+
+def long_to_wide(long, date_format="%Y-%m-%d"):
+    """
+    Wide (Ticker, Date) x Variable frame from a coded long table.
+
+    Same result as sorting, dropping duplicate (Ticker, Date, Variable) keys
+    with keep='last' and pivot_table(aggfunc='first'): rows sorted by Ticker
+    then Date, columns sorted by name, and rows/columns that would hold only
+    NaN left out. Later rows win over earlier ones for the same key.
+
+    Args:
+        long (pd.DataFrame): Output of encode_long() / concat_long().
+        date_format (str, optional): Format of the Date column; None keeps datetime64.
+    """
+    tickers = long["Ticker"].cat
+    variables = long["Variable"].cat
+    date_codes, date_values = pd.factorize(long["Date"], sort=True)
+    n_dates = max(len(date_values), 1)
+    n_vars = max(len(variables.categories), 1)
+
+    key = tickers.codes.to_numpy(np.int64) * n_dates
+    key += date_codes
+    key *= n_vars
+    key += variables.codes.to_numpy(np.int64)
+    del date_codes
+
+    # Stable sort keeps rows of equal keys in input order: the last one wins
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    last = np.append(key[1:] != key[:-1], True)
+    values = long["Value"].to_numpy()[order[last]]
+    del order
+    key = key[last]
+    present = ~np.isnan(values)
+    key, values = key[present], values[present]
+
+    # Keys are sorted, so row keys are too: rows start where the row key changes
+    row_of_cell = key // n_vars
+    starts = np.append(True, row_of_cell[1:] != row_of_cell[:-1])
+    row_keys = row_of_cell[starts]
+    row_idx = np.cumsum(starts) - 1
+    del row_of_cell, starts
+    col_of_cell = key % n_vars
+    used = np.zeros(n_vars, dtype=bool)
+    used[col_of_cell] = True
+    col_codes = np.flatnonzero(used)
+    col_idx = (np.cumsum(used) - 1)[col_of_cell]
+    del key, col_of_cell
+
+    matrix = np.full((len(row_keys), len(col_codes)), np.nan, dtype=values.dtype)
+    matrix[row_idx, col_idx] = values
+
+    columns = pd.Index(np.asarray(variables.categories)[col_codes], name="Variable")
+    wide = pd.DataFrame(matrix, columns=columns, copy=False)
+    dates = pd.DatetimeIndex(date_values)
+    date_labels = np.asarray(dates.strftime(date_format), dtype=object) if date_format else dates
+    wide.insert(0, "Date", date_labels[row_keys % n_dates])
+    wide.insert(0, "Ticker", np.asarray(tickers.categories, dtype=object)[row_keys // n_dates])
+    return wide
+
+
+def synthetic_long(n_tickers=300, n_dates=40, n_vars=150, seed=0):
+    """String-typed long frame shaped like the merge input (with duplicates and gaps)."""
+    rng = np.random.default_rng(seed)
+    n = n_tickers * n_dates * n_vars
+    t = np.repeat(np.arange(n_tickers), n_dates * n_vars)
+    d = np.tile(np.repeat(np.arange(n_dates), n_vars), n_tickers)
+    v = np.tile(np.arange(n_vars), n_tickers * n_dates)
+    keep = rng.random(n) > 0.15
+    dup = rng.random(n) < 0.02
+    idx = np.concatenate([np.flatnonzero(keep), np.flatnonzero(dup)])
+    values = rng.normal(size=len(idx))
+    values[rng.random(len(idx)) < 0.01] = np.nan
+    dates = pd.date_range("2010-03-31", periods=n_dates, freq="QE")
+    return pd.DataFrame({
+        "Ticker": np.array([f"T{i:04d}" for i in range(n_tickers)], dtype=object)[t[idx]],
+        "Date": dates[d[idx]],
+        "Variable": np.array([f"Metric {i:03d}" for i in range(n_vars)], dtype=object)[v[idx]],
+        "Value": values,
+    })
+
+
+def _pivot_reference(long_df):
+    """Previous merge path: string sort/dedupe + pivot_table."""
+    merged = (long_df.sort_values(["Ticker", "Date", "Variable"], kind="mergesort")
+              .drop_duplicates(["Ticker", "Date", "Variable"], keep="last"))
+    merged["Date"] = merged["Date"].astype("str").str[:10]
+    wide = merged.pivot_table(index=["Ticker", "Date"], columns="Variable", values="Value",
+                              observed=True, aggfunc="first")
+    return wide.reset_index()
+
+
+def _peak(fn):
+    import tracemalloc
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+if __name__ == "__main__":
+    import time
+
+    long_df = synthetic_long()
+    print(f"{len(long_df):,} long rows")
+
+    t0 = time.perf_counter()
+    expected, peak_old = _peak(lambda: _pivot_reference(long_df))
+    t_old = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    coded, peak_encode = _peak(lambda: encode_long(long_df))
+    got, peak_wide = _peak(lambda: long_to_wide(coded))
+    t_new = time.perf_counter() - t0
+
+    pd.testing.assert_frame_equal(got, expected, check_names=False)
+    coded_bytes = coded.memory_usage(deep=True).sum()
+    wide_bytes = got.memory_usage(deep=False).sum()
+    print(f"pivot_table: {t_old:6.2f}s, peak {peak_old / 2**20:7.1f} MB")
+    print(f"direct:      {t_new:6.2f}s, peak {max(peak_encode, peak_wide) / 2**20:7.1f} MB "
+          f"(encode {peak_encode / 2**20:.1f} MB, wide build {peak_wide / 2**20:.1f} MB; "
+          f"coded long {coded_bytes / 2**20:.1f} MB, result {wide_bytes / 2**20:.1f} MB)")
+
+    # Peak-memory regression guards: the wide build needs only a few int64
+    # per long row on top of the result, and the whole path stays well below pivot_table
+    assert peak_wide < 2 * coded_bytes + 2 * wide_bytes, peak_wide
+    assert max(peak_encode, peak_wide) < peak_old * 2 / 3, (peak_encode, peak_wide, peak_old)
+    print("OK")